@@ -0,0 +1,104 @@
+"""
+Generates a deterministic synthetic image corpus of mixed sizes and formats for benchmarking.
+
+    python -m benchmarks.corpus ./benchmarks/corpus --count 50
+
+Images are plate-like compositions (a background, a plate and a few coloured blobs with
+noise), so they compress like photos rather than flat colours. They exercise decoding,
+resizing and payload optimization realistically; whether the detector classifies them as
+food depends on the model, so benchmarks can also be run on a directory of real photos.
+"""
+import argparse
+import io
+import json
+import random
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+# (width, height) mix from thumbnails up to 12 MP phone photos.
+SIZES: List[Tuple[int, int]] = [(320, 240), (640, 480), (1024, 768), (1280, 960), (1920, 1080), (3024, 4032), (4032, 3024)]
+FORMATS = ["JPEG", "JPEG", "JPEG", "PNG", "WEBP"] # Weighted towards JPEG, like real uploads
+EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+
+def generate_image(rng: random.Random, size: Tuple[int, int]) -> Image.Image:
+    width, height = size
+    background = tuple(rng.randint(120, 230) for _ in range(3))
+    img = Image.new("RGB", size, background)
+    draw = ImageDraw.Draw(img)
+    radius = int(min(width, height) * rng.uniform(0.35, 0.45))
+    cx, cy = width // 2, height // 2
+    draw.ellipse((cx - radius, cy - radius, cx + radius, cy + radius), fill=(245, 245, 240))
+    for _ in range(rng.randint(2, 5)):
+        r = int(radius * rng.uniform(0.2, 0.45))
+        x = cx + int(rng.uniform(-0.5, 0.5) * radius)
+        y = cy + int(rng.uniform(-0.5, 0.5) * radius)
+        color = (rng.randint(90, 230), rng.randint(40, 200), rng.randint(0, 120))
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+    img = img.filter(ImageFilter.GaussianBlur(radius=max(1, min(width, height) // 200)))
+    noise = np.random.default_rng(rng.randint(0, 2**32 - 1)).normal(0, 12, (height, width, 3))
+    return Image.fromarray(np.clip(np.asarray(img, dtype=np.float32) + noise, 0, 255).astype(np.uint8))
+
+
+def encode(img: Image.Image, image_format: str, quality: int = 90) -> bytes:
+    buffer = io.BytesIO()
+    if image_format == "JPEG":
+        img.save(buffer, format="JPEG", quality=quality)
+    elif image_format == "WEBP":
+        img.save(buffer, format="WEBP", quality=85)
+    else:
+        img.save(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def generate_corpus(output_dir: Path, count: int = 50, seed: int = 0,
+                    max_bytes: Optional[int] = None) -> List[Dict]:
+    """
+    Writes `count` images to `output_dir` plus a manifest.json describing them.
+
+    Args:
+        output_dir: Directory to write to; created if missing.
+        count: Number of images.
+        seed: Random seed; the same seed always produces the same corpus.
+        max_bytes: If set, images larger than this (e.g. big PNGs over the upload limit)
+                   are re-encoded as lower-quality JPEG so every image is a valid upload.
+    """
+    rng = random.Random(seed)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest = []
+    for i in range(count):
+        size = rng.choice(SIZES)
+        image_format = rng.choice(FORMATS)
+        img = generate_image(rng, size)
+        data = encode(img, image_format)
+        quality = 90
+        while max_bytes and len(data) > max_bytes and quality > 30:
+            # Oversized PNG/WebP become JPEG, then JPEG quality steps down until it fits.
+            image_format = "JPEG"
+            quality -= 10
+            data = encode(img, image_format, quality)
+        filename = f"synthetic_{i:04d}{EXTENSIONS[image_format]}"
+        (output_dir / filename).write_bytes(data)
+        manifest.append({"filename": filename, "format": image_format, "width": size[0],
+                         "height": size[1], "bytes": len(data)})
+    (output_dir / "manifest.json").write_text(json.dumps({"seed": seed, "images": manifest}, indent=2))
+    return manifest
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic benchmark image corpus.")
+    parser.add_argument("output_dir", type=Path)
+    parser.add_argument("--count", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-mb", type=float, default=5.0, help="Keep images under the upload limit.")
+    args = parser.parse_args(argv)
+    manifest = generate_corpus(args.output_dir, args.count, args.seed, int(args.max_mb * 1024 * 1024))
+    total = sum(entry["bytes"] for entry in manifest)
+    print(f"Wrote {len(manifest)} images ({total / (1024 * 1024):.1f} MB) to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
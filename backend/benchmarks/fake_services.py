@@ -0,0 +1,324 @@
+"""
+Local stand-ins for the Groq chat completions API and the USDA FoodData Central search API,
+so the backend can be load-tested without spending API quota.
+
+Point the backend at them with:
+
+    GROQ_API_BASE=http://127.0.0.1:8901    (read by langchain_groq)
+    USDA_API_BASE=http://127.0.0.1:8902/fdc/v1
+
+Run standalone with `python -m benchmarks.fake_services`, or let run_benchmark start them.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_ITEMS = ["grilled chicken", "white rice", "steamed broccoli"]
+
+# Extra nutrients padding each USDA result, so responses are about as large as real ones.
+_FILLER_NUTRIENTS = [
+    "Water", "Ash", "Fiber, total dietary", "Sugars, total including NLEA", "Calcium, Ca", "Iron, Fe",
+    "Magnesium, Mg", "Phosphorus, P", "Potassium, K", "Sodium, Na", "Zinc, Zn", "Copper, Cu",
+    "Selenium, Se", "Vitamin C, total ascorbic acid", "Thiamin", "Riboflavin", "Niacin",
+    "Vitamin B-6", "Folate, total", "Vitamin B-12", "Vitamin A, RAE", "Vitamin E (alpha-tocopherol)",
+    "Vitamin D (D2 + D3)", "Vitamin K (phylloquinone)", "Fatty acids, total saturated",
+    "Fatty acids, total monounsaturated", "Fatty acids, total polyunsaturated", "Cholesterol",
+]
+
+
+def _estimate_tokens(value: Any) -> int:
+    # Roughly four characters per token, which is close enough for load testing.
+    return max(1, len(json.dumps(value)) // 4)
+
+
+def _query_seed(query: str) -> int:
+    return int(hashlib.sha256(query.lower().encode("utf-8")).hexdigest()[:8], 16)
+
+
+class FakeGroq:
+    def __init__(self, latency_ms: float = 300.0, jitter_ms: float = 50.0, tokens_per_second: float = 0.0,
+                 items: Optional[List[str]] = None, error_rate: float = 0.0, image_tokens: int = 1600,
+                 requests_per_minute: int = 0):
+        """
+        An OpenAI-compatible chat completions endpoint that answers like the Groq models do.
+
+        Requests containing an image get a canned VLM answer. Requests with tools get one
+        tool call per food item on the first turn, and a total nutritional facts summary once
+        the tool results are in, so the LangChain agent runs its full loop.
+
+        Args:
+            latency_ms: Time to first token.
+            jitter_ms: Uniform random jitter added to the latency.
+            tokens_per_second: Generation speed for the completion; 0 returns it instantly.
+            items: Food items the fake VLM reports.
+            error_rate: Fraction of requests answered with HTTP 500.
+            image_tokens: Prompt tokens billed per image, in place of the base64 data.
+            requests_per_minute: Rate limit over a sliding minute; requests over it get a
+                                 429 with `retry-after`, like Groq. 0 disables it.
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_second = tokens_per_second
+        self.items = items or DEFAULT_ITEMS
+        self.error_rate = error_rate
+        self.image_tokens = image_tokens
+        self.requests_per_minute = requests_per_minute
+        self.requests = 0
+        self.rate_limited = 0
+        self._accepted_at: deque = deque()
+
+    def _vlm_reply(self) -> str:
+        return (
+            f"Food Item: {', '.join(self.items)}\n"
+            f"Calories: {150 * len(self.items)} kcal\n"
+            f"Protein: {12 * len(self.items)} g\n"
+            f"Carbohydrates: {20 * len(self.items)} g\n"
+            f"Fat: {5 * len(self.items)} g"
+        )
+
+    @staticmethod
+    def _agent_summary() -> str:
+        return ("**Total Nutritional Facts**:\n- **Calories**: 450 kcal\n- **Protein**: 36 g\n"
+                "- **Carbohydrates**: 60 g\n- **Fat**: 15 g")
+
+    def _reply(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        messages = body.get("messages", [])
+        has_image = any(
+            isinstance(message.get("content"), list)
+            and any(part.get("type") == "image_url" for part in message["content"])
+            for message in messages
+        )
+        tools = body.get("tools") or []
+        if has_image or not tools:
+            return {"content": self._vlm_reply()}
+        if messages and messages[-1].get("role") == "tool":
+            return {"content": self._agent_summary()}
+        tool_name = tools[0].get("function", {}).get("name", "Nutrition_Analyzer")
+        return {"tool_calls": [
+            {
+                "id": f"call_{uuid.uuid4().hex[:12]}",
+                "type": "function",
+                "function": {"name": tool_name, "arguments": json.dumps({"__arg1": item})},
+            }
+            for item in self.items
+        ]}
+
+    def _prompt_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        tokens = 0
+        for message in messages:
+            content = message.get("content")
+            if isinstance(content, list):
+                for part in content:
+                    tokens += self.image_tokens if part.get("type") == "image_url" else _estimate_tokens(part)
+            else:
+                tokens += _estimate_tokens(message)
+        return tokens
+
+    async def _delay(self, completion_tokens: int):
+        latency = self.latency_ms + random.uniform(0, self.jitter_ms)
+        await asyncio.sleep(latency / 1000.0)
+        if self.tokens_per_second:
+            await asyncio.sleep(completion_tokens / self.tokens_per_second)
+
+    def _rate_limit(self) -> Optional[JSONResponse]:
+        if not self.requests_per_minute:
+            return None
+        now = time.monotonic()
+        while self._accepted_at and now - self._accepted_at[0] >= 60:
+            self._accepted_at.popleft()
+        if len(self._accepted_at) >= self.requests_per_minute:
+            self.rate_limited += 1
+            retry_after = math.ceil(60 - (now - self._accepted_at[0]))
+            return JSONResponse(
+                status_code=429,
+                headers={"retry-after": str(retry_after)},
+                content={"error": {"message": "Rate limit reached for requests", "type": "requests",
+                                   "code": "rate_limit_exceeded"}},
+            )
+        self._accepted_at.append(now)
+        return None
+
+    async def chat_completions(self, request: Request):
+        self.requests += 1
+        body = await request.json()
+        rate_limited = self._rate_limit()
+        if rate_limited is not None:
+            return rate_limited
+        if self.error_rate and random.random() < self.error_rate:
+            await asyncio.sleep(self.latency_ms / 1000.0)
+            return JSONResponse(status_code=500, content={"error": {"message": "Injected failure."}})
+
+        reply = self._reply(body)
+        prompt_tokens = self._prompt_tokens(body.get("messages", []))
+        completion_tokens = _estimate_tokens(reply)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        finish_reason = "tool_calls" if "tool_calls" in reply else "stop"
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model = body.get("model", "fake")
+
+        if body.get("stream"):
+            return StreamingResponse(self._stream(completion_id, model, reply, usage, finish_reason),
+                                     media_type="text/event-stream")
+
+        await self._delay(completion_tokens)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply.get("content"),
+                            **({"tool_calls": reply["tool_calls"]} if "tool_calls" in reply else {})},
+                "finish_reason": finish_reason,
+            }],
+            "usage": usage,
+        }
+
+    async def _stream(self, completion_id: str, model: str, reply: Dict[str, Any],
+                      usage: Dict[str, int], finish_reason: str):
+        def chunk(delta: Dict[str, Any], finish: Optional[str] = None, extra: Optional[Dict] = None) -> str:
+            payload = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+                **(extra or {}),
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        await asyncio.sleep((self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000.0)
+        yield chunk({"role": "assistant", "content": ""})
+        if "tool_calls" in reply:
+            yield chunk({"tool_calls": [dict(call, index=i) for i, call in enumerate(reply["tool_calls"])]})
+        else:
+            # One line per chunk, paced at tokens_per_second.
+            for line in reply["content"].splitlines(keepends=True):
+                if self.tokens_per_second:
+                    await asyncio.sleep(_estimate_tokens(line) / self.tokens_per_second)
+                yield chunk({"content": line})
+        yield chunk({}, finish_reason, {"x_groq": {"usage": usage}, "usage": usage})
+        yield "data: [DONE]\n\n"
+
+
+class FakeUsda:
+    def __init__(self, latency_ms: float = 150.0, jitter_ms: float = 50.0, miss_rate: float = 0.0):
+        """
+        A `foods/search` endpoint returning one deterministic food per query.
+
+        Args:
+            latency_ms: Response latency.
+            jitter_ms: Uniform random jitter added to the latency.
+            miss_rate: Fraction of queries answered with no foods.
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.miss_rate = miss_rate
+        self.requests = 0
+
+    def _food(self, query: str) -> Dict[str, Any]:
+        rng = random.Random(_query_seed(query))
+        nutrients = [
+            {"nutrientId": 1008, "nutrientName": "Energy", "unitName": "KCAL", "value": rng.randint(30, 400)},
+            {"nutrientId": 1003, "nutrientName": "Protein", "unitName": "G", "value": round(rng.uniform(0, 30), 2)},
+            {"nutrientId": 1005, "nutrientName": "Carbohydrate, by difference", "unitName": "G",
+             "value": round(rng.uniform(0, 60), 2)},
+            {"nutrientId": 1004, "nutrientName": "Total lipid (fat)", "unitName": "G",
+             "value": round(rng.uniform(0, 25), 2)},
+        ]
+        nutrients += [
+            {"nutrientId": 2000 + i, "nutrientName": name, "unitName": "MG", "value": round(rng.uniform(0, 100), 2)}
+            for i, name in enumerate(_FILLER_NUTRIENTS)
+        ]
+        return {
+            "fdcId": _query_seed(query) % 10_000_000,
+            "description": query.upper(),
+            "dataType": "Survey (FNDDS)",
+            "foodNutrients": nutrients,
+        }
+
+    async def search(self, query: str = "", pageSize: int = 1, api_key: str = ""):
+        self.requests += 1
+        await asyncio.sleep((self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000.0)
+        if self.miss_rate and random.Random(_query_seed(query)).random() < self.miss_rate:
+            return {"totalHits": 0, "foods": []}
+        return {"totalHits": 1, "currentPage": 1, "totalPages": 1, "foods": [self._food(query)]}
+
+
+def create_groq_app(fake: FakeGroq) -> FastAPI:
+    app = FastAPI()
+    app.add_api_route("/openai/v1/chat/completions", fake.chat_completions, methods=["POST"])
+    return app
+
+
+def create_usda_app(fake: FakeUsda) -> FastAPI:
+    app = FastAPI()
+    app.add_api_route("/fdc/v1/foods/search", fake.search, methods=["GET"])
+    return app
+
+
+class BackgroundServer:
+    def __init__(self, app: FastAPI, host: str = "127.0.0.1", port: int = 0):
+        """
+        Runs a uvicorn server on a daemon thread, for use from the benchmark runner.
+        """
+        self.config = uvicorn.Config(app, host=host, port=port, log_level="warning")
+        self.server = uvicorn.Server(self.config)
+        self._thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self) -> "BackgroundServer":
+        self._thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.servers[0].sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    def stop(self):
+        self.server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Run the fake Groq and USDA services.")
+    parser.add_argument("--groq-port", type=int, default=8901)
+    parser.add_argument("--usda-port", type=int, default=8902)
+    parser.add_argument("--groq-latency-ms", type=float, default=300.0)
+    parser.add_argument("--groq-tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--groq-rpm", type=int, default=0, help="Simulated Groq requests-per-minute limit.")
+    parser.add_argument("--usda-latency-ms", type=float, default=150.0)
+    parser.add_argument("--items", default=",".join(DEFAULT_ITEMS), help="Comma-separated items the VLM reports.")
+    args = parser.parse_args(argv)
+
+    groq = BackgroundServer(create_groq_app(FakeGroq(
+        latency_ms=args.groq_latency_ms, tokens_per_second=args.groq_tokens_per_second,
+        requests_per_minute=args.groq_rpm,
+        items=[item.strip() for item in args.items.split(",") if item.strip()],
+    )), port=args.groq_port).start()
+    usda = BackgroundServer(create_usda_app(FakeUsda(latency_ms=args.usda_latency_ms)), port=args.usda_port).start()
+    print(f"GROQ_API_BASE={groq.url}")
+    print(f"USDA_API_BASE={usda.url}/fdc/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        groq.stop()
+        usda.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+Load and latency benchmark for the analysis endpoints, run against local fake Groq and USDA
+services so it costs nothing and is reproducible.
+
+    python -m benchmarks.run_benchmark --requests 200 --concurrency 8 --mode fast
+    python -m benchmarks.run_benchmark --save-baseline fast-c8
+    python -m benchmarks.run_benchmark --baseline fast-c8        # exits 1 on regression
+
+By default this starts the fake services and a backend subprocess wired to them, generates
+the synthetic corpus if needed, sends the requests, and reports end-to-end p50/p95/p99
+latency, requests/s and a per-stage breakdown read from the backend's /metrics endpoint.
+The backend still needs a detector model (FOOD_DETECTOR_MODEL_PATH or the default path).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+from benchmarks.corpus import generate_corpus
+from benchmarks.fake_services import BackgroundServer, FakeGroq, FakeUsda, create_groq_app, create_usda_app
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+BENCHMARK_DIR = Path(__file__).resolve().parent
+BASELINE_DIR = BENCHMARK_DIR / "baselines"
+DEFAULT_CORPUS_DIR = BENCHMARK_DIR / "corpus"
+
+STAGE_METRIC = "foodvision_stage_duration_seconds"
+STAGE_ERRORS_METRIC = "foodvision_stage_errors_total"
+TOKENS_METRIC = "foodvision_groq_tokens_total"
+MIME_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".webp": "image/webp", ".gif": "image/gif"}
+
+Samples = Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float]
+
+
+def load_images(directory: Path) -> List[Tuple[str, bytes, str]]:
+    images = []
+    for path in sorted(directory.rglob("*")):
+        mime_type = MIME_TYPES.get(path.suffix.lower())
+        if mime_type:
+            images.append((path.name, path.read_bytes(), mime_type))
+    return images
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100.0
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+async def _send(client: httpx.AsyncClient, url: str, image: Tuple[str, bytes, str], stream: bool) -> Dict[str, Any]:
+    filename, data, mime_type = image
+    started = time.perf_counter()
+    first_byte = None
+    status = "error"
+    try:
+        async with client.stream("POST", url, files={"file": (filename, data, mime_type)}) as response:
+            body = b""
+            async for chunk in response.aiter_bytes():
+                if first_byte is None:
+                    first_byte = time.perf_counter()
+                body += chunk
+        if response.status_code == 200:
+            # The streaming endpoint always answers 200; failures arrive as an `error` event.
+            status = "ok" if not stream or b"event: result" in body else "stream_error"
+        elif response.status_code == 400 and b"No food detected" in body:
+            status = "no_food"
+        else:
+            status = f"http_{response.status_code}"
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    finished = time.perf_counter()
+    return {
+        "status": status,
+        "latency_ms": (finished - started) * 1000.0,
+        "first_byte_ms": ((first_byte or finished) - started) * 1000.0,
+    }
+
+
+async def run_load(target: str, images: List[Tuple[str, bytes, str]], endpoint: str, mode: str,
+                   total_requests: int, concurrency: int) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    Sends `total_requests` uploads with `concurrency` requests in flight, cycling through the corpus.
+
+    Returns:
+        The per-request results and the wall-clock duration of the timed phase in seconds.
+    """
+    path = "/api/analyze/stream" if endpoint == "stream" else "/api/analyze"
+    url = f"{target}{path}?mode={mode}"
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=httpx.Timeout(120.0), limits=limits) as client:
+        results: List[Dict[str, Any]] = []
+        next_index = 0
+
+        async def worker():
+            nonlocal next_index
+            while next_index < total_requests:
+                index = next_index
+                next_index += 1
+                results.append(await _send(client, url, images[index % len(images)], endpoint == "stream"))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return results, time.perf_counter() - started
+
+
+def scrape_metrics(target: str) -> Samples:
+    response = httpx.get(f"{target}/metrics", timeout=10.0)
+    response.raise_for_status()
+    samples: Samples = {}
+    for family in text_string_to_metric_families(response.text):
+        for sample in family.samples:
+            samples[(sample.name, tuple(sorted(sample.labels.items())))] = sample.value
+    return samples
+
+
+def _delta(before: Samples, after: Samples, name: str, **labels: str) -> float:
+    key = (name, tuple(sorted(labels.items())))
+    return after.get(key, 0.0) - before.get(key, 0.0)
+
+
+def _histogram_quantile(buckets: List[Tuple[float, float]], q: float) -> float:
+    # Same linear interpolation as PromQL's histogram_quantile, over cumulative bucket counts.
+    total = buckets[-1][1] if buckets else 0.0
+    if total <= 0:
+        return 0.0
+    rank = q * total
+    previous_bound, previous_count = 0.0, 0.0
+    for bound, count in buckets:
+        if count >= rank:
+            if bound == float("inf"):
+                return previous_bound
+            width = count - previous_count
+            fraction = (rank - previous_count) / width if width else 0.0
+            return previous_bound + (bound - previous_bound) * fraction
+        previous_bound, previous_count = bound, count
+    return previous_bound
+
+
+def stage_breakdown(before: Samples, after: Samples) -> Dict[str, Dict[str, float]]:
+    """
+    Per-stage count, mean, estimated p50/p95 and errors over the benchmark window, from the
+    difference between two /metrics scrapes.
+    """
+    stages = sorted({dict(labels)["stage"] for name, labels in after if name == f"{STAGE_METRIC}_count"})
+    breakdown = {}
+    for stage in stages:
+        count = _delta(before, after, f"{STAGE_METRIC}_count", stage=stage)
+        if count <= 0:
+            continue
+        buckets = sorted(
+            (float(dict(labels)["le"]), value - before.get((name, labels), 0.0))
+            for (name, labels), value in after.items()
+            if name == f"{STAGE_METRIC}_bucket" and dict(labels).get("stage") == stage
+        )
+        breakdown[stage] = {
+            "count": count,
+            "mean_ms": _delta(before, after, f"{STAGE_METRIC}_sum", stage=stage) / count * 1000.0,
+            "p50_ms": _histogram_quantile(buckets, 0.50) * 1000.0,
+            "p95_ms": _histogram_quantile(buckets, 0.95) * 1000.0,
+            "errors": _delta(before, after, STAGE_ERRORS_METRIC, stage=stage),
+        }
+    return breakdown
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    latencies = [r["latency_ms"] for r in results]
+    first_bytes = [r["first_byte_ms"] for r in results]
+    return {
+        "requests": len(results),
+        "elapsed_seconds": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "status_counts": dict(Counter(r["status"] for r in results)),
+        "latency_ms": {
+            "mean": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p50": _percentile(latencies, 50),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "max": max(latencies) if latencies else 0.0,
+        },
+        "first_byte_ms": {"p50": _percentile(first_bytes, 50), "p95": _percentile(first_bytes, 95)},
+    }
+
+
+def compare_to_baseline(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float,
+                        min_delta_ms: float) -> List[str]:
+    """
+    Returns a description of every metric that is worse than the baseline by more than
+    `tolerance` (relative) and, for latencies, also by more than `min_delta_ms`.
+    """
+    regressions = []
+
+    def check_latency(label: str, current: Optional[float], previous: Optional[float]):
+        if current is None or not previous:
+            return
+        if current > previous * (1 + tolerance) and current - previous > min_delta_ms:
+            regressions.append(f"{label}: {previous:.1f} ms -> {current:.1f} ms (+{(current / previous - 1):.0%})")
+
+    for key in ("p50", "p95", "p99"):
+        check_latency(f"latency {key}", report["latency_ms"].get(key), baseline["latency_ms"].get(key))
+    for stage, stats in baseline.get("stages", {}).items():
+        check_latency(f"stage {stage} mean", report.get("stages", {}).get(stage, {}).get("mean_ms"), stats.get("mean_ms"))
+
+    previous_rps = baseline.get("throughput_rps") or 0.0
+    if previous_rps and report["throughput_rps"] < previous_rps * (1 - tolerance):
+        regressions.append(f"throughput: {previous_rps:.2f} -> {report['throughput_rps']:.2f} req/s")
+    return regressions
+
+
+def print_report(report: Dict[str, Any]):
+    latency = report["latency_ms"]
+    print(f"\n{report['requests']} requests in {report['elapsed_seconds']:.1f}s "
+          f"({report['throughput_rps']:.2f} req/s), statuses: {report['status_counts']}")
+    print(f"latency ms: p50 {latency['p50']:.1f}  p95 {latency['p95']:.1f}  p99 {latency['p99']:.1f}  "
+          f"max {latency['max']:.1f}  (first byte p50 {report['first_byte_ms']['p50']:.1f})")
+    if report.get("stages"):
+        print(f"\n{'stage':<22} {'count':>7} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7}")
+        for stage, stats in sorted(report["stages"].items(), key=lambda s: -s[1]["mean_ms"] * s[1]["count"]):
+            print(f"{stage:<22} {stats['count']:>7.0f} {stats['mean_ms']:>9.1f} {stats['p50_ms']:>9.1f} "
+                  f"{stats['p95_ms']:>9.1f} {stats['errors']:>7.0f}")
+    if report.get("groq_tokens"):
+        print(f"\nGroq tokens per request: {report['groq_tokens']}")
+    if report.get("groq_rate_limited_responses"):
+        print(f"Groq 429 responses: {report['groq_rate_limited_responses']}")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_backend(env: Dict[str, str], workers: int, log_path: Path) -> Tuple[subprocess.Popen, str]:
+    port = _free_port()
+    log = open(log_path, "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    return process, f"http://127.0.0.1:{port}"
+
+
+def wait_until_ready(target: str, timeout: float, process: Optional[subprocess.Popen] = None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"The backend exited with code {process.returncode} during startup.")
+        try:
+            response = httpx.get(f"{target}/api/ready", timeout=2.0)
+            if response.status_code == 200:
+                return
+            if response.json().get("status") == "failed":
+                raise RuntimeError(f"Backend startup failed: {response.json().get('error')}")
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"The backend at {target} was not ready after {timeout:.0f}s.")
+
+
+def _baseline_path(name: str) -> Path:
+    path = Path(name)
+    return path if path.suffix == ".json" else BASELINE_DIR / f"{name}.json"
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the analysis endpoints against fake Groq/USDA services.")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed requests sent first.")
+    parser.add_argument("--mode", choices=["agent", "fast"], default="fast")
+    parser.add_argument("--endpoint", choices=["analyze", "stream"], default="analyze")
+    parser.add_argument("--images", type=Path, help="Image directory; defaults to the synthetic corpus.")
+    parser.add_argument("--corpus-size", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache", action="store_true", help="Keep the result cache enabled (off by default).")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Backend workers. With more than one, /metrics covers only the worker that answers the scrape.")
+    parser.add_argument("--target", help="Benchmark an already-running backend instead of starting one.")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Extra environment for the backend, e.g. FOOD_DETECTOR_MODEL_PATH=...")
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--groq-latency-ms", type=float, default=300.0)
+    parser.add_argument("--groq-tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--groq-rpm", type=int, default=0,
+                        help="Requests-per-minute limit enforced by the fake Groq (429 + retry-after).")
+    parser.add_argument("--usda-latency-ms", type=float, default=150.0)
+    parser.add_argument("--output", type=Path, help="Write the full report as JSON.")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Save the report as benchmarks/baselines/NAME.json.")
+    parser.add_argument("--baseline", metavar="NAME", help="Compare against a saved baseline; exit 1 on regression.")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative slowdown (default 15%%).")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="Ignore latency changes smaller than this.")
+    args = parser.parse_args(argv)
+
+    if args.images:
+        images = load_images(args.images)
+    else:
+        if not (DEFAULT_CORPUS_DIR / "manifest.json").exists():
+            print(f"Generating a {args.corpus_size}-image synthetic corpus in {DEFAULT_CORPUS_DIR}")
+            generate_corpus(DEFAULT_CORPUS_DIR, args.corpus_size, args.seed, max_bytes=5 * 1024 * 1024)
+        images = load_images(DEFAULT_CORPUS_DIR)
+    if not images:
+        parser.error("No images found to send.")
+
+    groq = usda = process = fake_groq = None
+    try:
+        target = args.target
+        if not target:
+            fake_groq = FakeGroq(latency_ms=args.groq_latency_ms, tokens_per_second=args.groq_tokens_per_second,
+                                 requests_per_minute=args.groq_rpm)
+            groq = BackgroundServer(create_groq_app(fake_groq)).start()
+            usda = BackgroundServer(create_usda_app(FakeUsda(latency_ms=args.usda_latency_ms))).start()
+            env = dict(os.environ)
+            env.update({
+                "GROQ_API_BASE": groq.url,
+                "GROQ_API_KEY": "benchmark",
+                "USDA_API_BASE": f"{usda.url}/fdc/v1",
+                "USDA_API_KEY": "benchmark",
+                "FDC_INDEX_PATH": "",
+                "RESULT_CACHE_DB_PATH": "",
+            })
+            if not args.cache:
+                env["RESULT_CACHE_MAX_ENTRIES"] = "0"
+            env.update(dict(item.split("=", 1) for item in args.env))
+            BENCHMARK_DIR.joinpath("results").mkdir(exist_ok=True)
+            process, target = start_backend(env, args.workers, BENCHMARK_DIR / "results" / "backend.log")
+
+        wait_until_ready(target, args.startup_timeout, process)
+        if args.warmup:
+            asyncio.run(run_load(target, images, args.endpoint, args.mode, args.warmup, 1))
+        # Stage metrics are the difference between these two scrapes, so warmup is excluded.
+        before = scrape_metrics(target)
+        results, elapsed = asyncio.run(run_load(target, images, args.endpoint, args.mode,
+                                                args.requests, args.concurrency))
+        after = scrape_metrics(target)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        for server in (groq, usda):
+            if server is not None:
+                server.stop()
+
+    report = summarize(results, elapsed)
+    report["stages"] = stage_breakdown(before, after)
+    timed_requests = max(len(results), 1)
+    report["groq_tokens"] = {
+        f"{component}_{kind}": _delta(before, after, f"{TOKENS_METRIC}", component=component, kind=kind) / timed_requests
+        for component in ("vlm", "agent") for kind in ("prompt", "completion")
+    }
+    if fake_groq is not None:
+        report["groq_rate_limited_responses"] = fake_groq.rate_limited
+    report["config"] = {
+        "requests": args.requests, "concurrency": args.concurrency, "mode": args.mode,
+        "endpoint": args.endpoint, "images": len(images), "cache": args.cache, "workers": args.workers,
+        "groq_latency_ms": args.groq_latency_ms, "groq_rpm": args.groq_rpm, "usda_latency_ms": args.usda_latency_ms,
+        "python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(),
+    }
+    print_report(report)
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+    if args.save_baseline:
+        path = _baseline_path(args.save_baseline)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(report, indent=2))
+        print(f"\nSaved baseline to {path}")
+    if args.baseline:
+        baseline = json.loads(_baseline_path(args.baseline).read_text())
+        if baseline.get("config", {}).get("cpus") != report["config"]["cpus"]:
+            print("\nNote: the baseline was recorded on a machine with a different CPU count.")
+        regressions = compare_to_baseline(report, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print("\nRegressions against baseline:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
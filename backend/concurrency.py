@@ -0,0 +1,47 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_cpu_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    """
+    Returns the process-wide bounded executor for CPU-bound work (PIL decoding,
+    image re-encoding, TensorFlow preprocessing), creating it on first use.
+
+    The pool size is read from CPU_EXECUTOR_WORKERS and defaults to the CPU count,
+    so blocking work never piles up in the event loop or in an unbounded pool.
+    """
+    global _cpu_executor
+    if _cpu_executor is None:
+        max_workers = int(os.environ.get("CPU_EXECUTOR_WORKERS", str(os.cpu_count() or 1)))
+        _cpu_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cpu-worker")
+        logger.info(f"CPU executor started with {max_workers} workers.")
+    return _cpu_executor
+
+
+async def run_in_cpu_executor(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Runs a blocking callable on the bounded CPU executor without blocking the event loop.
+    The caller's context variables (such as the request trace ID) are visible to the callable.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_cpu_executor(), functools.partial(context.run, func, *args, **kwargs))
+
+
+def shutdown_cpu_executor():
+    """
+    Shuts down the CPU executor, waiting for queued work to finish.
+    """
+    global _cpu_executor
+    if _cpu_executor is not None:
+        _cpu_executor.shutdown(wait=True)
+        _cpu_executor = None
@@ -0,0 +1,255 @@
+"""
+Converts the Keras food detector into lighter runtimes and compares them against it.
+
+Convert (requires TensorFlow; ONNX export also requires tf2onnx, and int8 ONNX requires onnxruntime):
+
+    python convert_detector.py convert --format tflite --quantization fp16
+    python convert_detector.py convert --format tflite --quantization int8 --calibration-dir ./samples
+    python convert_detector.py convert --format onnx --quantization int8
+
+Compare accuracy and latency against the Keras model:
+
+    python convert_detector.py compare ./models/binary_food_detector_fp16.tflite \\
+        ./models/binary_food_detector_int8.onnx --images ./samples
+
+If the images directory contains `food/` and `non_food/` subdirectories, accuracy against
+those labels is reported as well as agreement with the Keras model.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from detector_backends import load_backend
+from food_detector import DEFAULT_MODEL_PATH, load_image_array
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SIZE = (224, 224)
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+QUANTIZATIONS = {
+    "tflite": ("fp32", "fp16", "dynamic", "int8"),
+    "onnx": ("fp32", "int8"),
+}
+
+
+def _find_images(directory: Path) -> List[Path]:
+    return sorted(p for p in directory.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES)
+
+
+def _label_for(path: Path, root: Path) -> Optional[bool]:
+    # food/ -> True, non_food/ -> False, anything else is unlabeled.
+    top = path.relative_to(root).parts[0].lower()
+    if top == "food":
+        return True
+    if top in ("non_food", "nonfood", "not_food"):
+        return False
+    return None
+
+
+def _representative_dataset(calibration_dir: Optional[Path], samples: int) -> Iterator[List[np.ndarray]]:
+    paths = _find_images(calibration_dir) if calibration_dir else []
+    if not paths:
+        logger.warning("No calibration images given; int8 ranges will be calibrated on random noise, "
+                       "which usually costs accuracy. Pass --calibration-dir with real photos.")
+        for _ in range(samples):
+            yield [np.random.rand(1, *IMAGE_SIZE[::-1], 3).astype(np.float32)]
+        return
+    random.shuffle(paths)
+    for path in paths[:samples]:
+        yield [np.expand_dims(load_image_array(path, IMAGE_SIZE), 0)]
+
+
+def convert_to_tflite(keras_path: Path, output: Path, quantization: str,
+                      calibration_dir: Optional[Path], samples: int):
+    import tensorflow as tf
+
+    model = tf.keras.models.load_model(keras_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantization == "fp16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "dynamic":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    elif quantization == "int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: _representative_dataset(calibration_dir, samples)
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        # Inputs and outputs stay float32 so the backend can feed preprocessed images directly.
+    output.write_bytes(converter.convert())
+
+
+def convert_to_onnx(keras_path: Path, output: Path, quantization: str, opset: int):
+    import tensorflow as tf
+    try:
+        import tf2onnx
+    except ImportError:
+        raise RuntimeError("ONNX export requires `tf2onnx`.")
+
+    model = tf.keras.models.load_model(keras_path)
+    spec = (tf.TensorSpec((None, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), tf.float32, name="input"),)
+    fp32_path = output if quantization == "fp32" else output.with_suffix(".fp32.onnx")
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=str(fp32_path))
+
+    if quantization == "int8":
+        try:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+        except ImportError:
+            raise RuntimeError("int8 ONNX quantization requires `onnxruntime`.")
+        quantize_dynamic(str(fp32_path), str(output), weight_type=QuantType.QInt8)
+        fp32_path.unlink()
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _percentile(values: List[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def _benchmark(model_path: Path, images: np.ndarray, num_threads: Optional[int],
+               batch_size: int, runs: int) -> Tuple[Dict, np.ndarray]:
+    rss_before = _rss_mb()
+    started = time.perf_counter()
+    backend = load_backend(model_path, num_threads=num_threads)
+    load_seconds = time.perf_counter() - started
+    rss_after = _rss_mb()
+
+    backend.predict(images[:1]) # Warm up before timing
+    single_latencies = []
+    for i in range(min(runs, len(images))):
+        started = time.perf_counter()
+        backend.predict(images[i:i + 1])
+        single_latencies.append((time.perf_counter() - started) * 1000.0)
+
+    scores = []
+    started = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        scores.append(np.asarray(backend.predict(images[i:i + batch_size])).reshape(-1))
+    batch_seconds = time.perf_counter() - started
+
+    report = {
+        "model": str(model_path),
+        "backend": backend.name,
+        "file_size_mb": model_path.stat().st_size / (1024 * 1024) if model_path.is_file() else None,
+        "load_seconds": load_seconds,
+        "rss_delta_mb": rss_after - rss_before,
+        "latency_p50_ms": _percentile(single_latencies, 50),
+        "latency_p95_ms": _percentile(single_latencies, 95),
+        "batch_images_per_second": len(images) / batch_seconds if batch_seconds else 0.0,
+    }
+    return report, np.concatenate(scores)
+
+
+def compare(reference: Path, candidates: List[Path], images_dir: Optional[Path], limit: int,
+            num_threads: Optional[int], batch_size: int, runs: int) -> List[Dict]:
+    """
+    Benchmarks the reference Keras model and each candidate on the same images, and reports
+    how often each candidate's food/non-food verdict agrees with the reference.
+    """
+    paths = _find_images(images_dir)[:limit] if images_dir else []
+    if paths:
+        images = np.stack([load_image_array(path, IMAGE_SIZE) for path in paths])
+        labels = [_label_for(path, images_dir) for path in paths]
+    else:
+        logger.warning("No images given; comparing on random noise. Agreement numbers are not meaningful.")
+        images = np.random.rand(limit, IMAGE_SIZE[1], IMAGE_SIZE[0], 3).astype(np.float32)
+        labels = [None] * limit
+
+    reports = []
+    reference_scores = None
+    for model_path in [reference] + candidates:
+        report, scores = _benchmark(model_path, images, num_threads, batch_size, runs)
+        verdicts = scores < 0.5 # Same threshold as FoodDetector: closer to 0 means food
+        if reference_scores is None:
+            reference_scores = scores
+        reference_verdicts = reference_scores < 0.5
+        report["agreement_with_reference"] = float(np.mean(verdicts == reference_verdicts))
+        report["max_abs_score_diff"] = float(np.max(np.abs(scores - reference_scores)))
+        labeled = [(v, l) for v, l in zip(verdicts, labels) if l is not None]
+        report["labeled_accuracy"] = float(np.mean([v == l for v, l in labeled])) if labeled else None
+        reports.append(report)
+    return reports
+
+
+def _print_report(reports: List[Dict]):
+    columns = [
+        ("backend", "Backend", "{}"),
+        ("file_size_mb", "Size (MB)", "{:.1f}"),
+        ("load_seconds", "Load (s)", "{:.2f}"),
+        ("rss_delta_mb", "RSS +MB", "{:.0f}"),
+        ("latency_p50_ms", "p50 (ms)", "{:.2f}"),
+        ("latency_p95_ms", "p95 (ms)", "{:.2f}"),
+        ("batch_images_per_second", "Batch img/s", "{:.1f}"),
+        ("agreement_with_reference", "Agreement", "{:.2%}"),
+        ("max_abs_score_diff", "Max |diff|", "{:.4f}"),
+        ("labeled_accuracy", "Accuracy", "{:.2%}"),
+    ]
+    print("| Model | " + " | ".join(title for _, title, _ in columns) + " |")
+    print("|" + " --- |" * (len(columns) + 1))
+    for report in reports:
+        cells = ["-" if report[key] is None else fmt.format(report[key]) for key, _, fmt in columns]
+        print(f"| {Path(report['model']).name} | " + " | ".join(cells) + " |")
+    print("\nRSS deltas are measured in one process in load order, so later models may share "
+          "already-loaded libraries; run one candidate per invocation for exact per-worker memory.")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Convert and compare food detector backends.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="Convert the Keras model to TFLite or ONNX.")
+    convert_parser.add_argument("--keras", type=Path, default=Path(DEFAULT_MODEL_PATH))
+    convert_parser.add_argument("--format", choices=sorted(QUANTIZATIONS), default="tflite")
+    convert_parser.add_argument("--quantization", default="fp16",
+                                help="tflite: fp32, fp16, dynamic or int8. onnx: fp32 or int8.")
+    convert_parser.add_argument("--calibration-dir", type=Path,
+                                help="Images used to calibrate int8 TFLite activation ranges.")
+    convert_parser.add_argument("--calibration-samples", type=int, default=200)
+    convert_parser.add_argument("--opset", type=int, default=13)
+    convert_parser.add_argument("--output", type=Path)
+
+    compare_parser = subparsers.add_parser("compare", help="Compare converted models against the Keras model.")
+    compare_parser.add_argument("candidates", type=Path, nargs="+")
+    compare_parser.add_argument("--reference", type=Path, default=Path(DEFAULT_MODEL_PATH))
+    compare_parser.add_argument("--images", type=Path, help="Directory of evaluation images.")
+    compare_parser.add_argument("--limit", type=int, default=500)
+    compare_parser.add_argument("--threads", type=int, help="Interpreter thread count.")
+    compare_parser.add_argument("--batch-size", type=int, default=16)
+    compare_parser.add_argument("--runs", type=int, default=100, help="Single-image latency samples.")
+    compare_parser.add_argument("--json", type=Path, help="Also write the report as JSON.")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "convert":
+        if args.quantization not in QUANTIZATIONS[args.format]:
+            parser.error(f"--quantization for {args.format} must be one of {', '.join(QUANTIZATIONS[args.format])}")
+        output = args.output or args.keras.with_name(f"{args.keras.stem}_{args.quantization}.{args.format}")
+        if args.format == "tflite":
+            convert_to_tflite(args.keras, output, args.quantization, args.calibration_dir, args.calibration_samples)
+        else:
+            convert_to_onnx(args.keras, output, args.quantization, args.opset)
+        print(f"Wrote {output} ({output.stat().st_size / (1024 * 1024):.1f} MB)")
+    else:
+        reports = compare(args.reference, args.candidates, args.images, args.limit,
+                          args.threads, args.batch_size, args.runs)
+        _print_report(reports)
+        if args.json:
+            args.json.write_text(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import logging
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("keras", "tflite", "onnx")
+
+
+class KerasBackend:
+    name = "keras"
+
+    def __init__(self, model_path: Path):
+        """
+        Runs the original Keras model. Imports TensorFlow on construction only, so the
+        lightweight backends never pay for it.
+        """
+        import tensorflow as tf
+
+        self.model = tf.keras.models.load_model(model_path)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        # predict_on_batch skips the per-call data adapter setup that predict() performs.
+        return np.asarray(self.model.predict_on_batch(batch))
+
+
+class TFLiteBackend:
+    name = "tflite"
+
+    def __init__(self, model_path: Path, num_threads: Optional[int] = None):
+        """
+        Runs a converted .tflite model with the standalone TFLite interpreter.
+
+        `tflite_runtime` (or its successor `ai_edge_litert`) is preferred because it does
+        not pull in TensorFlow; `tf.lite` is used only as a fallback.
+        """
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                try:
+                    from tensorflow.lite import Interpreter
+                except ImportError:
+                    raise RuntimeError("The tflite backend requires `ai-edge-litert`, `tflite-runtime` or `tensorflow`.")
+
+        self.interpreter = Interpreter(model_path=str(model_path), num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_detail = self.interpreter.get_input_details()[0]
+        self.output_detail = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self.input_detail["shape"][0])
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        if batch.shape[0] != self._batch_size:
+            # Converted models have a fixed batch dimension; resize it to the current batch.
+            self.interpreter.resize_tensor_input(self.input_detail["index"], list(batch.shape))
+            self.interpreter.allocate_tensors()
+            self.input_detail = self.interpreter.get_input_details()[0]
+            self.output_detail = self.interpreter.get_output_details()[0]
+            self._batch_size = batch.shape[0]
+
+        input_dtype = self.input_detail["dtype"]
+        if input_dtype != np.float32:
+            # Fully integer-quantized inputs: map floats onto the quantized range.
+            scale, zero_point = self.input_detail["quantization"]
+            batch = np.clip(np.round(batch / scale + zero_point),
+                            np.iinfo(input_dtype).min, np.iinfo(input_dtype).max).astype(input_dtype)
+        self.interpreter.set_tensor(self.input_detail["index"], batch)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self.output_detail["index"])
+        if self.output_detail["dtype"] != np.float32:
+            scale, zero_point = self.output_detail["quantization"]
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+
+class OnnxBackend:
+    name = "onnx"
+
+    def __init__(self, model_path: Path, num_threads: Optional[int] = None):
+        """
+        Runs a converted .onnx model with ONNX Runtime on the CPU.
+        """
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("The onnx backend requires `onnxruntime`.")
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(str(model_path), sess_options=options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch.astype(np.float32)})[0]
+
+
+def infer_backend(model_path: Path) -> str:
+    """
+    Picks a backend from the model file's extension.
+    """
+    suffix = model_path.suffix.lower()
+    if suffix == ".tflite":
+        return "tflite"
+    if suffix == ".onnx":
+        return "onnx"
+    return "keras"
+
+
+def load_backend(model_path: Path, backend: Optional[str] = None, num_threads: Optional[int] = None):
+    """
+    Loads a detector model with the requested backend, or one inferred from its extension.
+
+    Args:
+        model_path: Path to a Keras (.h5/.keras/SavedModel), .tflite or .onnx model.
+        backend: One of BACKENDS, or None to infer it.
+        num_threads: Intra-op thread count for the tflite and onnx backends.
+    """
+    backend = backend or infer_backend(model_path)
+    if backend == "keras":
+        return KerasBackend(model_path)
+    if backend == "tflite":
+        return TFLiteBackend(model_path, num_threads)
+    if backend == "onnx":
+        return OnnxBackend(model_path, num_threads)
+    raise ValueError(f"Unknown detector backend {backend}. Only {', '.join(BACKENDS)} are allowed.")
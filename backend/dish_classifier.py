@@ -0,0 +1,304 @@
+"""
+Local multi-class dish classifier, used as a cascade stage between the food detector and the VLM.
+
+The model takes the same 224x224 RGB input, rescaled to [0, 1], as the food detector (for
+example a Food-101 head on the detector's MobileNet backbone) and outputs one softmax score
+per dish. Its labels file lists one dish per line in output order; underscores are read as
+spaces, so Food-101 style labels such as `chicken_wings` can be used as they are.
+
+Measure the skip rate against accuracy over a range of thresholds:
+
+    python dish_classifier.py evaluate ./samples --model ./models/dish_classifier.tflite \\
+        --labels ./models/dish_labels.txt
+
+The images directory holds one subdirectory per dish, named like its label. Images in
+subdirectories that match no label (for example `other/`) count as dishes the classifier
+does not know, so skipping the VLM for them is always an error.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+
+from concurrency import run_in_cpu_executor
+from detector_backends import load_backend
+from food_detector import BatchingInferenceEngine, load_image_array
+from image_pipeline import DecodedImage
+from metrics import DISH_CLASSIFIER_CONFIDENCE, DISH_CLASSIFIER_DECISIONS, track_stage
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SIZE = (224, 224)
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp"}
+DEFAULT_THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98)
+
+
+def load_labels(path: Union[str, Path]) -> List[str]:
+    """
+    Reads a labels file with one dish per line, turning underscores into spaces.
+    """
+    lines = Path(path).read_text(encoding="utf-8").splitlines()
+    return [line.strip().replace("_", " ") for line in lines if line.strip()]
+
+
+class DishPrediction:
+    def __init__(self, label: str, confidence: float, top_k: List[Dict[str, Any]]):
+        self.label = label
+        self.confidence = confidence
+        self.top_k = top_k
+
+    def to_vlm_analysis(self) -> Dict[str, Any]:
+        """
+        Returns the prediction in the shape VLMAnalyzer produces, so the orchestrators can
+        use it in place of a VLM analysis.
+        """
+        return {
+            "food_item_vlm": self.label,
+            "description": f"Identified by the local dish classifier as {self.label} "
+                           f"({self.confidence:.0%} confidence).",
+            "vlm_nutritional_estimates": {},
+            "identified_by": "dish_classifier",
+        }
+
+
+class DishClassifier:
+    def __init__(self, model_path: Union[str, Path], labels_path: Union[str, Path], threshold: float = 0.85,
+                 backend: Optional[str] = None, num_threads: Optional[int] = None,
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        """
+        Predicts which of a fixed set of common dishes an image shows. Predictions at or
+        above `threshold` are trusted, so the request can skip the VLM call.
+
+        Concurrent requests share forward passes through a BatchingInferenceEngine, and the
+        input is the same thumbnail the food detector already decoded.
+
+        Args:
+            model_path: Keras, .tflite or .onnx classifier model.
+            labels_path: Labels file, one dish per model output.
+            threshold: Minimum softmax confidence for skipping the VLM.
+            backend: One of detector_backends.BACKENDS, or None to infer it from the extension.
+            num_threads: Intra-op thread count for the tflite and onnx backends.
+            max_batch_size: Upper bound on the number of images per forward pass.
+            max_wait_ms: Maximum time an image waits for others to join its batch.
+        """
+        model_path = Path(model_path)
+        if not model_path.exists():
+            raise FileNotFoundError(f"Dish classifier model not found at {model_path}")
+        self.labels = load_labels(labels_path)
+        self.threshold = threshold
+        try:
+            self.backend = load_backend(model_path, backend, num_threads)
+        except Exception as e:
+            logger.error(f"Error loading dish classifier from {model_path}: {e}")
+            raise RuntimeError(f"Failed to load dish classifier: {e}")
+        logger.info(f"Dish classifier loaded from {model_path} with {len(self.labels)} dishes "
+                    f"({self.backend.name} backend), threshold {threshold}.")
+
+        self.engine = BatchingInferenceEngine(
+            self._predict_batch,
+            max_batch_size=max_batch_size,
+            max_wait_ms=max_wait_ms,
+            name="dish-classifier",
+        )
+
+    @classmethod
+    def from_env(cls) -> Optional["DishClassifier"]:
+        """
+        Builds the classifier from DISH_CLASSIFIER_* settings, or returns None when no
+        model is configured.
+        """
+        model_path = os.environ.get("DISH_CLASSIFIER_MODEL_PATH")
+        if not model_path:
+            return None
+        num_threads = int(os.environ.get("DISH_CLASSIFIER_NUM_THREADS", "0")) or None
+        return cls(
+            model_path,
+            os.environ.get("DISH_CLASSIFIER_LABELS_PATH") or str(Path(model_path).with_suffix(".labels.txt")),
+            threshold=float(os.environ.get("DISH_CLASSIFIER_THRESHOLD", "0.85")),
+            backend=os.environ.get("DISH_CLASSIFIER_BACKEND") or None,
+            num_threads=num_threads,
+            max_batch_size=int(os.environ.get("DISH_CLASSIFIER_MAX_BATCH_SIZE", "16")),
+            max_wait_ms=float(os.environ.get("DISH_CLASSIFIER_MAX_WAIT_MS", "5")),
+        )
+
+    def _predict_batch(self, batch: np.ndarray) -> np.ndarray:
+        with track_stage("dish_classifier_inference"):
+            return self.backend.predict(batch)
+
+    def _load_image_array(self, image: Union[str, Path, DecodedImage]) -> np.ndarray:
+        with track_stage("dish_classifier_preprocess"):
+            return load_image_array(image, IMAGE_SIZE)
+
+    def _prediction(self, scores: np.ndarray, top_k: int = 3) -> DishPrediction:
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        if len(scores) != len(self.labels):
+            raise ValueError(f"The dish classifier returned {len(scores)} scores for {len(self.labels)} labels.")
+        ranked = np.argsort(scores)[::-1][:top_k]
+        return DishPrediction(
+            self.labels[ranked[0]],
+            float(scores[ranked[0]]),
+            [{"label": self.labels[i], "confidence": float(scores[i])} for i in ranked],
+        )
+
+    def classify(self, image: Union[str, Path, DecodedImage]) -> DishPrediction:
+        """
+        Predicts the dish in an image.
+        """
+        return self._prediction(self.engine.submit(self._load_image_array(image)).result())
+
+    async def classify_async(self, image: Union[str, Path, DecodedImage]) -> DishPrediction:
+        """
+        Async variant of classify; preprocessing runs on the bounded CPU executor.
+        """
+        img_array = await run_in_cpu_executor(self._load_image_array, image)
+        return self._prediction(await asyncio.wrap_future(self.engine.submit(img_array)))
+
+    async def identify_async(self, image: DecodedImage) -> Optional[Dict[str, Any]]:
+        """
+        Runs the cascade decision for one image.
+
+        Returns:
+            A VLM-shaped analysis if the prediction clears the threshold, or None if the
+            image should fall through to the VLM.
+        """
+        try:
+            prediction = await self.classify_async(image)
+        except Exception as e:
+            logger.error(f"Dish classification failed for {image.filename}, falling back to the VLM: {e}")
+            DISH_CLASSIFIER_DECISIONS.labels("error").inc()
+            return None
+        DISH_CLASSIFIER_CONFIDENCE.observe(prediction.confidence)
+        if prediction.confidence >= self.threshold:
+            logger.info(f"Dish classifier identified {prediction.label} ({prediction.confidence:.2f}) "
+                        f"in {image.filename}; skipping the VLM.")
+            DISH_CLASSIFIER_DECISIONS.labels("skipped_vlm").inc()
+            return prediction.to_vlm_analysis()
+        logger.info(f"Dish classifier unsure about {image.filename} ({prediction.label}, "
+                    f"{prediction.confidence:.2f}); using the VLM.")
+        DISH_CLASSIFIER_DECISIONS.labels("fell_through").inc()
+        return None
+
+    def warmup(self) -> float:
+        """
+        Runs a dummy image through the model before the first request.
+
+        Returns:
+            Milliseconds taken.
+        """
+        started = time.perf_counter()
+        self.backend.predict(np.zeros((1, IMAGE_SIZE[1], IMAGE_SIZE[0], 3), dtype=np.float32))
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        logger.info(f"Dish classifier warmed up ({self.backend.name} backend) in {elapsed_ms:.1f} ms")
+        return elapsed_ms
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.engine.get_stats(), "threshold": self.threshold, "labels": len(self.labels)}
+
+    def close(self):
+        """
+        Runs the images still queued for the classifier, then stops its batching engine.
+        """
+        self.engine.shutdown()
+
+
+def _find_labeled_images(directory: Path, limit: int) -> List[tuple]:
+    # (path, dish label or None if the subdirectory names no known dish)
+    images = []
+    for path in sorted(p for p in directory.rglob("*") if p.suffix.lower() in IMAGE_SUFFIXES):
+        images.append((path, path.relative_to(directory).parts[0].replace("_", " ").strip().lower()))
+    return images[:limit] if limit else images
+
+
+def evaluate(model_path: Path, labels_path: Path, images_dir: Path, thresholds: List[float],
+             backend: Optional[str] = None, limit: int = 0, batch_size: int = 32) -> Dict[str, Any]:
+    """
+    Classifies every image under `images_dir` once, then reports for each threshold the
+    share of images that would skip the VLM and how often those skipped predictions are right.
+    """
+    labels = load_labels(labels_path)
+    known = {label.lower() for label in labels}
+    model = load_backend(model_path, backend)
+    images = _find_labeled_images(images_dir, limit)
+    if not images:
+        raise ValueError(f"No images found under {images_dir}.")
+
+    confidences, correct = [], []
+    started = time.perf_counter()
+    for offset in range(0, len(images), batch_size):
+        chunk = images[offset:offset + batch_size]
+        scores = np.asarray(model.predict(np.stack([load_image_array(path, IMAGE_SIZE) for path, _ in chunk])))
+        for (path, truth), row in zip(chunk, scores):
+            best = int(np.argmax(row))
+            confidences.append(float(row[best]))
+            correct.append(truth in known and labels[best].lower() == truth)
+    per_image_ms = (time.perf_counter() - started) * 1000.0 / len(images)
+
+    confidences = np.asarray(confidences)
+    correct = np.asarray(correct)
+    rows = []
+    for threshold in thresholds:
+        skipped = confidences >= threshold
+        rows.append({
+            "threshold": threshold,
+            "skip_rate": float(skipped.mean()),
+            "skipped_accuracy": float(correct[skipped].mean()) if skipped.any() else None,
+            "skipped_errors": int((skipped & ~correct).sum()),
+        })
+    return {
+        "model": str(model_path),
+        "images": len(images),
+        "unknown_dish_images": int(sum(truth not in known for _, truth in images)),
+        "top1_accuracy": float(correct.mean()),
+        "ms_per_image": per_image_ms,
+        "thresholds": rows,
+    }
+
+
+def _print_report(report: Dict[str, Any]):
+    print(f"{report['images']} images ({report['unknown_dish_images']} of unknown dishes), "
+          f"top-1 accuracy {report['top1_accuracy']:.1%}, {report['ms_per_image']:.1f} ms/image "
+          f"including preprocessing\n")
+    print("| Threshold | Skip rate | Accuracy when skipped | Wrong skips |")
+    print("| --- | --- | --- | --- |")
+    for row in report["thresholds"]:
+        accuracy = "-" if row["skipped_accuracy"] is None else f"{row['skipped_accuracy']:.1%}"
+        print(f"| {row['threshold']:.2f} | {row['skip_rate']:.1%} | {accuracy} | {row['skipped_errors']} |")
+    print("\nSet DISH_CLASSIFIER_THRESHOLD to the lowest threshold whose accuracy is acceptable; "
+          "images below it are sent to the VLM as before.")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Evaluate the dish classifier cascade.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    evaluate_parser = subparsers.add_parser("evaluate", help="Report skip rate against accuracy per threshold.")
+    evaluate_parser.add_argument("images", type=Path, help="Directory with one subdirectory per dish.")
+    evaluate_parser.add_argument("--model", type=Path, default=os.environ.get("DISH_CLASSIFIER_MODEL_PATH"),
+                                 required=not os.environ.get("DISH_CLASSIFIER_MODEL_PATH"),
+                                 help="Defaults to DISH_CLASSIFIER_MODEL_PATH.")
+    evaluate_parser.add_argument("--labels", type=Path, help="Defaults to the model path with a .labels.txt suffix.")
+    evaluate_parser.add_argument("--backend", help="keras, tflite or onnx; inferred from the extension by default.")
+    evaluate_parser.add_argument("--thresholds", type=lambda s: [float(t) for t in s.split(",")],
+                                 default=list(DEFAULT_THRESHOLDS), help="Comma-separated confidence thresholds.")
+    evaluate_parser.add_argument("--limit", type=int, default=0, help="Evaluate at most this many images.")
+    evaluate_parser.add_argument("--batch-size", type=int, default=32)
+    evaluate_parser.add_argument("--json", type=Path, help="Also write the report as JSON.")
+    args = parser.parse_args(argv)
+
+    model_path = Path(args.model)
+    labels_path = args.labels or os.environ.get("DISH_CLASSIFIER_LABELS_PATH") or model_path.with_suffix(".labels.txt")
+    report = evaluate(model_path, Path(labels_path), args.images, sorted(args.thresholds), args.backend,
+                      args.limit, args.batch_size)
+    _print_report(report)
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
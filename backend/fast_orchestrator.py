@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from metrics import track_stage
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of items looked up per image, to bound the fan-out.
+MAX_FOOD_ITEMS = 10
+
+_ITEM_SEPARATORS = re.compile(r"\s*(?:,|;|\n|&|\+)\s*")
+_FINAL_CONJUNCTION = re.compile(r"^(?:and\s+)?(.+?)\s+and\s+(.+)$", re.IGNORECASE)
+
+# An amount ("130", "0.5", "1/2"), optionally a range ("100-200", "100 to 200"), then a unit.
+_NUMBER = r"\d+(?:\.\d+)?(?:\s*/\s*\d+(?:\.\d+)?)?"
+_QUANTITY = re.compile(rf"\s*(-?{_NUMBER})(?:\s*(?:-|–|to)\s*({_NUMBER}))?\s*([a-zµ]*)", re.IGNORECASE)
+
+# Conversion factors into the units reported in the summary (kcal and g).
+_UNIT_FACTORS = {
+    "kcal": 1.0,
+    "cal": 1.0, # Food labels use "Cal" for kilocalories
+    "kj": 1.0 / 4.184,
+    "g": 1.0,
+    "mg": 1e-3,
+    "ug": 1e-6,
+    "µg": 1e-6,
+}
+
+# (details key in NutritionAnalyzer output, details key in the summary, summary unit)
+_MACROS = (
+    ("calories", "Calories", "kcal"),
+    ("protein", "Protein", "g"),
+    ("carbohydrates", "Carbohydrates", "g"),
+    ("fat", "Fat", "g"),
+)
+
+
+def split_food_items(food_item: str) -> List[str]:
+    """
+    Splits the VLM's `Food Item:` line into individual, de-duplicated item names.
+
+    "and" is only treated as a separator in the last element of a list ("A, B and C"),
+    so single dishes such as "macaroni and cheese" stay whole.
+    """
+    food_item = food_item.strip().strip("[]")
+    parts = _ITEM_SEPARATORS.split(food_item)
+    if len(parts) > 1:
+        match = _FINAL_CONJUNCTION.match(parts[-1].strip())
+        if match:
+            parts[-1:] = [match.group(1), match.group(2)]
+        elif parts[-1].lower().startswith("and "):
+            parts[-1] = parts[-1][4:]
+    items, seen = [], set()
+    for item in parts:
+        item = item.strip(" .-*[]")
+        if not item or item.lower() == "unknown food" or item.lower() in seen:
+            continue
+        seen.add(item.lower())
+        items.append(item)
+    return items[:MAX_FOOD_ITEMS]
+
+
+def _parse_number(text: str) -> Optional[float]:
+    numerator, _, denominator = text.replace(" ", "").partition("/")
+    if not denominator:
+        return float(numerator)
+    return float(numerator) / float(denominator) if float(denominator) else None
+
+
+def parse_quantity(value: Any) -> Optional[float]:
+    """
+    Parses a NutritionAnalyzer detail value such as "130.0 KCAL" or "250 mg" into
+    kcal (for energy units) or grams (for mass units). Fractions ("1/2 g") are
+    evaluated and ranges ("100-200 kcal") give their midpoint. Returns None if unavailable.
+    """
+    match = _QUANTITY.match(str(value))
+    if not match:
+        return None
+    low = _parse_number(match.group(1))
+    high = _parse_number(match.group(2)) if match.group(2) else low
+    if low is None or high is None:
+        return None
+    unit = match.group(3).lower() or "g"
+    factor = _UNIT_FACTORS.get(unit)
+    if factor is None:
+        logger.warning(f"Unknown nutrient unit {unit!r} in {value!r}; ignoring it.")
+        return None
+    return (low + high) / 2 * factor
+
+
+class FastNutritionOrchestrator:
+    def __init__(self, nutrition_analyzer_instance):
+        """
+        Deterministic alternative to LangChainOrchestrator.
+
+        Instead of an LLM agent calling the nutrition tool once per item and then adding up
+        the totals itself, this splits the VLM's identified items, looks them all up
+        concurrently and sums the macros in Python. No LLM calls are made.
+
+        Args:
+            nutrition_analyzer_instance: An instance of NutritionAnalyzer to fetch raw nutritional data.
+        """
+        self.nutrition_analyzer = nutrition_analyzer_instance
+        logger.info("FastNutritionOrchestrator initialized.")
+
+    async def _lookup_async(self, item: str) -> Dict[str, Any]:
+        try:
+            return await self.nutrition_analyzer.get_nutritional_summary_async(item)
+        except Exception as e:
+            logger.error(f"FastNutritionOrchestrator: Lookup failed for {item}: {e}")
+            return {"summary": f"Nutritional information for {item} is unavailable.", "details": {}}
+
+    async def lookup_items_async(self, items: List[str]) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Looks up all items concurrently.
+        """
+        results = await asyncio.gather(*(self._lookup_async(item) for item in items))
+        return list(zip(items, results))
+
+    @staticmethod
+    def _aggregate(food_item: str, lookups: List[Tuple[str, Dict[str, Any]]]) -> Dict[str, Any]:
+        totals: Dict[str, Optional[float]] = {key: None for key, _, _ in _MACROS}
+        for _, summary in lookups:
+            item_details = summary.get("details", {})
+            for key, _, _ in _MACROS:
+                amount = parse_quantity(item_details.get(key, ""))
+                if amount is not None:
+                    totals[key] = (totals[key] or 0.0) + amount
+
+        details = {}
+        # If nothing was found, details stay empty like a failed agent summary.
+        if any(total is not None for total in totals.values()):
+            for key, label, unit in _MACROS:
+                if totals[key] is None:
+                    details[label] = "N/A"
+                elif unit == "kcal":
+                    details[label] = f"{totals[key]:.0f} {unit}"
+                else:
+                    details[label] = f"{totals[key]:.1f} {unit}"
+
+        return {
+            "food_item": food_item,
+            "description": " ".join(summary.get("summary", "") for _, summary in lookups),
+            "details": details
+        }
+
+    async def generate_comprehensive_summary_async(self, vlm_analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Generates the nutritional summary by fanning out one lookup per identified item.
+
+        Args:
+            vlm_analysis: The output from the VLMAnalyzer, containing identified food items and context.
+
+        Returns:
+            A dictionary containing the food item, description, and nutritional details,
+            in the same shape as LangChainOrchestrator.
+        """
+        food_item = vlm_analysis.get("food_item_vlm", "Unknown Food")
+        items = split_food_items(food_item)
+        logger.info(f"Generating fast nutritional summary for {len(items)} items: {items}")
+        with track_stage("fast_summary"):
+            lookups = await self.lookup_items_async(items)
+        return self._aggregate(food_item, lookups)
+
+    async def stream_comprehensive_summary_async(self, vlm_analysis: Dict[str, Any]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Streaming variant of generate_comprehensive_summary_async. Yields a
+        ("nutrition_item", {...}) event as each lookup completes, then ("result", summary).
+        """
+        food_item = vlm_analysis.get("food_item_vlm", "Unknown Food")
+        items = split_food_items(food_item)
+
+        async def lookup(item: str) -> Tuple[str, Dict[str, Any]]:
+            return item, await self._lookup_async(item)
+
+        tasks = [asyncio.ensure_future(lookup(item)) for item in items]
+        lookups = {}
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                item, summary = await next_done
+                lookups[item] = summary
+                yield "nutrition_item", {"item": item, "summary": summary.get("summary", ""), "details": summary.get("details", {})}
+        finally:
+            for task in tasks:
+                task.cancel()
+        # Aggregate in the original item order so the description is stable.
+        yield "result", self._aggregate(food_item, [(item, lookups[item]) for item in items])
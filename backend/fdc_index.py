@@ -0,0 +1,350 @@
+"""
+Local, offline index of USDA FoodData Central foods.
+
+Build the index once from a FoodData Central bulk download
+(https://fdc.nal.usda.gov/download-datasets.html), either the CSV directory or one of
+the JSON files:
+
+    python fdc_index.py import ./FoodData_Central_csv_2024-04-18 --db ./data/fdc_index.sqlite3
+    python fdc_index.py import ./FoodData_Central_foundation_food_json_2024-04-18.json --db ./data/fdc_index.sqlite3
+
+Then point FDC_INDEX_PATH at the database, and NutritionAnalyzer will answer lookups
+locally and only call the USDA API for queries the index cannot match:
+
+    python fdc_index.py search "fried rice" --db ./data/fdc_index.sqlite3
+"""
+import argparse
+import csv
+import functools
+import itertools
+import json
+import logging
+import math
+import re
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# FoodData Central nutrient ids for the four macros NutritionAnalyzer reports.
+# Foundation foods often only carry the Atwater energy values, so those are fallbacks.
+ENERGY_NUTRIENT_IDS = (1008, 2047, 2048)
+PROTEIN_NUTRIENT_ID = 1003
+FAT_NUTRIENT_ID = 1004
+CARBOHYDRATE_NUTRIENT_ID = 1005
+MACRO_NUTRIENT_IDS = set(ENERGY_NUTRIENT_IDS) | {PROTEIN_NUTRIENT_ID, FAT_NUTRIENT_ID, CARBOHYDRATE_NUTRIENT_ID}
+
+# Generic (non-branded) datasets. Branded foods are millions of rows of product names
+# and are only imported when asked for explicitly.
+DEFAULT_DATA_TYPES = ("foundation_food", "sr_legacy_food", "survey_fndds_food")
+
+# Preferred when several foods match a query equally well.
+DATA_TYPE_PRIORITY = {
+    "foundation_food": 0,
+    "sr_legacy_food": 1,
+    "survey_fndds_food": 2,
+    "branded_food": 3,
+}
+
+JSON_DATA_TYPES = {
+    "Foundation": "foundation_food",
+    "SR Legacy": "sr_legacy_food",
+    "Survey (FNDDS)": "survey_fndds_food",
+    "Branded": "branded_food",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Connecting words that carry no meaning in a food name; matching on them alone pairs
+# unrelated dishes ("miso soup and edamame" with "pasta with tomato sauce and meat").
+STOPWORDS = frozenset((
+    "a", "an", "and", "as", "at", "by", "for", "from", "in", "into", "of", "on", "or",
+    "over", "some", "the", "to", "with", "without",
+))
+
+# Queries are cut to this many tokens.
+MAX_QUERY_TOKENS = 8
+
+# Most FTS queries a search runs after its exact match misses. Searches run on the event
+# loop, so a long query that matches nothing must stay cheap; the cap holds a miss to about
+# a millisecond instead of one query per token subset (92 for eight tokens).
+MAX_RELAXED_QUERIES = 16
+
+# One row: (fdc_id, description, data_type, calories, protein, carbohydrates, fat)
+FoodRow = Tuple[int, str, str, Optional[float], Optional[float], Optional[float], Optional[float]]
+
+
+def _macro_row(fdc_id: int, description: str, data_type: str, amounts: Dict[int, float]) -> FoodRow:
+    calories = next((amounts[i] for i in ENERGY_NUTRIENT_IDS if i in amounts), None)
+    return (
+        fdc_id,
+        description,
+        data_type,
+        calories,
+        amounts.get(PROTEIN_NUTRIENT_ID),
+        amounts.get(CARBOHYDRATE_NUTRIENT_ID),
+        amounts.get(FAT_NUTRIENT_ID),
+    )
+
+
+def read_csv_dump(directory: Path, data_types: Iterable[str]) -> Iterator[FoodRow]:
+    """
+    Reads foods and their macros from an FDC CSV download directory
+    (food.csv and food_nutrient.csv).
+    """
+    data_types = set(data_types)
+    foods: Dict[int, Tuple[str, str]] = {}
+    with open(directory / "food.csv", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            if row["data_type"] in data_types:
+                foods[int(row["fdc_id"])] = (row["description"], row["data_type"])
+    logger.info(f"Read {len(foods)} foods from {directory / 'food.csv'}")
+
+    amounts: Dict[int, Dict[int, float]] = {}
+    with open(directory / "food_nutrient.csv", newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            nutrient_id = int(row["nutrient_id"])
+            if nutrient_id not in MACRO_NUTRIENT_IDS:
+                continue
+            fdc_id = int(row["fdc_id"])
+            if fdc_id not in foods or not row["amount"]:
+                continue
+            amounts.setdefault(fdc_id, {})[nutrient_id] = float(row["amount"])
+
+    for fdc_id, (description, data_type) in foods.items():
+        yield _macro_row(fdc_id, description, data_type, amounts.get(fdc_id, {}))
+
+
+def read_json_dump(path: Path, data_types: Iterable[str]) -> Iterator[FoodRow]:
+    """
+    Reads foods and their macros from an FDC JSON download
+    (e.g. {"FoundationFoods": [...]} or {"SRLegacyFoods": [...]}).
+    """
+    data_types = set(data_types)
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    for foods in data.values():
+        for food in foods:
+            data_type = JSON_DATA_TYPES.get(food.get("dataType"), food.get("dataType", ""))
+            if data_type not in data_types:
+                continue
+            amounts = {}
+            for food_nutrient in food.get("foodNutrients", []):
+                nutrient_id = food_nutrient.get("nutrient", {}).get("id")
+                if nutrient_id in MACRO_NUTRIENT_IDS and food_nutrient.get("amount") is not None:
+                    amounts[nutrient_id] = float(food_nutrient["amount"])
+            yield _macro_row(int(food["fdcId"]), food.get("description", ""), data_type, amounts)
+
+
+def build_index(source: Path, db_path: Path, data_types: Iterable[str] = DEFAULT_DATA_TYPES) -> int:
+    """
+    Builds (or rebuilds) the SQLite index at `db_path` from an FDC bulk download.
+
+    Returns:
+        The number of foods indexed.
+    """
+    if source.is_dir():
+        rows = read_csv_dump(source, data_types)
+    elif source.suffix.lower() == ".json":
+        rows = read_json_dump(source, data_types)
+    else:
+        raise ValueError(f"Unsupported FoodData Central source {source}: expected a CSV directory or a .json file.")
+
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = db_path.with_suffix(db_path.suffix + ".tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(
+            """
+            CREATE TABLE foods (
+                fdc_id INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                data_type TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                calories REAL,
+                protein REAL,
+                carbohydrates REAL,
+                fat REAL
+            );
+            CREATE VIRTUAL TABLE foods_fts USING fts5(
+                description, content='foods', content_rowid='fdc_id', tokenize='porter unicode61'
+            );
+            """
+        )
+        count = 0
+        for row in rows:
+            fdc_id, description, data_type = row[:3]
+            conn.execute(
+                "INSERT OR REPLACE INTO foods VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (fdc_id, description, data_type, DATA_TYPE_PRIORITY.get(data_type, 9), *row[3:]),
+            )
+            count += 1
+        conn.execute("INSERT INTO foods_fts(foods_fts) VALUES ('rebuild')")
+        conn.execute("INSERT INTO foods_fts(foods_fts) VALUES ('optimize')")
+        conn.commit()
+    finally:
+        conn.close()
+
+    tmp_path.replace(db_path)
+    logger.info(f"Indexed {count} foods into {db_path}")
+    return count
+
+
+class FoodDataIndex:
+    def __init__(self, db_path: str, cache_size: int = 4096, min_coverage: float = 0.6):
+        """
+        Read-only full-text index over FoodData Central foods built by `build_index`.
+
+        Searches are tokenized and stemmed by SQLite FTS5, ignoring stopwords. Every query
+        token is required first (as a prefix), so "grilled chickens" still finds "Chicken,
+        broilers or fryers, grilled". If nothing matches, the search relaxes to foods that
+        contain at least `min_coverage` of the tokens, trying at most MAX_RELAXED_QUERIES
+        subsets, and otherwise returns None, so the caller can ask the USDA API instead of
+        using a food that shares a single word with the query. Results, misses included,
+        are memoized per normalized query.
+
+        Args:
+            db_path: Path to the SQLite index.
+            cache_size: Number of normalized queries whose results are memoized.
+            min_coverage: Share of the query tokens a partial match must contain. Two-word
+                          queries therefore need both words at the default of 0.6.
+        """
+        self.db_path = Path(db_path)
+        self.min_coverage = min_coverage
+        if not self.db_path.exists():
+            raise FileNotFoundError(f"FoodData Central index not found at {self.db_path}")
+        self._local = threading.local()
+        self._search_cached = functools.lru_cache(maxsize=cache_size)(self._search_uncached)
+        logger.info(f"FoodData Central local index opened at {self.db_path}")
+
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections must not be shared across threads; open one per thread.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _normalize(query: str) -> Tuple[str, ...]:
+        tokens = [token for token in _TOKEN_RE.findall(query.lower()) if token not in STOPWORDS]
+        # Drop repeated words, keeping their first position.
+        return tuple(dict.fromkeys(tokens))[:MAX_QUERY_TOKENS]
+
+    def _match(self, tokens: Tuple[str, ...]) -> Optional[tuple]:
+        # The last column is the bm25 rank; lower is better.
+        return self._connection().execute(
+            "SELECT f.fdc_id, f.description, f.data_type, f.calories, f.protein, f.carbohydrates, f.fat, "
+            "bm25(foods_fts) AS rank "
+            "FROM foods_fts JOIN foods f ON f.fdc_id = foods_fts.rowid "
+            "WHERE foods_fts MATCH ? "
+            "ORDER BY rank, f.priority, length(f.description) LIMIT 1",
+            (" AND ".join(f'"{token}"*' for token in tokens),),
+        ).fetchone()
+
+    def _search_uncached(self, tokens: Tuple[str, ...]) -> Optional[tuple]:
+        if not tokens:
+            return None
+        row = self._match(tokens)
+        if row is not None:
+            return row[:-1]
+
+        # Relax to the largest subsets of the tokens that still cover `min_coverage` of the
+        # query, taking the best-ranked food among subsets of the same size. Subsets are
+        # tried in query order, so the earlier (usually more specific) words are kept longest.
+        required = max(1, math.ceil(self.min_coverage * len(tokens) - 1e-9))
+        budget = MAX_RELAXED_QUERIES
+        for size in range(len(tokens) - 1, required - 1, -1):
+            subsets = list(itertools.islice(itertools.combinations(tokens, size), budget))
+            budget -= len(subsets)
+            rows = [row for row in map(self._match, subsets) if row is not None]
+            if rows:
+                return min(rows, key=lambda row: row[-1])[:-1]
+            if budget <= 0:
+                break
+        return None
+
+    def search(self, query: str) -> Optional[Dict]:
+        """
+        Returns the best-matching food with its macros (per 100 g), or None.
+        """
+        row = self._search_cached(self._normalize(query))
+        if row is None:
+            return None
+        fdc_id, description, data_type, calories, protein, carbohydrates, fat = row
+        return {
+            "fdc_id": fdc_id,
+            "description": description,
+            "data_type": data_type,
+            "calories": calories,
+            "protein": protein,
+            "carbohydrates": carbohydrates,
+            "fat": fat,
+        }
+
+    def search_json(self, query: str) -> Optional[str]:
+        """
+        Returns the best match serialized in the USDA `foods/search` response shape,
+        so it can stand in for the API response in NutritionAnalyzer. None if no match.
+        """
+        food = self.search(query)
+        if food is None:
+            return None
+        food_nutrients = []
+        for name, key, unit in (
+            ("Energy", "calories", "KCAL"),
+            ("Protein", "protein", "G"),
+            ("Carbohydrate, by difference", "carbohydrates", "G"),
+            ("Total lipid (fat)", "fat", "G"),
+        ):
+            if food[key] is not None:
+                food_nutrients.append({"nutrientName": name, "value": food[key], "unitName": unit})
+        return json.dumps({
+            "totalHits": 1,
+            "foods": [{
+                "fdcId": food["fdc_id"],
+                "description": food["description"],
+                "dataType": food["data_type"],
+                "foodNutrients": food_nutrients,
+            }],
+        })
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build and query the local FoodData Central index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Import an FDC bulk download into the index.")
+    import_parser.add_argument("source", type=Path, help="FDC CSV download directory or JSON file.")
+    import_parser.add_argument("--db", type=Path, default=Path("./data/fdc_index.sqlite3"))
+    import_parser.add_argument("--data-types", nargs="+", default=list(DEFAULT_DATA_TYPES),
+                               help="FDC data types to include (e.g. branded_food).")
+
+    search_parser = subparsers.add_parser("search", help="Look up a food in the index.")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--db", type=Path, default=Path("./data/fdc_index.sqlite3"))
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "import":
+        count = build_index(args.source, args.db, args.data_types)
+        print(f"Indexed {count} foods into {args.db}")
+    else:
+        index = FoodDataIndex(str(args.db))
+        started = time.perf_counter()
+        result = index.search(args.query)
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        print(json.dumps(result, indent=2) if result else f"No match for {args.query!r}")
+        print(f"Lookup took {elapsed_ms:.3f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
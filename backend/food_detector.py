@@ -1,30 +1,210 @@
-import tensorflow as tf
 import numpy as np
+import asyncio
 from PIL import Image
 from pathlib import Path
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 import logging
+import os
+import queue
+import threading
+import time
+
+from concurrency import run_in_cpu_executor
+from detector_backends import load_backend
+from image_pipeline import DecodedImage
+from metrics import DETECTOR_BATCH_SIZE, track_stage
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_MODEL_PATH = "./models/binary_food_detector.h5"
+
+# Queued by BatchingInferenceEngine.shutdown behind the pending inputs; the worker exits on it.
+_STOP = object()
+
+
+def load_image_array(image: Union[str, Path, DecodedImage], size) -> np.ndarray:
+    """
+    Loads a single image as a rescaled (height, width, 3) float32 array, exactly as the
+    detector model expects it.
+
+    Args:
+        image: A path to an image file, or an already-decoded in-memory upload.
+        size: (width, height) to resize to.
+    """
+    if isinstance(image, DecodedImage):
+        img = image.thumbnail(size)
+    else:
+        img = Image.open(image).convert("RGB").resize(size)
+    return np.asarray(img, dtype=np.float32) / 255.0 # Rescale to [0, 1]
+
+
+class BatchingInferenceEngine:
+    def __init__(self, predict_fn: Callable[[np.ndarray], np.ndarray],
+                 max_batch_size: int = 16, max_wait_ms: float = 5.0, name: str = "inference"):
+        """
+        Groups individual inference requests into micro-batches and runs one forward pass
+        per batch on a dedicated worker thread.
+
+        A batch is dispatched as soon as it holds `max_batch_size` inputs, or once the oldest
+        queued input has waited `max_wait_ms`, whichever comes first. If the forward pass
+        fails, every input of the batch receives the exception.
+
+        Args:
+            predict_fn: Callable taking a stacked batch of shape (N, ...) and returning an
+                        array whose first dimension is N.
+            max_batch_size: Upper bound on the number of inputs per forward pass.
+            max_wait_ms: Maximum time the first input of a batch waits for companions.
+            name: Name used for the worker thread and log messages.
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1.")
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(max_wait_ms, 0.0) / 1000.0
+        self.name = name
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_observed_batch = 0
+        self._total_queue_wait = 0.0
+        self._max_queue_wait = 0.0
+        self._total_inference_time = 0.0
+
+        self._worker = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._worker.start()
+        logger.info(f"{name} batching engine started (max_batch_size={max_batch_size}, "
+                    f"max_wait_ms={max_wait_ms}).")
+
+    def submit(self, item: np.ndarray) -> Future:
+        """
+        Queues a single (unbatched) input and returns a Future resolving to its output row.
+        """
+        future: Future = Future()
+        with self._stats_lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} batching engine has been shut down.")
+            self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops accepting inputs. Inputs already queued are still run, in batches as usual,
+        before the worker thread exits.
+
+        Args:
+            wait: Block until the queued inputs have been run and the worker has exited.
+        """
+        with self._stats_lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(_STOP)
+        if wait:
+            self._worker.join()
+
+    def _collect_batch(self) -> Tuple[List[tuple], bool]:
+        # Returns the next batch, and whether shutdown was reached behind it.
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = first[2] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                entry = self._queue.get_nowait() if remaining <= 0 else self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect_batch()
+            # Futures cancelled while queued are dropped before the forward pass.
+            batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                outputs = self.predict_fn(np.stack([entry[0] for entry in batch]))
+                if len(outputs) != len(batch):
+                    raise ValueError(f"predict_fn returned {len(outputs)} outputs for {len(batch)} inputs.")
+            except Exception as e:
+                logger.error(f"{self.name} batch inference failed for {len(batch)} inputs: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            for i, (_, future, _) in enumerate(batch):
+                future.set_result(outputs[i])
+
+            waits = [started - enqueued for _, _, enqueued in batch]
+            with self._stats_lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._max_observed_batch = max(self._max_observed_batch, len(batch))
+                self._total_queue_wait += sum(waits)
+                self._max_queue_wait = max(self._max_queue_wait, max(waits))
+                self._total_inference_time += finished - started
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns batch-size and queue-wait statistics accumulated since startup.
+        """
+        with self._stats_lock:
+            batches = self._batches
+            items = self._items
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": self._queue.qsize(),
+                "batches": batches,
+                "items": items,
+                "avg_batch_size": items / batches if batches else 0.0,
+                "max_observed_batch_size": self._max_observed_batch,
+                "avg_queue_wait_ms": (self._total_queue_wait / items * 1000.0) if items else 0.0,
+                "max_queue_wait_ms": self._max_queue_wait * 1000.0,
+                "avg_batch_inference_ms": (self._total_inference_time / batches * 1000.0) if batches else 0.0,
+            }
+
+
 class FoodDetector:
-    def __init__(self, model_path: str = "./models/binary_food_detector.h5"):
+    def __init__(self, model_path: Optional[str] = None, backend: Optional[str] = None):
         """
         Initializes the FoodDetector with a pre-trained binary classification model.
         This model determines if an image contains food or not.
 
         Args:
-            model_path: The path to the pre-trained Keras model file (.h5 or SavedModel format).
+            model_path: The path to the pre-trained model file: the Keras model (.h5 or SavedModel
+                        format), or a converted .tflite/.onnx version of it (see convert_detector.py).
+                        Defaults to FOOD_DETECTOR_MODEL_PATH, then to the bundled Keras model.
                         Expected to be a binary classifier for food/non-food.
+            backend: "keras", "tflite" or "onnx". Defaults to FOOD_DETECTOR_BACKEND, then to
+                     the backend matching the model file's extension.
         """
+        model_path = model_path or os.environ.get("FOOD_DETECTOR_MODEL_PATH", DEFAULT_MODEL_PATH)
+        backend = backend or os.environ.get("FOOD_DETECTOR_BACKEND") or None
+        num_threads = int(os.environ.get("FOOD_DETECTOR_NUM_THREADS", "0")) or None
+
         self.model_path = Path(model_path)
         if not self.model_path.exists():
             logger.error(f"Food detection model not found at {self.model_path}. "
                          "Please ensure the model file is placed in the correct location.")
             raise FileNotFoundError(f"Food detection model not found at {self.model_path}")
-        
+
         try:
-            self.model = tf.keras.models.load_model(self.model_path)
-            logger.info(f"Successfully loaded food detection model from {self.model_path}")
+            self.backend = load_backend(self.model_path, backend, num_threads)
+            logger.info(f"Successfully loaded food detection model from {self.model_path} "
+                        f"({self.backend.name} backend)")
         except Exception as e:
             logger.error(f"Error loading food detection model from {self.model_path}: {e}")
             raise RuntimeError(f"Failed to load food detection model: {e}")
@@ -32,23 +212,100 @@ class FoodDetector:
         self.img_height = 224 # Assuming MobileNetV3 input size
         self.img_width = 224  # Assuming MobileNetV3 input size
 
-    def preprocess_image(self, image_path):
+        self.engine = BatchingInferenceEngine(
+            self._predict_batch,
+            max_batch_size=int(os.environ.get("FOOD_DETECTOR_MAX_BATCH_SIZE", "16")),
+            max_wait_ms=float(os.environ.get("FOOD_DETECTOR_MAX_WAIT_MS", "5")),
+            name="food-detector",
+        )
+
+    def _predict_batch(self, batch: np.ndarray) -> np.ndarray:
+        DETECTOR_BATCH_SIZE.observe(len(batch))
+        with track_stage("detector_inference"):
+            return self.backend.predict(batch)
+
+    def _load_image_array(self, image: Union[str, Path, DecodedImage]) -> np.ndarray:
+        """
+        Loads a single image as a rescaled (height, width, 3) float32 array.
+
+        Args:
+            image: A path to an image file, or an already-decoded in-memory upload.
+        """
+        with track_stage("detector_preprocess"):
+            return load_image_array(image, (self.img_width, self.img_height))
+
+    def preprocess_image(self, image: Union[str, Path, DecodedImage]):
         """
         Preprocesses the image for the binary food detection model.
         """
-        img = Image.open(image_path).resize((self.img_width, self.img_height))
-        img_array = tf.keras.utils.img_to_array(img)
-        img_array = tf.expand_dims(img_array, 0) # Create a batch
-        img_array = img_array / 255.0 # Rescale to [0, 1]
-        return img_array
+        return np.expand_dims(self._load_image_array(image), 0) # Create a batch
 
-    def is_food(self, image_path):
+    def is_food(self, image: Union[str, Path, DecodedImage]):
         """
         Predicts whether the given image contains food.
         Returns True if food, False otherwise.
+
+        Concurrent callers are grouped into shared forward passes by the batching engine.
+        """
+        prediction = self.engine.submit(self._load_image_array(image)).result()
+        return self._verdict(prediction)
+
+    async def is_food_async(self, image: Union[str, Path, DecodedImage]) -> bool:
+        """
+        Async variant of is_food. Image preprocessing runs on the bounded CPU executor and
+        the batching engine's result is awaited without blocking the event loop.
         """
-        preprocessed_img = self.preprocess_image(image_path)
-        predictions = self.model.predict(preprocessed_img)
+        img_array = await run_in_cpu_executor(self._load_image_array, image)
+        prediction = await asyncio.wrap_future(self.engine.submit(img_array))
+        return self._verdict(prediction)
+
+    async def is_food_batch_async(self, images: List[Union[str, Path, DecodedImage]]) -> List[bool]:
+        """
+        Classifies many images at once. All images are preprocessed on the CPU executor and
+        queued together, so the batching engine runs them in full-size forward passes.
+        """
+        arrays = await asyncio.gather(*(run_in_cpu_executor(self._load_image_array, image) for image in images))
+        futures = [self.engine.submit(array) for array in arrays]
+        predictions = await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+        return [self._verdict(prediction) for prediction in predictions]
+
+    @staticmethod
+    def _verdict(prediction: np.ndarray) -> bool:
         # Assuming binary classification where 0 is food, 1 is non-food
         # A prediction closer to 0 indicates food.
-        return predictions[0][0] < 0.5 # Example threshold
+        return bool(prediction[0] < 0.5) # Example threshold
+
+    def warmup(self) -> Dict[str, float]:
+        """
+        Runs dummy images through the model so that graph tracing, kernel selection and
+        tensor allocation happen before the first real request.
+
+        Both a single image and a full batch are run, since those are the two shapes the
+        batching engine dispatches most; each new batch shape may trigger a retrace. The
+        backend is called directly, so warmup does not count towards the engine's statistics
+        or the detector metrics.
+
+        Returns:
+            Milliseconds taken per warmed batch size.
+        """
+        timings = {}
+        for batch_size in sorted({1, self.engine.max_batch_size}):
+            batch = np.zeros((batch_size, self.img_height, self.img_width, 3), dtype=np.float32)
+            started = time.perf_counter()
+            self.backend.predict(batch)
+            timings[str(batch_size)] = (time.perf_counter() - started) * 1000.0
+        logger.info(f"Food detector warmed up ({self.backend.name} backend): "
+                    + ", ".join(f"batch {size} in {ms:.1f} ms" for size, ms in timings.items()))
+        return timings
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns the batching engine's batch-size and queue-wait statistics.
+        """
+        return self.engine.get_stats()
+
+    def close(self):
+        """
+        Runs the images still queued for the detector, then stops its batching engine.
+        """
+        self.engine.shutdown()
@@ -0,0 +1,496 @@
+import asyncio
+import base64
+import heapq
+import io
+import itertools
+import logging
+import math
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, List, Optional, Tuple, TypeVar, Union
+
+import groq
+from PIL import Image
+
+from metrics import GROQ_CONCURRENCY_LIMIT, GROQ_QUEUE_SECONDS, GROQ_RETRIES
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Groq calls are dispatched lowest priority first. Endpoints set the priority for the
+# calls made on behalf of their request; interactive uploads are the default.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+
+class SharedPriority:
+    def __init__(self, value: int):
+        """
+        Priority of work shared by several requests, such as a coalesced analysis: the most
+        urgent priority among the requests waiting on it. When a more urgent request joins,
+        the priority rises and calls already queued for the work move up the queue.
+        """
+        self.value = value
+        self._listeners: List[Callable[[], None]] = []
+
+    def raise_to(self, value: int):
+        if value < self.value:
+            self.value = value
+            for listener in list(self._listeners):
+                listener()
+
+    def subscribe(self, listener: Callable[[], None]) -> Callable[[], None]:
+        """
+        Calls `listener` whenever the priority rises; returns a function that unsubscribes it.
+        """
+        self._listeners.append(listener)
+        return lambda: self._listeners.remove(listener)
+
+
+def priority_value(priority: Union[int, SharedPriority]) -> int:
+    return priority.value if isinstance(priority, SharedPriority) else priority
+
+
+groq_priority_var: ContextVar[Union[int, SharedPriority]] = ContextVar("groq_priority", default=PRIORITY_INTERACTIVE)
+
+# Llama 3.2 Vision splits images into 560px tiles (at most 4) of about 1601 tokens each.
+_IMAGE_TILE_SIZE = 560
+_IMAGE_TOKENS_PER_TILE = 1601
+_IMAGE_MAX_TILES = 4
+# Enough of a base64 image to hold its header, so its size can be read without decoding it all.
+_IMAGE_HEADER_CHARS = 65536
+
+
+class GroqRateLimitError(Exception):
+    """
+    Raised when a Groq call could not be made within the account's rate limits,
+    either because it waited too long for a slot or because retries ran out.
+    """
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        """
+        A token bucket refilled continuously at `per_minute` / 60 per second, holding at
+        most one minute's worth. A limit of 0 disables the bucket.
+
+        The bucket is shared by the event loop and by synchronous calls on worker threads,
+        so its balance is updated under a lock.
+        """
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def clamp(self, amount: float) -> float:
+        """
+        Caps one request's charge at the bucket's capacity. An oversized estimate would
+        otherwise drive the balance far below zero and stall every other caller until
+        it had refilled.
+        """
+        return min(amount, self.capacity) if self.capacity > 0 else amount
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """
+        Returns how many seconds until `amount` can be taken (0 if it can be taken now).
+        Requests larger than the bucket only need a full bucket.
+        """
+        if self.capacity <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            missing = self.clamp(amount) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def take(self, amount: float):
+        """
+        Removes `amount` from the bucket; a negative amount returns unused budget.
+        The balance may go negative when actual usage exceeded the estimate.
+        """
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+def _image_tokens(url: str) -> int:
+    width = height = None
+    if url.startswith("data:") and "," in url:
+        encoded = url.split(",", 1)[1][:_IMAGE_HEADER_CHARS]
+        try:
+            with Image.open(io.BytesIO(base64.b64decode(encoded[:len(encoded) // 4 * 4]))) as img:
+                width, height = img.size
+        except Exception:
+            pass
+    if not width or not height:
+        return _IMAGE_TOKENS_PER_TILE * _IMAGE_MAX_TILES
+    tiles = math.ceil(width / _IMAGE_TILE_SIZE) * math.ceil(height / _IMAGE_TILE_SIZE)
+    return _IMAGE_TOKENS_PER_TILE * min(_IMAGE_MAX_TILES, tiles)
+
+
+def estimate_tokens(messages: List[Any], completion_tokens: int = 0, extra_text: str = "") -> int:
+    """
+    Estimates the tokens a chat request will be billed for: about four characters per text
+    token, images by their tile count, plus the expected completion length.
+
+    Args:
+        messages: LangChain messages (or (role, text) tuples) making up the prompt.
+        completion_tokens: Expected completion length.
+        extra_text: Other prompt text sent along, e.g. a system prompt or tool schemas.
+    """
+    chars = len(extra_text)
+    image_tokens = 0
+    for message in messages:
+        content = message[1] if isinstance(message, tuple) else getattr(message, "content", message)
+        parts = content if isinstance(content, list) else [content]
+        for part in parts:
+            if isinstance(part, dict) and part.get("type") == "image_url":
+                image_url = part.get("image_url")
+                image_tokens += _image_tokens(image_url.get("url", "") if isinstance(image_url, dict) else str(image_url))
+            elif isinstance(part, dict):
+                chars += len(str(part.get("text", "")))
+            else:
+                chars += len(str(part))
+    return chars // 4 + image_tokens + completion_tokens
+
+
+def response_tokens(message: Any) -> Optional[int]:
+    """
+    Returns the total tokens billed for a model response, or None if it carried no usage.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    total = usage.get("total_tokens")
+    return int(total) if total else None
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    return error.status_code if isinstance(error, groq.APIStatusError) else None
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+class _Waiter:
+    def __init__(self, tokens: int, future: asyncio.Future):
+        self.tokens = tokens
+        self.future = future
+
+
+class GroqScheduler:
+    def __init__(self, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_concurrency: int = 16, min_concurrency: int = 1, max_retries: int = 3,
+                 queue_timeout: float = 30.0, backoff_seconds: float = 0.5):
+        """
+        Shares the account's Groq rate limits between every Groq call in the process.
+
+        Calls wait in a priority queue and are dispatched when they fit the request and
+        token budgets (token buckets refilled per minute) and the concurrency limit. The
+        concurrency limit adapts AIMD-style: it grows by about one per limit's worth of
+        successful calls and halves on a 429, at most once per `retry-after` window. A 429
+        also pauses all dispatching until its `retry-after` has passed, so the queue drains
+        at the rate Groq accepts instead of retrying into it.
+
+        Args:
+            requests_per_minute: Account request limit; 0 disables request budgeting.
+            tokens_per_minute: Account token limit; 0 disables token budgeting.
+            max_concurrency: Upper bound (and starting value) of the adaptive concurrency limit.
+            min_concurrency: Lower bound of the adaptive concurrency limit.
+            max_retries: Retries per call after a 429, a 5xx or a connection error.
+            queue_timeout: Longest a call may wait for a slot before GroqRateLimitError is raised.
+            backoff_seconds: Base of the exponential backoff when no `retry-after` is given.
+        """
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        self.backoff_seconds = backoff_seconds
+
+        self._limit = float(self.max_concurrency)
+        self._in_flight = 0
+        self._queue: List[Tuple[int, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._decrease_holdoff_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._stats = {"calls": 0, "succeeded": 0, "failed": 0, "rate_limited": 0, "retries": 0, "queue_timeouts": 0}
+        # run_sync updates the budgets, the pause, the limit and the stats from worker threads.
+        self._lock = threading.Lock()
+        GROQ_CONCURRENCY_LIMIT.set(self._limit)
+
+    @classmethod
+    def from_env(cls) -> "GroqScheduler":
+        return cls(
+            requests_per_minute=float(os.environ.get("GROQ_REQUESTS_PER_MINUTE", "0")),
+            tokens_per_minute=float(os.environ.get("GROQ_TOKENS_PER_MINUTE", "0")),
+            max_concurrency=int(os.environ.get("GROQ_MAX_CONCURRENCY", "16")),
+            min_concurrency=int(os.environ.get("GROQ_MIN_CONCURRENCY", "1")),
+            max_retries=int(os.environ.get("GROQ_MAX_RETRIES", "3")),
+            queue_timeout=float(os.environ.get("GROQ_QUEUE_TIMEOUT_SECONDS", "30")),
+        )
+
+    async def run(self, func: Callable[[], Awaitable[T]], estimated_tokens: int,
+                  priority: Optional[Union[int, SharedPriority]] = None,
+                  actual_tokens: Optional[Callable[[T], Optional[int]]] = None) -> T:
+        """
+        Runs one Groq call once it fits the rate limits, retrying transient failures.
+
+        Args:
+            func: Zero-argument callable returning the awaitable that makes the call.
+                  It is called again for each retry.
+            estimated_tokens: Tokens reserved from the budget before the call; see estimate_tokens.
+            priority: Queue priority; defaults to the current request's groq_priority_var.
+            actual_tokens: Extracts the billed tokens from the result, to correct the budget.
+
+        Returns:
+            The result of the call.
+
+        Raises:
+            GroqRateLimitError: No slot became free within the queue timeout, or the call
+                was still rate limited after the last retry.
+        """
+        priority = groq_priority_var.get() if priority is None else priority
+        estimated_tokens = self.tokens.clamp(estimated_tokens)
+        self._count("calls")
+        attempt = 0
+        while True:
+            await self._acquire(priority, estimated_tokens)
+            try:
+                result = await func()
+            except asyncio.CancelledError:
+                self._release()
+                raise
+            except Exception as e:
+                status_code = _status_code(e)
+                # Rejected calls are not billed, so their reservation goes back to the budget.
+                self.tokens.take(-estimated_tokens)
+                self._release(rate_limited=status_code == 429, retry_after=_retry_after(e))
+                retryable = (status_code is not None and (status_code == 429 or status_code >= 500)) \
+                    or isinstance(e, groq.APIConnectionError)
+                if not retryable or attempt == self.max_retries:
+                    self._count("failed")
+                    if status_code == 429:
+                        raise GroqRateLimitError(f"Groq rate limit still exceeded after {attempt} retries.",
+                                                 self._pause_remaining() or self.backoff_seconds) from e
+                    raise
+                reason = "rate_limited" if status_code == 429 else "server_error" if status_code else "connection"
+                self._count("retries")
+                GROQ_RETRIES.labels(reason).inc()
+                logger.warning(f"Groq call failed ({reason}), retry {attempt + 1} of {self.max_retries}.")
+                if status_code != 429:
+                    # 429s wait for the shared pause in _acquire; other errors back off per call.
+                    await asyncio.sleep(self.backoff_seconds * (2 ** attempt) * random.uniform(0.5, 1.5))
+                attempt += 1
+                continue
+            self._release(succeeded=True)
+            self._count("succeeded")
+            self._correct_tokens(result, estimated_tokens, actual_tokens)
+            return result
+
+    def _correct_tokens(self, result: T, estimated_tokens: int,
+                        actual_tokens: Optional[Callable[[T], Optional[int]]]):
+        # Replaces the reservation with the billed usage.
+        if actual_tokens is not None:
+            actual = actual_tokens(result)
+            if actual is not None:
+                self.tokens.take(self.tokens.clamp(actual) - estimated_tokens)
+
+    def run_sync(self, func: Callable[[], T], estimated_tokens: int,
+                 actual_tokens: Optional[Callable[[T], Optional[int]]] = None) -> T:
+        """
+        Blocking counterpart of run for the synchronous code paths. It charges the same
+        request and token budgets as run, sleeping until they allow the call, and shares
+        its rate-limit state: a 429 pauses every caller and lowers the concurrency limit,
+        and successes raise it again. It does not take a place in the priority queue or a
+        concurrency slot, which need the event loop.
+        """
+        estimated_tokens = self.tokens.clamp(estimated_tokens)
+        self._count("calls")
+        deadline = time.monotonic() + self.queue_timeout
+        attempt = 0
+        while True:
+            wait = self._reserve(estimated_tokens)
+            if wait > 0:
+                if time.monotonic() + wait > deadline:
+                    self._count("queue_timeouts")
+                    raise GroqRateLimitError(f"No Groq capacity within {self.queue_timeout:.0f}s.", wait)
+                time.sleep(wait)
+                continue
+            try:
+                result = func()
+            except Exception as e:
+                status_code = _status_code(e)
+                self.tokens.take(-estimated_tokens)
+                if status_code == 429:
+                    self._record_rate_limit(_retry_after(e))
+                retryable = (status_code is not None and (status_code == 429 or status_code >= 500)) \
+                    or isinstance(e, groq.APIConnectionError)
+                if not retryable or attempt == self.max_retries:
+                    self._count("failed")
+                    if status_code == 429:
+                        raise GroqRateLimitError(f"Groq rate limit still exceeded after {attempt} retries.",
+                                                 self._pause_remaining() or self.backoff_seconds) from e
+                    raise
+                reason = "rate_limited" if status_code == 429 else "server_error" if status_code else "connection"
+                self._count("retries")
+                GROQ_RETRIES.labels(reason).inc()
+                logger.warning(f"Groq call failed ({reason}), retry {attempt + 1} of {self.max_retries}.")
+                if status_code != 429:
+                    # 429s wait for the shared pause in _reserve; other errors back off per call.
+                    time.sleep(self.backoff_seconds * (2 ** attempt) * random.uniform(0.5, 1.5))
+                attempt += 1
+                continue
+            self._record_success()
+            self._count("succeeded")
+            self._correct_tokens(result, estimated_tokens, actual_tokens)
+            return result
+
+    async def _acquire(self, priority: Union[int, SharedPriority], tokens: int):
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(tokens, loop.create_future())
+        heapq.heappush(self._queue, (priority_value(priority), next(self._sequence), waiter))
+        queued_at = time.monotonic()
+        unsubscribe = None
+        if isinstance(priority, SharedPriority):
+            unsubscribe = priority.subscribe(lambda: self._requeue(priority.value, waiter))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(waiter.future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._count("queue_timeouts")
+            raise GroqRateLimitError(
+                f"No Groq capacity within {self.queue_timeout:.0f}s.",
+                self._pause_remaining() or self.backoff_seconds,
+            )
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted just as the caller went away.
+                self._release()
+            raise
+        finally:
+            if unsubscribe is not None:
+                unsubscribe()
+            GROQ_QUEUE_SECONDS.labels("batch" if priority_value(priority) >= PRIORITY_BATCH else "interactive").observe(
+                time.monotonic() - queued_at)
+
+    def _requeue(self, priority: int, waiter: _Waiter):
+        # The old entry stays in the heap and is dropped by _dispatch once the waiter is done.
+        if not waiter.future.done():
+            heapq.heappush(self._queue, (priority, next(self._sequence), waiter))
+            self._dispatch()
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._queue:
+            waiter = self._queue[0][2]
+            if waiter.future.done():
+                # Timed out or cancelled while queued, or already dispatched from a requeued entry.
+                heapq.heappop(self._queue)
+                continue
+            if self._in_flight >= int(self._limit):
+                return  # _release dispatches again
+            wait = self._reserve(waiter.tokens)
+            if wait > 0:
+                # Only the head waits, so a large request is not starved by smaller ones behind it.
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._queue)
+            self._in_flight += 1
+            waiter.future.set_result(None)
+
+    def _reserve(self, tokens: int) -> float:
+        """
+        Takes one request and `tokens` from the budgets if the call may start now, and
+        otherwise returns how many seconds to wait before trying again.
+        """
+        with self._lock:
+            wait = max(self._pause_remaining(), self.requests.wait_time(1), self.tokens.wait_time(tokens))
+            if wait <= 0:
+                self.requests.take(1)
+                self.tokens.take(tokens)
+            return wait
+
+    def _release(self, succeeded: bool = False, rate_limited: bool = False, retry_after: Optional[float] = None):
+        self._in_flight -= 1
+        if rate_limited:
+            self._record_rate_limit(retry_after)
+        elif succeeded:
+            self._record_success()
+        self._dispatch()
+
+    def _record_rate_limit(self, retry_after: Optional[float]):
+        # Pauses dispatching until `retry_after` has passed and halves the concurrency limit.
+        now = time.monotonic()
+        pause = retry_after if retry_after is not None else self.backoff_seconds
+        with self._lock:
+            self._stats["rate_limited"] += 1
+            self._paused_until = max(self._paused_until, now + pause)
+            if now >= self._decrease_holdoff_until:
+                # One decrease per rate-limit window: the 429s of a burst all report the same overload.
+                self._limit = max(float(self.min_concurrency), self._limit / 2)
+                self._decrease_holdoff_until = now + max(pause, 1.0)
+                logger.info(f"Groq rate limited; concurrency limit lowered to {int(self._limit)}.")
+            GROQ_CONCURRENCY_LIMIT.set(self._limit)
+
+    def _record_success(self):
+        with self._lock:
+            self._limit = min(float(self.max_concurrency), self._limit + 1.0 / self._limit)
+            GROQ_CONCURRENCY_LIMIT.set(self._limit)
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _pause_remaining(self) -> float:
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            **stats,
+            "concurrency_limit": int(self._limit),
+            "in_flight": self._in_flight,
+            "queued": len({id(waiter) for _, _, waiter in self._queue if not waiter.future.done()}),
+            "paused_seconds": round(self._pause_remaining(), 3),
+            "request_budget": round(self.requests.tokens, 1) if self.requests.capacity else None,
+            "token_budget": round(self.tokens.tokens, 1) if self.tokens.capacity else None,
+        }
+
+
+_scheduler: Optional[GroqScheduler] = None
+
+
+def get_groq_scheduler() -> GroqScheduler:
+    """
+    Returns the process-wide Groq scheduler shared by the VLM and the agent LLM,
+    creating it from the environment on first use.
+    """
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = GroqScheduler.from_env()
+        logger.info(f"Groq scheduler started: {_scheduler.get_stats()}")
+    return _scheduler
@@ -0,0 +1,117 @@
+import hashlib
+import io
+import logging
+from typing import Optional, Tuple
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Formats that can be forwarded to the VLM as-is, keyed by PIL format name.
+PIL_FORMAT_MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "GIF": "image/gif",
+    "WEBP": "image/webp",
+}
+
+
+class ImageTooLargeError(ValueError):
+    """
+    Raised for images whose header declares more pixels than PIL will open
+    (twice Image.MAX_IMAGE_PIXELS), i.e. decompression bombs.
+    """
+
+
+class DecodedImage:
+    def __init__(self, raw_bytes: bytes, filename: str = "upload"):
+        """
+        Holds an uploaded image in memory so every pipeline stage can share it
+        without touching the disk.
+
+        The header is parsed once on construction. Pixel data is decoded lazily and
+        at most once per requested resolution: the detector asks for a small thumbnail,
+        which uses PIL draft mode to decode JPEGs at a reduced scale, and the VLM stage
+        can forward the original bytes without decoding at all.
+
+        Args:
+            raw_bytes: The uploaded file content.
+            filename: The client-supplied filename, used for logging only.
+
+        Raises:
+            ImageTooLargeError: If PIL refuses the image as a decompression bomb.
+            ValueError: If the bytes are not a readable image.
+        """
+        self.raw_bytes = raw_bytes
+        self.filename = filename
+        try:
+            header = Image.open(io.BytesIO(raw_bytes))
+        except Image.DecompressionBombError as e:
+            raise ImageTooLargeError(f"Uploaded file {filename} is too large to decode: {e}")
+        except Exception as e:
+            raise ValueError(f"Uploaded file {filename} is not a valid image: {e}")
+        self.format = header.format or "JPEG"
+        self.size = header.size
+        self.mode = header.mode
+        # Parsed from the header: JPEG APP1 and WebP EXIF chunks are read by Image.open.
+        self.has_exif = bool(header.info.get("exif"))
+        self._full: Optional[Image.Image] = None
+        self._thumbnails = {}
+        self._digest: Optional[str] = None
+
+    @property
+    def digest(self) -> str:
+        """
+        SHA-256 hex digest of the uploaded bytes, computed once. Identifies identical uploads
+        for the result cache and for coalescing concurrent requests.
+        """
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.raw_bytes).hexdigest()
+        return self._digest
+
+    @property
+    def mime_type(self) -> str:
+        return PIL_FORMAT_MIME_TYPES.get(self.format, f"image/{self.format.lower()}")
+
+    def _open(self) -> Image.Image:
+        return Image.open(io.BytesIO(self.raw_bytes))
+
+    @property
+    def image(self) -> Image.Image:
+        """
+        The full-resolution decoded image, decoded on first access and then reused.
+        """
+        if self._full is None:
+            img = self._open()
+            img.load()
+            self._full = img
+        return self._full
+
+    def thumbnail(self, size: Tuple[int, int]) -> Image.Image:
+        """
+        Returns an RGB image resized to exactly `size`.
+
+        JPEGs are decoded in draft mode at the smallest DCT scale that is still at least
+        `size`, which skips most of the decode work for large photos. If the full image
+        has already been decoded it is reused instead.
+        """
+        if size not in self._thumbnails:
+            if self._full is not None:
+                img = self._full
+            else:
+                img = self._open()
+                if img.format == "JPEG":
+                    img.draft("RGB", size)
+            self._thumbnails[size] = img.convert("RGB").resize(size)
+        return self._thumbnails[size]
+
+
+def decode_upload(raw_bytes: bytes, filename: str = "upload") -> DecodedImage:
+    """
+    Wraps uploaded bytes in a DecodedImage shared by the detector and the VLM stages.
+    """
+    decoded = DecodedImage(raw_bytes, filename)
+    decoded.digest # Hash here, on the CPU executor, rather than later on the event loop
+    logger.info(f"Decoded upload {filename}: {decoded.format} {decoded.size[0]}x{decoded.size[1]}, "
+                f"{len(raw_bytes)} bytes")
+    return decoded
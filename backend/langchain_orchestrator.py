@@ -1,5 +1,6 @@
+import ast
 import logging
-from typing import Dict, Any
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
 import os
 import re
 
@@ -7,10 +8,44 @@ from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.tools import Tool
 from langchain_groq import ChatGroq
 from langchain.agents import create_agent
+from langchain.agents.middleware import AgentMiddleware
 from langchain_core.prompts import ChatPromptTemplate
 
+from groq_scheduler import GroqRateLimitError, GroqScheduler, estimate_tokens, get_groq_scheduler, response_tokens
+from metrics import record_agent_messages, track_stage
+
 logger = logging.getLogger(__name__)
 
+# Expected length of one agent turn (a tool call or the totals), reserved from the token budget up front.
+AGENT_COMPLETION_TOKENS = 300
+
+class GroqSchedulerMiddleware(AgentMiddleware):
+    def __init__(self, scheduler: GroqScheduler):
+        """
+        Sends each of the agent's model calls through the shared Groq scheduler,
+        so agent turns queue and retry alongside the VLM calls.
+        """
+        super().__init__()
+        self.scheduler = scheduler
+
+    @staticmethod
+    def _estimate(request) -> int:
+        messages = [request.system_message, *request.messages] if request.system_message else list(request.messages)
+        tool_text = "".join(f"{getattr(tool, 'name', '')}{getattr(tool, 'description', '')}" for tool in request.tools or [])
+        return estimate_tokens(messages, AGENT_COMPLETION_TOKENS, extra_text=tool_text)
+
+    @staticmethod
+    def _actual_tokens(response) -> Optional[int]:
+        return response_tokens(response.result[-1]) if response.result else None
+
+    async def awrap_model_call(self, request, handler):
+        return await self.scheduler.run(lambda: handler(request), self._estimate(request),
+                                        actual_tokens=self._actual_tokens)
+
+    def wrap_model_call(self, request, handler):
+        return self.scheduler.run_sync(lambda: handler(request), self._estimate(request),
+                                       actual_tokens=self._actual_tokens)
+
 class LangChainOrchestrator:
     def __init__(self, nutrition_analyzer_instance):
         """
@@ -32,10 +67,12 @@ class LangChainOrchestrator:
         # Default to a versatile Groq model
         groq_llm_model = os.environ.get("GROQ_LLM_MODEL", "llama-3.3-70b-versatile")
 
+        # Retries are left to the shared scheduler, which knows about the other Groq traffic.
         self.llm = ChatGroq(
             temperature=0,
             model_name=groq_llm_model,
-            api_key=groq_api_key
+            api_key=groq_api_key,
+            max_retries=0
         )
         logger.info(f"Groq LLM configured with model: {groq_llm_model}")
 
@@ -44,6 +81,7 @@ class LangChainOrchestrator:
             Tool(
                 name="Nutrition_Analyzer",
                 func=self.nutrition_analyzer.get_nutritional_summary,
+                coroutine=self.nutrition_analyzer.get_nutritional_summary_async,
                 description="Useful for getting nutritional information for a given food item. Input should be a single food item name (string)."
             )
         ]
@@ -57,9 +95,62 @@ class LangChainOrchestrator:
         self.agent_executor = create_agent(
             model=self.llm,
             tools=self.tools,
-            system_prompt=system_prompt
+            system_prompt=system_prompt,
+            middleware=[GroqSchedulerMiddleware(get_groq_scheduler())]
         )
 
+    @staticmethod
+    def _agent_prompt(vlm_analysis: Dict[str, Any]) -> Dict[str, Any]:
+        food_item = vlm_analysis.get("food_item_vlm", "Unknown Food")
+        vlm_description = vlm_analysis.get("description", "")
+        return {
+            "messages": [("human", f"The VLM identified the following food: {food_item}. Additional VLM context: {vlm_description}. Please provide a comprehensive nutritional analysis.")]
+        }
+
+    @staticmethod
+    def _parse_agent_response(food_item: str, agent_response: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Extracts the final agent message and parses the total nutritional facts out of it.
+        """
+        # Extract output from the messages in the response
+        detailed_output = agent_response.get("messages", [])[-1].content if agent_response.get("messages") else ""
+        logger.debug(f"LangChain Agent detailed output: {detailed_output}")
+
+        # Parse the detailed output for nutritional facts
+        # The regex parsing remains the same as it targets the specific format requested in the prompt
+        description = ""
+        details = {}
+
+        nutritional_facts_str = detailed_output
+
+        # Parse nutritional facts
+        calories_match = re.search(r"- \*\*Calories\*\*:\s*([^\n]+)", nutritional_facts_str, re.IGNORECASE)
+        if calories_match: details["Calories"] = calories_match.group(1).strip()
+
+        protein_match = re.search(r"- \*\*Protein\*\*:\s*([^\n]+)", nutritional_facts_str, re.IGNORECASE)
+        if protein_match: details["Protein"] = protein_match.group(1).strip()
+
+        carbohydrates_match = re.search(r"- \*\*Carbohydrates\*\*:\s*([^\n]+)", nutritional_facts_str, re.IGNORECASE)
+        if carbohydrates_match: details["Carbohydrates"] = carbohydrates_match.group(1).strip()
+
+        fat_match = re.search(r"- \*\*Fat\*\*:\s*([^\n]+)", nutritional_facts_str, re.IGNORECASE)
+        if fat_match: details["Fat"] = fat_match.group(1).strip()
+
+        return {
+            "food_item": food_item,
+            "description": description,
+            "details": details
+        }
+
+    @staticmethod
+    def _failure_result(food_item: str, e: Exception) -> Dict[str, Any]:
+        logger.exception(f"Error invoking LangChain agent or parsing output: {e}")
+        return {
+            "food_item": food_item,
+            "description": f"Failed to generate a comprehensive summary due to an internal error: {e}",
+            "details": {}
+        }
+
     def generate_comprehensive_summary(self, vlm_analysis: Dict[str, Any]) -> Dict[str, Any]:
         """
         Generates a comprehensive nutritional summary using VLM analysis and a LangChain agent,
@@ -72,51 +163,76 @@ class LangChainOrchestrator:
             A dictionary containing the food item, description, and nutritional details.
         """
         logger.info("Generating comprehensive summary with LangChainOrchestrator using agent.")
-        
-        food_item = vlm_analysis.get("food_item_vlm", "Unknown Food")
-        vlm_description = vlm_analysis.get("description", "")
 
+        food_item = vlm_analysis.get("food_item_vlm", "Unknown Food")
         try:
             # Invoke the LangChain agent to get a detailed response
-            agent_response = self.agent_executor.invoke({
-                "messages": [("human", f"The VLM identified the following food: {food_item}. Additional VLM context: {vlm_description}. Please provide a comprehensive nutritional analysis.")]
-            })
-            # Extract output from the messages in the response
-            detailed_output = agent_response.get("messages", [])[-1].content if agent_response.get("messages") else ""
-            logger.info(f"LangChain Agent detailed output: {detailed_output}")
-
-            # Parse the detailed output for nutritional facts
-            # The regex parsing remains the same as it targets the specific format requested in the prompt
-            description = ""
-            details = {}
-
-            nutritional_facts_str = detailed_output
-
-            # Parse nutritional facts
-            calories_match = re.search(r"- \*\*Calories\*\*:\s*([^\n]+)", nutritional_facts_str, re.IGNORECASE)
-            if calories_match: details["Calories"] = calories_match.group(1).strip()
-
-            protein_match = re.search(r"- \*\*Protein\*\*:\s*([^\n]+)", nutritional_facts_str, re.IGNORECASE)
-            if protein_match: details["Protein"] = protein_match.group(1).strip()
+            with track_stage("agent"):
+                agent_response = self.agent_executor.invoke(self._agent_prompt(vlm_analysis))
+            record_agent_messages(agent_response.get("messages", []))
+            return self._parse_agent_response(food_item, agent_response)
+        except GroqRateLimitError:
+            raise
+        except Exception as e:
+            return self._failure_result(food_item, e)
 
-            carbohydrates_match = re.search(r"- \*\*Carbohydrates\*\*:\s*([^\n]+)", nutritional_facts_str, re.IGNORECASE)
-            if carbohydrates_match: details["Carbohydrates"] = carbohydrates_match.group(1).strip()
+    async def generate_comprehensive_summary_async(self, vlm_analysis: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Async variant of generate_comprehensive_summary. The agent runs via `ainvoke`, and its
+        tool calls use the NutritionAnalyzer's async HTTP client.
+        """
+        logger.info("Generating comprehensive summary with LangChainOrchestrator using agent (async).")
 
-            fat_match = re.search(r"- \*\*Fat\*\*:\s*([^\n]+)", nutritional_facts_str, re.IGNORECASE)
-            if fat_match: details["Fat"] = fat_match.group(1).strip()
+        food_item = vlm_analysis.get("food_item_vlm", "Unknown Food")
+        try:
+            with track_stage("agent"):
+                agent_response = await self.agent_executor.ainvoke(self._agent_prompt(vlm_analysis))
+            record_agent_messages(agent_response.get("messages", []))
+            return self._parse_agent_response(food_item, agent_response)
+        except GroqRateLimitError:
+            raise
+        except Exception as e:
+            return self._failure_result(food_item, e)
 
-            return {
-                "food_item": food_item,
-                "description": description,
-                "details": details
-            }
+    async def stream_comprehensive_summary_async(self, vlm_analysis: Dict[str, Any]) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Streaming variant of generate_comprehensive_summary_async. Yields a
+        ("nutrition_item", {...}) event for each Nutrition_Analyzer tool result as the agent
+        produces it, then ("result", summary) once the agent has finished.
+        """
+        logger.info("Streaming comprehensive summary with LangChainOrchestrator using agent.")
 
+        food_item = vlm_analysis.get("food_item_vlm", "Unknown Food")
+        messages = []
+        tool_inputs = {}
+        try:
+            with track_stage("agent"):
+                async for update in self.agent_executor.astream(self._agent_prompt(vlm_analysis), stream_mode="updates"):
+                    for node_update in update.values():
+                        for message in (node_update or {}).get("messages", []):
+                            messages.append(message)
+                            # Remember which item each tool call asked for, to label its result.
+                            for tool_call in getattr(message, "tool_calls", None) or []:
+                                args = tool_call.get("args") or {}
+                                tool_inputs[tool_call.get("id")] = next(iter(args.values()), "") if isinstance(args, dict) else str(args)
+                            if getattr(message, "type", None) == "tool":
+                                yield "nutrition_item", self._tool_event(tool_inputs.get(message.tool_call_id, ""), message.content)
+            record_agent_messages(messages)
+            yield "result", self._parse_agent_response(food_item, {"messages": messages})
+        except GroqRateLimitError:
+            raise
         except Exception as e:
-            import traceback
-            traceback.print_exc()
-            logger.error(f"Error invoking LangChain agent or parsing output: {e}")
-            return {
-                "food_item": food_item,
-                "description": f"Failed to generate a comprehensive summary due to an internal error: {e}",
-                "details": {}
-            }
+            yield "result", self._failure_result(food_item, e)
+
+    @staticmethod
+    def _tool_event(item: str, content: Any) -> Dict[str, Any]:
+        # Tool results arrive stringified; recover the NutritionAnalyzer dict when possible.
+        summary = content
+        if isinstance(content, str):
+            try:
+                summary = ast.literal_eval(content)
+            except (ValueError, SyntaxError):
+                summary = {"summary": content, "details": {}}
+        if not isinstance(summary, dict):
+            summary = {"summary": str(content), "details": {}}
+        return {"item": item, "summary": summary.get("summary", ""), "details": summary.get("details", {})}
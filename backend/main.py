@@ -1,35 +1,191 @@
+import asyncio
+import io
+import json
 import logging
-from fastapi import FastAPI, UploadFile, File, HTTPException, status
+import math
+import os
+import time
+import uuid
+import zipfile
+from pathlib import PurePosixPath
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi import Depends, FastAPI, Request, UploadFile, File, HTTPException, Query, status
 from fastapi.middleware.cors import CORSMiddleware
-import shutil
-from pathlib import Path
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from dotenv import load_dotenv # New import
 
 # Load environment variables from .env file
 load_dotenv() # New call
 
-from nutrition_analyzer import NutritionAnalyzer
-from food_detector import FoodDetector
-from vlm_analyzer import VLMAnalyzer
-from langchain_orchestrator import LangChainOrchestrator
+from fast_orchestrator import FastNutritionOrchestrator, split_food_items
+from image_pipeline import DecodedImage, ImageTooLargeError, PIL_FORMAT_MIME_TYPES, decode_upload
+from concurrency import run_in_cpu_executor, shutdown_cpu_executor
+from result_cache import ResultCache
+from startup import StartupProfiler
+from metrics import HTTP_REQUEST_SECONDS, PAYLOAD_BYTES, REJECTIONS, install_trace_logging, trace_id_var
+from single_flight import SingleFlight
+from groq_scheduler import PRIORITY_BATCH, GroqRateLimitError, get_groq_scheduler, groq_priority_var
+from upload_guard import (MULTIPART_OVERHEAD_BYTES, AdmissionController, UploadGuardMiddleware, UploadRejected,
+                          check_dimensions, read_upload, too_many_pixels)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Tag every request, and its log lines, with a trace ID (Optional, default: true)
+REQUEST_TRACE_IDS = os.environ.get("REQUEST_TRACE_IDS", "true").lower() == "true"
+if REQUEST_TRACE_IDS:
+    install_trace_logging()
 
-# Initialize FoodDetector (assuming model path is configured)
-food_detector = FoodDetector()
+# Components are built by the lifespan hook below rather than at import time, so that
+# importing TensorFlow/LangChain and loading the model don't block the worker from booting.
+# Endpoints that use them depend on `require_ready`.
+food_detector = None
+dish_classifier = None
+vlm_analyzer = None
+nutrition_analyzer = None
+langchain_orchestrator = None
+fast_orchestrator = None
+result_cache = None
 
-# Initialize VLMAnalyzer
-vlm_analyzer = VLMAnalyzer()
+startup_profiler = StartupProfiler()
 
-# Initialize NutritionAnalyzer
-nutrition_analyzer = NutritionAnalyzer()
+# Identical images uploaded concurrently (retries, double submits, shared photos) share one
+# detector, VLM and summary run, keyed by the SHA-256 of the upload. Finished results are
+# reused through the result cache instead.
+detection_flight = SingleFlight("detection")
+vlm_flight = SingleFlight("vlm")
+analysis_flight = SingleFlight("analysis")
 
-# Initialize LangChainOrchestrator
-langchain_orchestrator = LangChainOrchestrator(nutrition_analyzer)
+# Run dummy images through the detector before reporting ready (Optional, default: true)
+STARTUP_WARMUP = os.environ.get("STARTUP_WARMUP", "true").lower() == "true"
+
+# Summary modes selectable per request: "agent" runs the LangChain agent,
+# "fast" sums concurrent NutritionAnalyzer lookups without any LLM calls.
+ANALYSIS_MODES = ("agent", "fast")
+DEFAULT_ANALYSIS_MODE = os.environ.get("ANALYSIS_MODE", "agent")
+
+def _load_components():
+    """
+    Imports the heavy modules and builds every component, timing each phase.
+    Runs on a worker thread during startup.
+    """
+    global food_detector, dish_classifier, vlm_analyzer, nutrition_analyzer, langchain_orchestrator
+    global fast_orchestrator, result_cache
+
+    # Initialize the analysis result cache (content hash + perceptual hash)
+    with startup_profiler.phase("load:result_cache"):
+        result_cache = ResultCache.from_env()
+
+    # Initialize FoodDetector (assuming model path is configured)
+    with startup_profiler.phase("import:food_detector"):
+        from food_detector import FoodDetector
+    with startup_profiler.phase("load:food_detector"):
+        detector = FoodDetector()
+
+    # Initialize the optional DishClassifier that lets confident common dishes skip the VLM
+    with startup_profiler.phase("import:dish_classifier"):
+        from dish_classifier import DishClassifier
+    with startup_profiler.phase("load:dish_classifier"):
+        classifier = DishClassifier.from_env()
+
+    # Initialize VLMAnalyzer
+    with startup_profiler.phase("import:vlm_analyzer"):
+        from vlm_analyzer import VLMAnalyzer
+    with startup_profiler.phase("load:vlm_analyzer"):
+        vlm_analyzer = VLMAnalyzer()
+
+    # Initialize NutritionAnalyzer
+    with startup_profiler.phase("import:nutrition_analyzer"):
+        from nutrition_analyzer import NutritionAnalyzer
+    with startup_profiler.phase("load:nutrition_analyzer"):
+        nutrition_analyzer = NutritionAnalyzer()
+
+    # Initialize LangChainOrchestrator
+    with startup_profiler.phase("import:langchain_orchestrator"):
+        from langchain_orchestrator import LangChainOrchestrator
+    with startup_profiler.phase("load:langchain_orchestrator"):
+        langchain_orchestrator = LangChainOrchestrator(nutrition_analyzer)
+
+    # Initialize FastNutritionOrchestrator (deterministic, LLM-free alternative to the agent)
+    fast_orchestrator = FastNutritionOrchestrator(nutrition_analyzer)
+
+    # The first forward pass traces the model graph; pay for it here, not on a user request.
+    if STARTUP_WARMUP:
+        with startup_profiler.phase("warmup:food_detector"):
+            detector.warmup()
+        if classifier is not None:
+            with startup_profiler.phase("warmup:dish_classifier"):
+                classifier.warmup()
+    dish_classifier = classifier
+    food_detector = detector
+
+async def _startup():
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, _load_components)
+    except Exception as e:
+        logger.exception("Startup failed; the server will keep reporting not ready.")
+        startup_profiler.mark_failed(e)
+    else:
+        startup_profiler.mark_ready()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load in the background so the server accepts health checks while it warms up.
+    startup_task = asyncio.ensure_future(_startup())
+    yield
+    startup_task.cancel()
+    if nutrition_analyzer is not None:
+        await nutrition_analyzer.aclose()
+    shutdown_cpu_executor()
+    # After the CPU executor, so no preprocessed image is submitted once the engines stop.
+    for component in (food_detector, dish_classifier):
+        if component is not None:
+            component.close()
+    if result_cache is not None:
+        result_cache.close()
+
+app = FastAPI(lifespan=lifespan)
+
+def require_ready():
+    """
+    Rejects requests with 503 until every component is loaded and warm.
+    """
+    if not startup_profiler.is_ready:
+        REJECTIONS.labels("not_ready").inc()
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="The server is still starting up. Please retry shortly.",
+            headers={"Retry-After": "5"},
+        )
+
+MAX_FILE_SIZE_MB = 5
+ALLOWED_IMAGE_TYPES = ["image/jpeg", "image/png", "image/gif", "image/webp"]
+ZIP_CONTENT_TYPES = ["application/zip", "application/x-zip-compressed"]
+
+# Batch endpoint limits
+BATCH_MAX_IMAGES = int(os.environ.get("BATCH_MAX_IMAGES", "500"))
+BATCH_VLM_CONCURRENCY = int(os.environ.get("BATCH_VLM_CONCURRENCY", "4"))
+# Total size of a batch request, and of the images unpacked from its zip archives
+BATCH_MAX_UPLOAD_MB = int(os.environ.get("BATCH_MAX_UPLOAD_MB", "100"))
+
+# Upload routes get a body size cap and share one in-flight byte/request budget, checked
+# before the body is read. Registered before the other middleware so that rejections are
+# still timed, traced and given CORS headers.
+upload_admission = AdmissionController.from_env()
+app.add_middleware(
+    UploadGuardMiddleware,
+    limits={
+        "/api/analyze": MAX_FILE_SIZE_MB * 1024 * 1024 + MULTIPART_OVERHEAD_BYTES,
+        "/api/analyze/stream": MAX_FILE_SIZE_MB * 1024 * 1024 + MULTIPART_OVERHEAD_BYTES,
+        "/api/analyze/batch": BATCH_MAX_UPLOAD_MB * 1024 * 1024,
+    },
+    admission=upload_admission,
+    retry_after=int(os.environ.get("UPLOAD_RETRY_AFTER_SECONDS", "2")),
+)
 
 # Add CORS middleware
 origins = [
@@ -42,65 +198,491 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
-MAX_FILE_SIZE_MB = 5
-ALLOWED_IMAGE_TYPES = ["image/jpeg", "image/png", "image/gif", "image/webp"]
+@app.middleware("http")
+async def instrument_request(request: Request, call_next):
+    """
+    Times each request and tags it with a trace ID, taken from the X-Request-ID header when
+    the client sends one. The ID is echoed back and included in every log line for the request.
+    """
+    trace_id = (request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]) if REQUEST_TRACE_IDS else "-"
+    token = trace_id_var.set(trace_id)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        trace_id_var.reset(token)
+    # Label by route template, not raw path, to keep the number of series bounded.
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.labels(
+        request.method, getattr(route, "path", "unmatched"), str(response.status_code)
+    ).observe(time.perf_counter() - started)
+    if REQUEST_TRACE_IDS:
+        response.headers["X-Request-ID"] = trace_id
+    return response
 
-@app.post("/api/analyze")
-async def analyze_image(file: UploadFile = File(...)):
-    # 1. File type validation
-    if file.content_type not in ALLOWED_IMAGE_TYPES:
+def _validate_mode(mode: Optional[str]) -> str:
+    mode = mode or DEFAULT_ANALYSIS_MODE
+    if mode not in ANALYSIS_MODES:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Invalid file type. Only {', '.join(ALLOWED_IMAGE_TYPES)} are allowed."
+            detail=f"Invalid mode. Only {', '.join(ANALYSIS_MODES)} are allowed."
+        )
+    return mode
+
+def _over_capacity(e: GroqRateLimitError) -> HTTPException:
+    """
+    Builds the 503 returned when Groq calls could not be made within the account's rate limits.
+    """
+    logger.warning(f"Groq over capacity: {e}")
+    REJECTIONS.labels("rate_limited").inc()
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="The analysis service is over capacity. Please retry shortly.",
+        headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))},
+    )
+
+async def _is_food(image: DecodedImage) -> bool:
+    return await detection_flight.do(image.digest, lambda: food_detector.is_food_async(image))
+
+def _prefetch_nutrition(food_item: str):
+    # Called as soon as the streamed VLM answer names the food items, so the USDA lookups
+    # run while the VLM is still generating its calorie and macro lines.
+    nutrition_analyzer.prefetch_searches(split_food_items(food_item))
+
+async def _analyze_with_vlm(image: DecodedImage, mode: str) -> Dict[str, Any]:
+    # Only the fast summary looks up the split food items as they are. The agent's tools
+    # send queries of their own, so prefetching for it would spend USDA quota for nothing.
+    # The VLM call is shared across modes; the request that starts it decides.
+    on_food_item = _prefetch_nutrition if mode == "fast" else None
+    return await vlm_flight.do(
+        image.digest, lambda: vlm_analyzer.analyze_image_with_vlm_async(image, on_food_item=on_food_item))
+
+async def _identify_food(image: DecodedImage, mode: str) -> Dict[str, Any]:
+    """
+    Identifies the food with the local dish classifier when it is configured and confident,
+    and with the VLM otherwise.
+    """
+    if dish_classifier is not None:
+        classified = await dish_classifier.identify_async(image)
+        if classified is not None:
+            return classified
+    return await _analyze_with_vlm(image, mode)
+
+def _is_cacheable(vlm_analysis_result: Dict[str, Any], analysis_result: Optional[Dict[str, Any]]) -> bool:
+    """
+    Returns whether an analysis is complete enough to cache. Failed VLM calls still yield a
+    summary of N/A values, which must not be served to later uploads of the image or its
+    near-duplicates.
+    """
+    if vlm_analysis_result.get("failed") or not analysis_result:
+        return False
+    details = analysis_result.get("details") or {}
+    return any(value != "N/A" for value in details.values())
+
+async def _analyze_food_image_once(image: DecodedImage, mode: str) -> Dict[str, Any]:
+    """
+    Runs _analyze_food_image, sharing one run between concurrent requests for the same image and mode.
+    """
+    return await analysis_flight.do((mode, image.digest), lambda: _analyze_food_image(image, mode))
+
+async def _analyze_food_image(image: DecodedImage, mode: str) -> Dict[str, Any]:
+    """
+    Runs the VLM and summary stages for an image the detector has accepted,
+    and caches the result if it is complete.
+    """
+    # 2. Detailed Food Identification and Contextual Analysis using VLM
+    try:
+        vlm_analysis_result = await _identify_food(image, mode)
+        food_item = vlm_analysis_result.get("food_item_vlm", "Unknown Food")
+        logger.info(f"Identified food item: {food_item}")
+    except GroqRateLimitError as e:
+        raise _over_capacity(e)
+    except Exception as e:
+        logger.exception(f"Error during VLM analysis for {image.filename}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to perform detailed food analysis."
         )
 
-    temp_file_path = Path(f"temp_{file.filename}")
+    # 3. Generate Comprehensive Nutritional Summary using the selected orchestrator
+    orchestrator = fast_orchestrator if mode == "fast" else langchain_orchestrator
     try:
-        file_content = await file.read()
-        # 2. File size validation
-        if len(file_content) > MAX_FILE_SIZE_MB * 1024 * 1024:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"File size exceeds the limit of {MAX_FILE_SIZE_MB}MB."
-            )
+        analysis_result = await orchestrator.generate_comprehensive_summary_async(vlm_analysis_result)
+        logger.info("Comprehensive nutritional summary generated.")
+    except GroqRateLimitError as e:
+        raise _over_capacity(e)
+    except Exception as e:
+        logger.exception(f"Error during {mode} orchestration for summary generation.")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to generate comprehensive nutritional summary."
+        )
+
+    # Only complete analyses are cached; failed VLM calls and summaries without any totals are not.
+    if _is_cacheable(vlm_analysis_result, analysis_result):
+        await run_in_cpu_executor(result_cache.put, image, analysis_result, mode)
 
-        with open(temp_file_path, "wb") as buffer:
-            buffer.write(file_content)
+    return analysis_result
+
+async def _read_upload(file: UploadFile) -> DecodedImage:
+    """
+    Validates a single-image upload and decodes it in memory.
+    """
+    # 1-2. Per-file size cap (the body cap is enforced by UploadGuardMiddleware as it streams in);
+    # the type is sniffed from the bytes, not the client's content type.
+    file_content = await read_upload(file, MAX_FILE_SIZE_MB * 1024 * 1024)
+    PAYLOAD_BYTES.labels("upload").observe(len(file_content))
+
+    # Decode the upload once in memory; both stages share this object.
+    try:
+        image = await run_in_cpu_executor(decode_upload, file_content, file.filename)
+    except ImageTooLargeError:
+        raise too_many_pixels(file.filename or "upload")
+    except ValueError:
+        REJECTIONS.labels("invalid_image").inc()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="The uploaded file could not be read as an image."
+        )
+    check_dimensions(image)
+    return image
+
+@app.post("/api/analyze", dependencies=[Depends(require_ready)])
+async def analyze_image(file: UploadFile = File(...), mode: str = Query(None)):
+    mode = _validate_mode(mode)
+    image = await _read_upload(file)
+
+    # Identical or near-identical images skip the whole pipeline.
+    cached_result = await run_in_cpu_executor(result_cache.get, image, mode)
+    if cached_result is not None:
+        logger.info(f"Result cache hit for {file.filename}")
+        return cached_result
+
+    # 1. Initial Food Detection
+    if not await _is_food(image):
+        logger.info(f"No food detected in {file.filename}")
+        REJECTIONS.labels("no_food").inc()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="No food detected in the uploaded image. Please upload an image containing food."
+        )
+
+    return await _analyze_food_image_once(image, mode)
+
+def _sse_event(event: str, payload: Dict[str, Any]) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8")
+
+@app.post("/api/analyze/stream", dependencies=[Depends(require_ready)])
+async def analyze_image_stream(file: UploadFile = File(...), mode: str = Query(None)):
+    """
+    Streaming variant of /api/analyze. Emits Server-Sent Events as each stage finishes:
+    `detection`, `vlm`, one `nutrition_item` per lookup, then `result` (or `error`).
+    """
+    mode = _validate_mode(mode)
+    image = await _read_upload(file)
+
+    async def stream_events():
+        cached_result = await run_in_cpu_executor(result_cache.get, image, mode)
+        if cached_result is not None:
+            logger.info(f"Result cache hit for {image.filename}")
+            yield _sse_event("result", {**cached_result, "cached": True})
+            return
+
+        if analysis_flight.in_flight((mode, image.digest)):
+            # The same image is already being analyzed for another request; wait for its result.
+            try:
+                shared_result = await _analyze_food_image_once(image, mode)
+            except HTTPException as e:
+                yield _sse_event("error", {"detail": e.detail})
+                return
+            yield _sse_event("result", {**shared_result, "cached": False})
+            return
 
         # 1. Initial Food Detection
-        if not food_detector.is_food(str(temp_file_path)):
-            logger.info(f"No food detected in {file.filename}")
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="No food detected in the uploaded image. Please upload an image containing food."
-            )
-
-        # 2. Detailed Food Identification and Contextual Analysis using VLM
+        is_food = await _is_food(image)
+        yield _sse_event("detection", {"is_food": is_food})
+        if not is_food:
+            logger.info(f"No food detected in {image.filename}")
+            REJECTIONS.labels("no_food").inc()
+            yield _sse_event("error", {"detail": "No food detected in the uploaded image. Please upload an image containing food."})
+            return
+
         try:
-            vlm_analysis_result = vlm_analyzer.analyze_image_with_vlm(str(temp_file_path))
+            # 2. Detailed Food Identification and Contextual Analysis using VLM
+            vlm_analysis_result = await _identify_food(image, mode)
             food_item = vlm_analysis_result.get("food_item_vlm", "Unknown Food")
-            logger.info(f"VLM identified food item: {food_item}")
-        except Exception as e:
-            logger.exception(f"Error during VLM analysis for {file.filename}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to perform detailed food analysis."
-            )
-
-        # 3. Generate Comprehensive Nutritional Summary using LangChainOrchestrator
+            logger.info(f"Identified food item: {food_item}")
+            yield _sse_event("vlm", {
+                "food_item": food_item,
+                "items": split_food_items(food_item),
+                "vlm_nutritional_estimates": vlm_analysis_result.get("vlm_nutritional_estimates", {}),
+                "identified_by": vlm_analysis_result.get("identified_by", "vlm"),
+            })
+
+            # 3. Per-item lookups and totals from the selected orchestrator
+            orchestrator = fast_orchestrator if mode == "fast" else langchain_orchestrator
+            analysis_result = None
+            async for event, payload in orchestrator.stream_comprehensive_summary_async(vlm_analysis_result):
+                if event == "result":
+                    analysis_result = payload
+                else:
+                    yield _sse_event(event, payload)
+        except GroqRateLimitError as e:
+            error = _over_capacity(e)
+            yield _sse_event("error", {"detail": error.detail, "retry_after": int(error.headers["Retry-After"])})
+            return
+
+        if not analysis_result or not analysis_result.get("details"):
+            yield _sse_event("error", {"detail": "Failed to generate comprehensive nutritional summary."})
+            return
+        if _is_cacheable(vlm_analysis_result, analysis_result):
+            await run_in_cpu_executor(result_cache.put, image, analysis_result, mode)
+        yield _sse_event("result", {**analysis_result, "cached": False})
+
+    return StreamingResponse(
+        stream_events(),
+        media_type="text/event-stream",
+        # Disable proxy buffering so each event reaches the client as soon as it is sent.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+class _BatchBudget:
+    def __init__(self):
+        """
+        Running totals of the images and image bytes gathered from every part of one batch
+        request, so many zip parts cannot each unpack up to the limit.
+        """
+        self.images = 0
+        self.bytes = 0
+
+    def add(self, filename: str, size: int):
+        """
+        Counts one image of `size` bytes, rejecting the request with 413 as soon as the
+        batch goes over BATCH_MAX_IMAGES images or BATCH_MAX_UPLOAD_MB unpacked.
+        """
+        self.images += 1
+        self.bytes += size
+        if self.images > BATCH_MAX_IMAGES:
+            raise UploadRejected(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "too_large",
+                                 f"Batch exceeds the limit of {BATCH_MAX_IMAGES} images.")
+        if self.bytes > BATCH_MAX_UPLOAD_MB * 1024 * 1024:
+            raise UploadRejected(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "too_large",
+                                 f"Batch unpacks to more than the limit of {BATCH_MAX_UPLOAD_MB}MB at {filename}.")
+
+def _expand_batch_upload(filename: str, content_type: str, content: bytes,
+                         budget: _BatchBudget) -> List[Tuple[str, bytes]]:
+    """
+    Returns the (filename, bytes) images contained in one batch upload part,
+    unpacking zip archives. Each image is counted against the request's `budget`
+    before it is decompressed.
+    """
+    is_zip = content_type in ZIP_CONTENT_TYPES or filename.lower().endswith(".zip")
+    if not is_zip:
+        budget.add(filename, len(content))
+        return [(filename, content)]
+
+    entries = []
+    try:
+        with zipfile.ZipFile(io.BytesIO(content)) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or name.startswith("__MACOSX/") or PurePosixPath(name).name.startswith("."):
+                    continue
+                if info.file_size > MAX_FILE_SIZE_MB * 1024 * 1024:
+                    # Keep the entry so it is reported as an error, but never decompress it.
+                    budget.add(name, 0)
+                    entries.append((name, b""))
+                    continue
+                budget.add(name, info.file_size)
+                entries.append((name, archive.read(info)))
+    except zipfile.BadZipFile:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"{filename} is not a valid zip archive."
+        )
+    return entries
+
+def _ndjson_line(payload: Dict[str, Any]) -> bytes:
+    return (json.dumps(payload) + "\n").encode("utf-8")
+
+@app.post("/api/analyze/batch", dependencies=[Depends(require_ready)])
+async def analyze_batch(files: List[UploadFile] = File(...), mode: str = Query(None)):
+    """
+    Analyzes many images in one request. Accepts several `files` parts and/or zip archives
+    of images, and streams one NDJSON line per image as soon as its result is ready.
+    """
+    mode = _validate_mode(mode)
+
+    uploads: List[Tuple[str, bytes]] = []
+    budget = _BatchBudget()
+    for file in files:
+        content = await read_upload(file, BATCH_MAX_UPLOAD_MB * 1024 * 1024, sniff=False)
+        uploads.extend(_expand_batch_upload(file.filename or "upload", file.content_type or "", content, budget))
+
+    async def stream_results():
+        # Groq calls for batch images queue behind interactive uploads.
+        groq_priority_var.set(PRIORITY_BATCH)
+        pending: List[asyncio.Task] = []
         try:
-            analysis_result = langchain_orchestrator.generate_comprehensive_summary(vlm_analysis_result)
-            logger.info("Comprehensive nutritional summary generated.")
-        except Exception as e:
-            logger.exception("Error during LangChain orchestration for summary generation.")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to generate comprehensive nutritional summary."
-            )
-
-        return analysis_result
-    finally:
-        if temp_file_path.exists():
-            temp_file_path.unlink()
+            # Decode everything first; unreadable or oversized images are reported immediately.
+            images: List[Tuple[int, DecodedImage]] = []
+            for index, (filename, content) in enumerate(uploads):
+                PAYLOAD_BYTES.labels("upload").observe(len(content))
+                if not content or len(content) > MAX_FILE_SIZE_MB * 1024 * 1024:
+                    REJECTIONS.labels("too_large").inc()
+                    yield _ndjson_line({"index": index, "filename": filename, "status": "error",
+                                        "detail": f"File is empty or exceeds the limit of {MAX_FILE_SIZE_MB}MB."})
+                    continue
+                try:
+                    image = await run_in_cpu_executor(decode_upload, content, filename)
+                except ImageTooLargeError:
+                    yield _ndjson_line({"index": index, "filename": filename, "status": "error",
+                                        "detail": too_many_pixels(filename).detail})
+                    continue
+                except ValueError:
+                    REJECTIONS.labels("invalid_image").inc()
+                    yield _ndjson_line({"index": index, "filename": filename, "status": "error",
+                                        "detail": "The file could not be read as an image."})
+                    continue
+                if image.format not in PIL_FORMAT_MIME_TYPES:
+                    REJECTIONS.labels("invalid_type").inc()
+                    yield _ndjson_line({"index": index, "filename": filename, "status": "error",
+                                        "detail": f"Invalid file type. Only {', '.join(ALLOWED_IMAGE_TYPES)} are allowed."})
+                    continue
+                try:
+                    check_dimensions(image)
+                except UploadRejected as e:
+                    yield _ndjson_line({"index": index, "filename": filename, "status": "error", "detail": e.detail})
+                    continue
+                images.append((index, image))
+
+            # Cached results come back before any model runs.
+            uncached: List[Tuple[int, DecodedImage]] = []
+            for index, image in images:
+                cached_result = await run_in_cpu_executor(result_cache.get, image, mode)
+                if cached_result is not None:
+                    yield _ndjson_line({"index": index, "filename": image.filename, "status": "ok",
+                                        "cached": True, "result": cached_result})
+                else:
+                    uncached.append((index, image))
+
+            # 1. Food detection over the whole set, in batched forward passes.
+            verdicts = await food_detector.is_food_batch_async([image for _, image in uncached])
+            food_images = []
+            for (index, image), is_food in zip(uncached, verdicts):
+                if is_food:
+                    food_images.append((index, image))
+                else:
+                    REJECTIONS.labels("no_food").inc()
+                    yield _ndjson_line({"index": index, "filename": image.filename, "status": "no_food",
+                                        "detail": "No food detected in the image."})
+
+            # 2-3. VLM and summary for food images only, with bounded concurrency.
+            semaphore = asyncio.Semaphore(BATCH_VLM_CONCURRENCY)
+
+            async def analyze(index: int, image: DecodedImage) -> Dict[str, Any]:
+                async with semaphore:
+                    try:
+                        result = await _analyze_food_image_once(image, mode)
+                        return {"index": index, "filename": image.filename, "status": "ok",
+                                "cached": False, "result": result}
+                    except HTTPException as e:
+                        return {"index": index, "filename": image.filename, "status": "error", "detail": e.detail}
+
+            pending = [asyncio.ensure_future(analyze(index, image)) for index, image in food_images]
+            for next_done in asyncio.as_completed(pending):
+                yield _ndjson_line(await next_done)
+        finally:
+            # The client may disconnect mid-stream; don't keep paying for its images.
+            for task in pending:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.get("/api/stats/detector", dependencies=[Depends(require_ready)])
+async def detector_stats():
+    """
+    Returns the food detector's micro-batching statistics (batch sizes and queue waits).
+    """
+    return food_detector.get_stats()
+
+@app.get("/api/stats/dish-classifier", dependencies=[Depends(require_ready)])
+async def dish_classifier_stats():
+    """
+    Returns the dish classifier's threshold and micro-batching statistics, or
+    `{"enabled": false}` when no classifier is configured.
+    """
+    if dish_classifier is None:
+        return {"enabled": False}
+    return {"enabled": True, **dish_classifier.get_stats()}
+
+@app.get("/api/stats/cache", dependencies=[Depends(require_ready)])
+async def cache_stats():
+    """
+    Returns the result cache's hit/miss counters and tier sizes.
+    """
+    return result_cache.get_stats()
+
+@app.get("/api/stats/single-flight", dependencies=[Depends(require_ready)])
+async def single_flight_stats():
+    """
+    Returns leader/follower counts for each request-coalescing group, including USDA searches.
+    """
+    stats = {flight.name: flight.get_stats() for flight in (detection_flight, vlm_flight, analysis_flight)}
+    stats.update(nutrition_analyzer.get_search_flight_stats())
+    return stats
+
+
+@app.get("/api/stats/uploads")
+async def upload_stats():
+    """
+    Returns the upload admission budget: bytes and requests in flight, the limits,
+    and how many requests were admitted or shed.
+    """
+    return upload_admission.get_stats()
+
+@app.get("/api/stats/groq", dependencies=[Depends(require_ready)])
+async def groq_stats():
+    """
+    Returns the Groq scheduler's state: adaptive concurrency limit, queue length,
+    remaining request and token budgets, and call, retry and rate-limit counters.
+    """
+    return get_groq_scheduler().get_stats()
+
+
+@app.get("/api/stats/startup")
+async def startup_stats():
+    """
+    Returns the startup state and how long each import, load and warmup phase took.
+    """
+    return startup_profiler.get_report()
+
+@app.get("/api/health")
+async def health():
+    """
+    Liveness check: answers as soon as the process is serving, even while warming up.
+    """
+    return {"status": "ok", "startup": startup_profiler.state}
+
+@app.get("/api/ready")
+async def ready():
+    """
+    Readiness check: 200 once components are loaded and the detector is warm, 503 otherwise.
+    """
+    if not startup_profiler.is_ready:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": startup_profiler.state, "error": startup_profiler.error},
+        )
+    return {"status": "ready", "ready_after_seconds": startup_profiler.ready_after_seconds}
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Prometheus metrics: per-stage latency histograms, error and rejection counters,
+    Groq token and cost counters, payload sizes and HTTP request durations.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,193 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Iterable, Tuple
+
+from prometheus_client import Counter, Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Per-request trace ID, set by the HTTP middleware in main.py and added to every log line.
+trace_id_var: ContextVar[str] = ContextVar("trace_id", default="-")
+
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram(
+    "foodvision_stage_duration_seconds",
+    "Time spent in each pipeline stage.",
+    ["stage"],
+    buckets=_LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "foodvision_stage_errors_total",
+    "Failures per pipeline stage.",
+    ["stage"],
+)
+REJECTIONS = Counter(
+    "foodvision_rejections_total",
+    "Requests or images rejected before analysis, by reason.",
+    ["reason"],
+)
+DETECTOR_BATCH_SIZE = Histogram(
+    "foodvision_detector_batch_size",
+    "Number of images per food detector forward pass.",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+AGENT_TOOL_CALLS = Histogram(
+    "foodvision_agent_tool_calls",
+    "Nutrition tool calls made by the LangChain agent per summary.",
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20),
+)
+GROQ_TOKENS = Counter(
+    "foodvision_groq_tokens_total",
+    "Tokens billed by Groq, by component (vlm or agent) and kind (prompt or completion).",
+    ["component", "kind"],
+)
+GROQ_COST = Counter(
+    "foodvision_groq_cost_usd_total",
+    "Estimated Groq spend from GROQ_*_PRICE_PER_MTOK settings.",
+    ["component"],
+)
+PAYLOAD_BYTES = Histogram(
+    "foodvision_payload_bytes",
+    "Size of uploads, VLM requests and USDA responses.",
+    ["kind"],
+    buckets=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+)
+SINGLE_FLIGHT_CALLS = Counter(
+    "foodvision_single_flight_calls_total",
+    "Coalesced calls by flight and role: leader (ran the work), follower (shared it) or cancelled.",
+    ["flight", "role"],
+)
+GROQ_QUEUE_SECONDS = Histogram(
+    "foodvision_groq_queue_seconds",
+    "Time Groq calls waited in the scheduler for rate-limit budget and a concurrency slot.",
+    ["priority"],
+    buckets=_LATENCY_BUCKETS,
+)
+GROQ_RETRIES = Counter(
+    "foodvision_groq_retries_total",
+    "Groq calls retried by the scheduler, by reason (rate_limited, server_error or connection).",
+    ["reason"],
+)
+GROQ_CONCURRENCY_LIMIT = Gauge(
+    "foodvision_groq_concurrency_limit",
+    "Current adaptive limit on concurrent Groq calls.",
+)
+NUTRITION_PREFETCH = Counter(
+    "foodvision_nutrition_prefetch_total",
+    "Nutrition searches started from the streamed VLM answer (started) and later reused by a lookup (used).",
+    ["outcome"],
+)
+DISH_CLASSIFIER_DECISIONS = Counter(
+    "foodvision_dish_classifier_decisions_total",
+    "Dish classifier cascade outcomes: skipped_vlm (confident), fell_through (sent to the VLM) or error.",
+    ["decision"],
+)
+DISH_CLASSIFIER_CONFIDENCE = Histogram(
+    "foodvision_dish_classifier_confidence",
+    "Top-1 confidence of the local dish classifier.",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98, 0.99, 1.0),
+)
+UPLOAD_INFLIGHT_BYTES = Gauge(
+    "foodvision_upload_inflight_bytes",
+    "Upload bytes admitted and not yet answered.",
+)
+UPLOAD_INFLIGHT_REQUESTS = Gauge(
+    "foodvision_upload_inflight_requests",
+    "Upload requests admitted and not yet answered.",
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "foodvision_http_request_duration_seconds",
+    "Time until the response headers are sent, by route and status.",
+    ["method", "route", "status"],
+    buckets=_LATENCY_BUCKETS,
+)
+
+# USD per million tokens, used for the cost counter. Prices differ per model, so the VLM
+# and the agent LLM are configured separately.
+_PRICES = {
+    "vlm": (float(os.environ.get("GROQ_VLM_INPUT_PRICE_PER_MTOK", "0")),
+            float(os.environ.get("GROQ_VLM_OUTPUT_PRICE_PER_MTOK", "0"))),
+    "agent": (float(os.environ.get("GROQ_LLM_INPUT_PRICE_PER_MTOK", "0")),
+              float(os.environ.get("GROQ_LLM_OUTPUT_PRICE_PER_MTOK", "0"))),
+}
+
+
+@contextmanager
+def track_stage(stage: str):
+    """
+    Times the enclosed block into STAGE_SECONDS and counts exceptions into STAGE_ERRORS.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def _token_usage(message: Any) -> Tuple[int, int]:
+    # LangChain exposes usage as `usage_metadata`; older versions only fill response_metadata.
+    usage = getattr(message, "usage_metadata", None) or {}
+    if usage:
+        return int(usage.get("input_tokens") or 0), int(usage.get("output_tokens") or 0)
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    return int(token_usage.get("prompt_tokens") or 0), int(token_usage.get("completion_tokens") or 0)
+
+
+def record_token_usage(component: str, message: Any) -> Tuple[int, int]:
+    """
+    Adds the prompt and completion tokens of one model response to the token and cost counters.
+
+    Returns:
+        The (prompt_tokens, completion_tokens) pair, (0, 0) if the response carried no usage.
+    """
+    prompt_tokens, completion_tokens = _token_usage(message)
+    if prompt_tokens:
+        GROQ_TOKENS.labels(component, "prompt").inc(prompt_tokens)
+    if completion_tokens:
+        GROQ_TOKENS.labels(component, "completion").inc(completion_tokens)
+    input_price, output_price = _PRICES.get(component, (0.0, 0.0))
+    cost = (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+    if cost:
+        GROQ_COST.labels(component).inc(cost)
+    return prompt_tokens, completion_tokens
+
+
+def record_agent_messages(messages: Iterable[Any]) -> int:
+    """
+    Records token usage for every model turn in an agent run, and its number of tool calls.
+
+    Returns:
+        The number of tool calls the agent made.
+    """
+    tool_calls = 0
+    for message in messages:
+        if getattr(message, "type", None) == "ai":
+            record_token_usage("agent", message)
+            tool_calls += len(getattr(message, "tool_calls", None) or [])
+    AGENT_TOOL_CALLS.observe(tool_calls)
+    return tool_calls
+
+
+class TraceIdFilter(logging.Filter):
+    """
+    Adds the current request's trace ID to log records as `trace_id`.
+    """
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.trace_id = trace_id_var.get()
+        return True
+
+
+def install_trace_logging():
+    """
+    Prefixes every log line from the root handlers with the current request's trace ID.
+    """
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(TraceIdFilter())
+        handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:[%(trace_id)s] %(message)s"))
@@ -1,33 +1,107 @@
+import asyncio
 import logging
 import os
 import requests
+import httpx
 import json
-from langchain.tools import tool
+from typing import Dict, List, Optional
 from fastapi import HTTPException, status
 
+from fdc_index import FoodDataIndex
+from metrics import NUTRITION_PREFETCH, PAYLOAD_BYTES, track_stage
+from single_flight import SingleFlight, ThreadSingleFlight
+
 logger = logging.getLogger(__name__)
 
+
+def normalize_query(query: str) -> str:
+    """
+    Lowercases a search query and collapses whitespace, so equivalent queries share one lookup.
+    """
+    return " ".join(query.lower().split())
+
 class NutritionAnalyzer:
     def __init__(self):
         self.api_key = os.environ.get("USDA_API_KEY")
+
+        # Optional offline index built with `python fdc_index.py import ...`; the USDA API
+        # is then only used for queries the index cannot match.
+        self.local_index: Optional[FoodDataIndex] = None
+        index_path = os.environ.get("FDC_INDEX_PATH")
+        if index_path:
+            self.local_index = FoodDataIndex(
+                index_path, min_coverage=float(os.environ.get("FDC_INDEX_MIN_COVERAGE", "0.6")))
+
         if not self.api_key:
-            raise ValueError("USDA_API_KEY environment variable not set.")
+            if self.local_index is None:
+                raise ValueError("USDA_API_KEY environment variable not set.")
+            logger.warning("USDA_API_KEY not set; nutrition lookups will use the local FoodData Central index only.")
+        # USDA_API_BASE can point at a local stand-in, e.g. for the benchmark suite.
+        api_base = os.environ.get("USDA_API_BASE", "https://api.nal.usda.gov/fdc/v1")
+        self.base_url = f"{api_base.rstrip('/')}/foods/search"
+        self._async_client: Optional[httpx.AsyncClient] = None
 
-    def search_food_data(self, query: str) -> str:
+        # Concurrent identical USDA queries (e.g. "rice" from many images at once) share one request.
+        self._search_flight = SingleFlight("usda_search")
+        self._search_flight_sync = ThreadSingleFlight("usda_search_sync")
+
+        # Searches started ahead of time by prefetch_searches, kept for a short while for the lookups that follow.
+        self.prefetch_ttl = float(os.environ.get("NUTRITION_PREFETCH_TTL_SECONDS", "10"))
+        self._prefetched: Dict[str, asyncio.Future] = {}
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the running event loop and reuses pooled connections.
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(timeout=httpx.Timeout(10.0))
+        return self._async_client
+
+    async def aclose(self):
         """
-        Searches the USDA FoodData Central API for food items based on a query.
-        Returns a JSON string of the search results.
+        Closes the pooled async HTTP client.
         """
-        base_url = "https://api.nal.usda.gov/fdc/v1/foods/search"
-        params = {
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    def _search_params(self, query: str) -> dict:
+        return {
             "query": query,
             "api_key": self.api_key,
             "pageSize": 1, # Limit to the most relevant result
         }
 
+    def _search_local(self, query: str) -> Optional[str]:
+        if self.local_index is None:
+            return None
+        with track_stage("local_index_lookup"):
+            result = self.local_index.search_json(query)
+        if result is None:
+            logger.info(f"NutritionAnalyzer: No local index match for {query}, falling back to the USDA API.")
+        return result
+
+    def search_food_data(self, query: str) -> str:
+        """
+        Searches the USDA FoodData Central API for food items based on a query.
+        Returns a JSON string of the search results.
+
+        When a local index is configured it is consulted first, and the API is only
+        called if the index has no match. Concurrent calls for the same normalized query
+        share one API request.
+        """
+        query = normalize_query(query)
+        local_result = self._search_local(query)
+        if local_result is not None:
+            return local_result
+        if not self.api_key:
+            return json.dumps({"foods": []})
+        return self._search_flight_sync.do(query, lambda: self._search_usda(query))
+
+    def _search_usda(self, query: str) -> str:
         try:
-            response = requests.get(base_url, params=params)
-            response.raise_for_status()  # Raise an exception for HTTP errors
+            with track_stage("usda_lookup"):
+                response = requests.get(self.base_url, params=self._search_params(query))
+                response.raise_for_status()  # Raise an exception for HTTP errors
+            PAYLOAD_BYTES.labels("usda_response").observe(len(response.content))
             return response.text
         except requests.exceptions.RequestException as e:
             raise HTTPException(
@@ -35,11 +109,92 @@ class NutritionAnalyzer:
                 detail=f"Error making API request to USDA FoodData Central: {e}"
             )
 
+    def prefetch_searches(self, queries: List[str]):
+        """
+        Starts searches for `queries` in the background, so that lookups for them made
+        within NUTRITION_PREFETCH_TTL_SECONDS reuse the result instead of waiting for the
+        USDA API. Must be called from the event loop. A TTL of 0 disables prefetching.
+        """
+        if self.prefetch_ttl <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        for query in queries:
+            query = normalize_query(query)
+            if not query or query in self._prefetched:
+                continue
+            task = asyncio.ensure_future(self._search_food_data_async(query))
+            self._prefetched[query] = task
+            task.add_done_callback(lambda t, query=query: self._on_prefetch_done(query, t))
+            loop.call_later(self.prefetch_ttl, self._drop_prefetch, query, task)
+            NUTRITION_PREFETCH.labels("started").inc()
+        logger.debug(f"NutritionAnalyzer: Prefetching searches for {queries}")
+
+    def _on_prefetch_done(self, query: str, task: asyncio.Future):
+        if task.cancelled() or task.exception() is not None:
+            # Failed prefetches are forgotten, so the lookup itself retries.
+            self._drop_prefetch(query, task)
+
+    def _drop_prefetch(self, query: str, task: asyncio.Future):
+        if self._prefetched.get(query) is task:
+            del self._prefetched[query]
+
+    async def search_food_data_async(self, query: str) -> str:
+        """
+        Async variant of search_food_data using a pooled httpx client.
+        """
+        query = normalize_query(query)
+        prefetched = self._prefetched.get(query)
+        if prefetched is not None:
+            NUTRITION_PREFETCH.labels("used").inc()
+            # shield(): a cancelled lookup must not cancel the prefetch other lookups may share.
+            return await asyncio.shield(prefetched)
+        return await self._search_food_data_async(query)
+
+    async def _search_food_data_async(self, query: str) -> str:
+        # Local lookups run inline on the event loop: an exact match is one FTS query, and a
+        # miss is capped at fdc_index.MAX_RELAXED_QUERIES more.
+        local_result = self._search_local(query)
+        if local_result is not None:
+            return local_result
+        if not self.api_key:
+            return json.dumps({"foods": []})
+        return await self._search_flight.do(query, lambda: self._search_usda_async(query))
+
+    async def _search_usda_async(self, query: str) -> str:
+        try:
+            with track_stage("usda_lookup"):
+                response = await self._get_async_client().get(self.base_url, params=self._search_params(query))
+                response.raise_for_status()
+            PAYLOAD_BYTES.labels("usda_response").observe(len(response.content))
+            return response.text
+        except httpx.HTTPError as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error making API request to USDA FoodData Central: {e}"
+            )
+
+    def get_search_flight_stats(self) -> dict:
+        """
+        Returns the coalescing statistics of the async and sync USDA search paths.
+        """
+        return {flight.name: flight.get_stats() for flight in (self._search_flight, self._search_flight_sync)}
+
     def get_nutritional_summary(self, food_item: str) -> dict:
         logger.info(f"NutritionAnalyzer: Getting nutritional summary for {food_item}...")
         search_results = self.search_food_data(query=food_item)
-        logger.info(f"NutritionAnalyzer: Raw search results for {food_item}: {search_results}")
-        
+        return self._parse_search_results(food_item, search_results)
+
+    async def get_nutritional_summary_async(self, food_item: str) -> dict:
+        """
+        Async variant of get_nutritional_summary.
+        """
+        logger.info(f"NutritionAnalyzer: Getting nutritional summary for {food_item} (async)...")
+        search_results = await self.search_food_data_async(query=food_item)
+        return self._parse_search_results(food_item, search_results)
+
+    def _parse_search_results(self, food_item: str, search_results: str) -> dict:
+        logger.debug(f"NutritionAnalyzer: Raw search results for {food_item}: {search_results}")
+
         try:
             data = json.loads(search_results)
             foods = data.get("foods", [])
@@ -72,8 +227,8 @@ class NutritionAnalyzer:
                     "carbohydrates": f"{carbohydrates} {carbohydrates_unit}",
                     "fat": f"{fat} {fat_unit}"
                 }
-                logger.info(f"NutritionAnalyzer: Parsed summary for {food_item}: {summary}")
-                logger.info(f"NutritionAnalyzer: Parsed details for {food_item}: {details}")
+                logger.debug(f"NutritionAnalyzer: Parsed summary for {food_item}: {summary}")
+                logger.debug(f"NutritionAnalyzer: Parsed details for {food_item}: {details}")
                 return {"summary": summary, "details": details}
             else:
                 logger.info(f"NutritionAnalyzer: No nutritional information found for {food_item}.")
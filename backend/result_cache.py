@@ -0,0 +1,327 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from image_pipeline import DecodedImage
+
+logger = logging.getLogger(__name__)
+
+# The 64-bit perceptual hash is split into this many 16-bit bands. Two hashes within
+# Hamming distance < PHASH_BANDS must share at least one identical band (pigeonhole),
+# so bands act as exact-match index keys for the near-duplicate search.
+PHASH_BANDS = 4
+_BAND_BITS = 64 // PHASH_BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+# Expired rows are swept from the disk tier once per this many stores. Stale rows a lookup
+# reads are deleted on the spot, so the sweep only bounds rows that are never read again.
+DISK_EXPIRY_INTERVAL = 256
+
+
+def content_hash(image: DecodedImage) -> str:
+    """
+    Returns the SHA-256 digest of the uploaded bytes.
+    """
+    return image.digest
+
+
+def perceptual_hash(image: DecodedImage) -> int:
+    """
+    Computes a 64-bit difference hash (dHash) of the image.
+
+    The image is reduced to 9x8 grayscale and each bit records whether a pixel is brighter
+    than its right-hand neighbour, so the hash survives resizing and recompression.
+    """
+    pixels = list(image.thumbnail((9, 8)).convert("L").getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def _bands(phash: int) -> List[int]:
+    return [(phash >> (i * _BAND_BITS)) & _BAND_MASK for i in range(PHASH_BANDS)]
+
+
+def _band_keys(variant: str, phash: int) -> List[Tuple[str, int, int]]:
+    return [(variant, i, band) for i, band in enumerate(_bands(phash))]
+
+
+def _hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _is_informative(phash: int) -> bool:
+    # Flat or nearly flat images (blank frames, solid colours) hash to almost all zeros or
+    # ones and would match each other regardless of content, so they only match exactly.
+    return 8 <= bin(phash).count("1") <= 56
+
+
+def _to_signed(value: int) -> int:
+    # SQLite integers are signed 64-bit.
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 86400.0,
+                 phash_max_distance: int = 3, disk_path: Optional[str] = None,
+                 disk_max_entries: int = 100000):
+        """
+        Caches analysis results by image content.
+
+        Lookups first try the SHA-256 of the upload, then fall back to a perceptual hash
+        so that resized or recompressed copies of a cached image also hit. Results are
+        partitioned by a variant string (e.g. the analysis mode), so a result produced one
+        way is never served for a request that asked for another. Entries live in
+        an in-memory LRU tier with a TTL, and optionally in an SQLite tier on disk that
+        survives restarts.
+
+        Args:
+            max_entries: Maximum number of entries in the in-memory tier.
+            ttl_seconds: Time after which an entry is considered stale, in both tiers.
+            phash_max_distance: Maximum Hamming distance for a near-duplicate match.
+                                Values of PHASH_BANDS or more are clamped, since the band
+                                index can only guarantee recall below that distance.
+            disk_path: Path to the SQLite database for the on-disk tier, or None to disable it.
+            disk_max_entries: Maximum number of rows in the on-disk tier; the oldest rows
+                              are evicted beyond it. Expired rows are deleted when they
+                              are read and swept every DISK_EXPIRY_INTERVAL stores.
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        if phash_max_distance >= PHASH_BANDS:
+            logger.warning(f"phash_max_distance={phash_max_distance} exceeds what the band index "
+                           f"supports; clamping to {PHASH_BANDS - 1}.")
+            phash_max_distance = PHASH_BANDS - 1
+        self.phash_max_distance = phash_max_distance
+        self.disk_max_entries = disk_max_entries
+
+        self._lock = threading.Lock()
+        # "variant:content hash" -> (result, phash, stored_at, variant)
+        self._entries: "OrderedDict[str, Tuple[Dict[str, Any], int, float, str]]" = OrderedDict()
+        # (variant, band index, band value) -> entry keys
+        self._band_index: Dict[Tuple[str, int, int], set] = {}
+        self._stats = {
+            "hits_exact": 0,
+            "hits_perceptual": 0,
+            "hits_disk": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "disk_evictions": 0,
+            "disk_expirations": 0,
+        }
+
+        self._db: Optional[sqlite3.Connection] = None
+        # Running row count of the disk tier, so stores do not count the table.
+        self._disk_entries = 0
+        self._stores_since_expiry = 0
+        if disk_path:
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "cache_key TEXT PRIMARY KEY, variant TEXT NOT NULL, phash INTEGER NOT NULL, "
+                "band0 INTEGER, band1 INTEGER, band2 INTEGER, band3 INTEGER, "
+                "result TEXT NOT NULL, stored_at REAL NOT NULL)"
+            )
+            for i in range(PHASH_BANDS):
+                self._db.execute(f"CREATE INDEX IF NOT EXISTS results_band{i} ON results(band{i})")
+            self._db.execute("CREATE INDEX IF NOT EXISTS results_stored_at ON results(stored_at)")
+            self._disk_entries = self._db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+            self._expire_disk()
+            self._evict_disk()
+            self._db.commit()
+            logger.info(f"Result cache disk tier enabled at {disk_path}.")
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        """
+        Builds a cache configured from RESULT_CACHE_* environment variables.
+        """
+        return cls(
+            max_entries=int(os.environ.get("RESULT_CACHE_MAX_ENTRIES", "1024")),
+            ttl_seconds=float(os.environ.get("RESULT_CACHE_TTL_SECONDS", "86400")),
+            phash_max_distance=int(os.environ.get("RESULT_CACHE_PHASH_DISTANCE", "3")),
+            disk_path=os.environ.get("RESULT_CACHE_DB_PATH") or None,
+            disk_max_entries=int(os.environ.get("RESULT_CACHE_DB_MAX_ENTRIES", "100000")),
+        )
+
+    def _is_fresh(self, stored_at: float) -> bool:
+        return time.time() - stored_at < self.ttl_seconds
+
+    def _remove_memory_entry(self, key: str):
+        _, phash, _, variant = self._entries.pop(key)
+        for band_key in _band_keys(variant, phash):
+            keys = self._band_index.get(band_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._band_index[band_key]
+
+    def _store_memory_entry(self, key: str, result: Dict[str, Any], phash: int, stored_at: float, variant: str):
+        if key in self._entries:
+            self._remove_memory_entry(key)
+        self._entries[key] = (result, phash, stored_at, variant)
+        for band_key in _band_keys(variant, phash):
+            self._band_index.setdefault(band_key, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove_memory_entry(oldest)
+            self._stats["evictions"] += 1
+
+    def _get_memory_exact(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if not self._is_fresh(entry[2]):
+            self._remove_memory_entry(key)
+            self._stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _get_memory_perceptual(self, phash: int, variant: str) -> Optional[Dict[str, Any]]:
+        candidates = set()
+        for band_key in _band_keys(variant, phash):
+            candidates.update(self._band_index.get(band_key, ()))
+        best_key, best_distance = None, None
+        for key in candidates:
+            distance = _hamming_distance(phash, self._entries[key][1])
+            if distance <= self.phash_max_distance and (best_distance is None or distance < best_distance):
+                best_key, best_distance = key, distance
+        if best_key is None:
+            return None
+        return self._get_memory_exact(best_key)
+
+    def _expire_disk(self):
+        # Deletes expired rows through the stored_at index. The caller commits.
+        cursor = self._db.execute("DELETE FROM results WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+        expired = max(cursor.rowcount, 0)
+        self._disk_entries -= expired
+        self._stats["disk_expirations"] += expired
+        self._stores_since_expiry = 0
+
+    def _evict_disk(self):
+        # Deletes the oldest rows beyond disk_max_entries. The caller commits.
+        excess = self._disk_entries - self.disk_max_entries
+        if excess > 0:
+            cursor = self._db.execute(
+                "DELETE FROM results WHERE cache_key IN "
+                "(SELECT cache_key FROM results ORDER BY stored_at LIMIT ?)", (excess,)
+            )
+            evicted = max(cursor.rowcount, 0)
+            self._disk_entries -= evicted
+            self._stats["disk_evictions"] += evicted
+
+    def _get_disk(self, key: str, phash: int, variant: str) -> Optional[Tuple[Dict[str, Any], int, float]]:
+        if self._db is None:
+            return None
+        rows = self._db.execute(
+            "SELECT cache_key, result, phash, stored_at FROM results WHERE cache_key = ?", (key,)
+        ).fetchall()
+        if not rows and _is_informative(phash):
+            rows = self._db.execute(
+                "SELECT cache_key, result, phash, stored_at FROM results "
+                "WHERE variant = ? AND (band0 = ? OR band1 = ? OR band2 = ? OR band3 = ?)",
+                (variant, *_bands(phash))
+            ).fetchall()
+            rows = [r for r in rows if _hamming_distance(phash, _to_unsigned(r[2])) <= self.phash_max_distance]
+
+        stale = [r[0] for r in rows if not self._is_fresh(r[3])]
+        if stale:
+            self._db.executemany("DELETE FROM results WHERE cache_key = ?", [(k,) for k in stale])
+            self._db.commit()
+            self._disk_entries -= len(stale)
+            self._stats["disk_expirations"] += len(stale)
+        fresh = [r for r in rows if self._is_fresh(r[3])]
+        row = min(fresh, key=lambda r: _hamming_distance(phash, _to_unsigned(r[2])), default=None)
+        if row is None:
+            return None
+        return json.loads(row[1]), _to_unsigned(row[2]), row[3]
+
+    def get(self, image: DecodedImage, variant: str = "") -> Optional[Dict[str, Any]]:
+        """
+        Returns the cached result for an image or a near-duplicate of it, or None on a miss.
+        """
+        key = f"{variant}:{content_hash(image)}"
+        with self._lock:
+            result = self._get_memory_exact(key)
+            if result is not None:
+                self._stats["hits_exact"] += 1
+                return result
+
+        phash = perceptual_hash(image)
+        with self._lock:
+            result = self._get_memory_perceptual(phash, variant) if _is_informative(phash) else None
+            if result is not None:
+                self._stats["hits_perceptual"] += 1
+                return result
+
+            disk_entry = self._get_disk(key, phash, variant)
+            if disk_entry is not None:
+                result, stored_phash, stored_at = disk_entry
+                self._store_memory_entry(key, result, stored_phash, stored_at, variant)
+                self._stats["hits_disk"] += 1
+                return result
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, image: DecodedImage, result: Dict[str, Any], variant: str = ""):
+        """
+        Stores a result for an image in both tiers.
+        """
+        key = f"{variant}:{content_hash(image)}"
+        phash = perceptual_hash(image)
+        stored_at = time.time()
+        with self._lock:
+            self._store_memory_entry(key, result, phash, stored_at, variant)
+            self._stats["stores"] += 1
+            if self._db is not None:
+                exists = self._db.execute("SELECT 1 FROM results WHERE cache_key = ?", (key,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, variant, _to_signed(phash), *_bands(phash), json.dumps(result), stored_at),
+                )
+                if exists is None:
+                    self._disk_entries += 1
+                self._stores_since_expiry += 1
+                if self._stores_since_expiry >= DISK_EXPIRY_INTERVAL:
+                    self._expire_disk()
+                self._evict_disk()
+                self._db.commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Returns hit/miss counters and tier sizes.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["max_entries"] = self.max_entries
+            stats["disk_enabled"] = self._db is not None
+            if self._db is not None:
+                stats["disk_max_entries"] = self.disk_max_entries
+                stats["disk_entries"] = self._disk_entries
+        hits = stats["hits_exact"] + stats["hits_perceptual"] + stats["hits_disk"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,159 @@
+import asyncio
+import contextvars
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+from groq_scheduler import SharedPriority, groq_priority_var, priority_value
+from metrics import SINGLE_FLIGHT_CALLS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class _Call:
+    def __init__(self, task: asyncio.Future, priority: SharedPriority):
+        self.task = task
+        self.priority = priority
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        """
+        Coalesces concurrent async calls that share a key into one execution.
+
+        The first caller for a key (the leader) starts the computation as a task; callers
+        that arrive while it is running (followers) await the same task and receive the
+        same result or exception. Once the task finishes the key is released, so later
+        calls run again (combine with a cache to reuse finished results).
+
+        Cancellation is reference-counted: a caller that is cancelled (for example because
+        its client disconnected) only detaches itself. The shared task is cancelled only
+        when every caller waiting on it has gone.
+
+        The task runs in a fresh context instead of the leader's, so request-scoped context
+        variables such as the trace ID do not carry over to the followers. Its Groq priority
+        is a SharedPriority that follows the most urgent caller: an interactive request
+        joining a call led by a batch request moves the call's queued Groq requests ahead
+        of the batch traffic.
+
+        Results are shared, not copied, so callers must treat them as read-only.
+
+        Args:
+            name: Label used in logs, statistics and metrics.
+        """
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._stats = {"leaders": 0, "followers": 0, "cancelled": 0}
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        Returns the result of `func()`, sharing one in-flight execution per `key`.
+
+        Args:
+            key: Identifies equivalent calls, e.g. an image digest or a normalized query.
+            func: Zero-argument callable returning the awaitable to run. It is only called
+                  by the leader.
+        """
+        priority = groq_priority_var.get()
+        call = self._calls.get(key)
+        if call is None:
+            shared_priority = SharedPriority(priority_value(priority))
+            context = contextvars.Context()
+            context.run(groq_priority_var.set, shared_priority)
+            call = _Call(context.run(lambda: asyncio.ensure_future(func())), shared_priority)
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._on_done(key, call, task))
+            self._stats["leaders"] += 1
+            SINGLE_FLIGHT_CALLS.labels(self.name, "leader").inc()
+        else:
+            self._stats["followers"] += 1
+            SINGLE_FLIGHT_CALLS.labels(self.name, "follower").inc()
+            logger.debug(f"{self.name}: joined in-flight call for {key} ({call.waiters} already waiting)")
+            call.priority.raise_to(priority_value(priority))
+
+        unsubscribe = None
+        if isinstance(priority, SharedPriority):
+            # The caller is itself shared work (e.g. an analysis calling the VLM); follow its priority.
+            unsubscribe = priority.subscribe(lambda: call.priority.raise_to(priority.value))
+        call.waiters += 1
+        try:
+            # shield() keeps one caller's cancellation from cancelling the shared task.
+            return await asyncio.shield(call.task)
+        finally:
+            if unsubscribe is not None:
+                unsubscribe()
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # The last interested caller left; stop the work and let new callers start over.
+                self._release(key, call)
+                call.task.cancel()
+                self._stats["cancelled"] += 1
+                SINGLE_FLIGHT_CALLS.labels(self.name, "cancelled").inc()
+
+    def in_flight(self, key: Hashable) -> bool:
+        """
+        Returns whether a call for `key` is currently running.
+        """
+        return key in self._calls
+
+    def _on_done(self, key: Hashable, call: _Call, task: asyncio.Future):
+        self._release(key, call)
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every caller was cancelled first.
+            task.exception()
+
+    def _release(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self._stats, "in_flight": len(self._calls)}
+
+
+class ThreadSingleFlight:
+    def __init__(self, name: str):
+        """
+        Thread-based counterpart of SingleFlight for blocking code: concurrent calls with
+        the same key from different threads share one execution of the function.
+
+        Args:
+            name: Label used in statistics and metrics.
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, Future] = {}
+        self._stats = {"leaders": 0, "followers": 0}
+
+    def do(self, key: Hashable, func: Callable[[], T]) -> T:
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self._stats["leaders"] += 1
+            else:
+                self._stats["followers"] += 1
+        SINGLE_FLIGHT_CALLS.labels(self.name, "leader" if leader else "follower").inc()
+
+        if not leader:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._calls)}
@@ -0,0 +1,67 @@
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfiler:
+    def __init__(self):
+        """
+        Records how long each named startup phase takes, and how many modules it imported,
+        so slow imports and model loads show up in a report instead of as a slow boot.
+        """
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.phases: List[Dict[str, Any]] = []
+        self.state = "starting"
+        self.error: Optional[str] = None
+        self.ready_after_seconds: Optional[float] = None
+
+    @contextmanager
+    def phase(self, name: str):
+        modules_before = len(sys.modules)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.phases.append({
+                "phase": name,
+                "seconds": round(duration, 4),
+                "modules_imported": len(sys.modules) - modules_before,
+            })
+            logger.info(f"Startup phase {name} took {duration:.3f}s")
+
+    def mark_ready(self):
+        self.state = "ready"
+        self.ready_after_seconds = round(time.perf_counter() - self._start, 4)
+        logger.info(f"Startup finished in {self.ready_after_seconds:.3f}s:\n{self.format_table()}")
+
+    def mark_failed(self, error: BaseException):
+        self.state = "failed"
+        self.error = f"{type(error).__name__}: {error}"
+
+    @property
+    def is_ready(self) -> bool:
+        return self.state == "ready"
+
+    def format_table(self) -> str:
+        """
+        Returns the phases as a plain-text table, slowest first.
+        """
+        lines = [f"{'phase':<28} {'seconds':>9} {'modules':>8}"]
+        for phase in sorted(self.phases, key=lambda p: p["seconds"], reverse=True):
+            lines.append(f"{phase['phase']:<28} {phase['seconds']:>9.3f} {phase['modules_imported']:>8}")
+        return "\n".join(lines)
+
+    def get_report(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "started_at": self.started_at,
+            "ready_after_seconds": self.ready_after_seconds,
+            "phases": list(self.phases),
+        }
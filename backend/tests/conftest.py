@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Backend modules are imported flat, as uvicorn does when run from the backend directory.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,173 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import food_detector
+from food_detector import BatchingInferenceEngine, FoodDetector
+from image_pipeline import DecodedImage
+
+
+class StubModel:
+    """
+    Stands in for a detector backend: returns each input's mean and records batch sizes.
+    The first call can be held open, so that later inputs queue up behind it.
+    """
+    name = "stub"
+
+    def __init__(self, hold_first=False, fail=False):
+        self.batch_sizes = []
+        self.release = threading.Event()
+        if not hold_first:
+            self.release.set()
+        self.fail = fail
+
+    def predict(self, batch):
+        self.batch_sizes.append(len(batch))
+        if len(self.batch_sizes) == 1:
+            self.release.wait(5)
+        if self.fail:
+            raise RuntimeError("inference failed")
+        return batch.reshape(len(batch), -1).mean(axis=1, keepdims=True)
+
+
+def inputs(count):
+    return [np.full((2, 2), i, dtype=np.float32) for i in range(count)]
+
+
+def occupy(engine, model):
+    # Submits one full batch and waits until the model is holding it, so that the inputs
+    # submitted next queue up behind it.
+    futures = [engine.submit(np.zeros((2, 2), dtype=np.float32)) for _ in range(engine.max_batch_size)]
+    while not model.batch_sizes:
+        time.sleep(0.001)
+    return futures
+
+
+def results(futures):
+    return [float(future.result(timeout=5)[0]) for future in futures]
+
+
+def test_full_batches_are_dispatched_without_waiting():
+    model = StubModel(hold_first=True)
+    engine = BatchingInferenceEngine(model.predict, max_batch_size=4, max_wait_ms=10000)
+    first = occupy(engine, model)
+    futures = [engine.submit(item) for item in inputs(8)]
+    started = time.perf_counter()
+    model.release.set()
+    assert results(futures) == list(range(8))
+    assert time.perf_counter() - started < 1
+    assert results(first) == [0] * 4
+    assert model.batch_sizes == [4, 4, 4]
+    engine.shutdown()
+
+
+def test_partial_batches_are_dispatched_after_max_wait():
+    model = StubModel()
+    engine = BatchingInferenceEngine(model.predict, max_batch_size=16, max_wait_ms=50)
+    started = time.perf_counter()
+    futures = [engine.submit(item) for item in inputs(3)]
+    assert results(futures) == [0, 1, 2]
+    assert time.perf_counter() - started >= 0.045
+    assert model.batch_sizes == [3]
+    engine.shutdown()
+
+
+def test_a_failed_forward_pass_fails_every_input_of_its_batch():
+    model = StubModel(hold_first=True, fail=True)
+    engine = BatchingInferenceEngine(model.predict, max_batch_size=4, max_wait_ms=10000)
+    occupy(engine, model)
+    futures = [engine.submit(item) for item in inputs(4)]
+    model.release.set()
+    errors = [future.exception(timeout=5) for future in futures]
+    assert all(isinstance(error, RuntimeError) for error in errors)
+    assert len({id(error) for error in errors}) == 1
+
+    # The worker keeps serving later batches.
+    model.fail = False
+    assert results([engine.submit(item) for item in inputs(4)]) == [0, 1, 2, 3]
+    engine.shutdown()
+
+
+def test_a_short_output_fails_the_batch_instead_of_the_worker():
+    # Always returns a single output row, whatever the batch size.
+    engine = BatchingInferenceEngine(lambda batch: batch.reshape(len(batch), -1)[:1, :1],
+                                     max_batch_size=2, max_wait_ms=50)
+    futures = [engine.submit(item) for item in inputs(2)]
+    assert all(isinstance(future.exception(timeout=5), ValueError) for future in futures)
+    assert results([engine.submit(inputs(1)[0])]) == [0]
+    engine.shutdown()
+
+
+def test_cancelled_inputs_are_skipped():
+    model = StubModel(hold_first=True)
+    engine = BatchingInferenceEngine(model.predict, max_batch_size=4, max_wait_ms=10000)
+    occupy(engine, model)
+    futures = [engine.submit(item) for item in inputs(4)]
+    assert futures[1].cancel()
+    model.release.set()
+    assert results([futures[0], futures[2], futures[3]]) == [0, 2, 3]
+    assert model.batch_sizes == [4, 3]
+    engine.shutdown()
+
+
+def test_shutdown_drains_queued_inputs_and_rejects_new_ones():
+    model = StubModel(hold_first=True)
+    engine = BatchingInferenceEngine(model.predict, max_batch_size=4, max_wait_ms=10000)
+    futures = [engine.submit(item) for item in inputs(10)]
+    while not model.batch_sizes:
+        time.sleep(0.001)
+    threading.Timer(0.05, model.release.set).start()
+    engine.shutdown(wait=True)
+    assert all(future.done() for future in futures)
+    assert results(futures) == list(range(10))
+    assert sum(model.batch_sizes) == 10
+    assert not engine._worker.is_alive()
+    with pytest.raises(RuntimeError):
+        engine.submit(inputs(1)[0])
+    engine.shutdown()
+
+
+def test_stats_describe_the_batches_run():
+    model = StubModel(hold_first=True)
+    engine = BatchingInferenceEngine(model.predict, max_batch_size=4, max_wait_ms=50)
+    occupy(engine, model)
+    futures = [engine.submit(item) for item in inputs(2)]
+    assert engine.get_stats()["queue_depth"] == 2
+    model.release.set()
+    results(futures)
+    engine.shutdown()
+
+    stats = engine.get_stats()
+    assert stats["batches"] == 2
+    assert stats["items"] == 6
+    assert stats["avg_batch_size"] == 3
+    assert stats["max_observed_batch_size"] == 4
+    assert stats["max_wait_ms"] == 50
+    assert stats["queue_depth"] == 0
+    assert stats["max_queue_wait_ms"] >= stats["avg_queue_wait_ms"] > 0
+
+
+def test_food_detector_batches_images_through_a_stub_backend(tmp_path, monkeypatch):
+    model_path = tmp_path / "detector.tflite"
+    model_path.write_bytes(b"")
+    model = StubModel()
+    monkeypatch.setattr(food_detector, "load_backend", lambda path, backend, num_threads: model)
+    monkeypatch.setenv("FOOD_DETECTOR_MAX_WAIT_MS", "50")
+    detector = FoodDetector(str(model_path))
+
+    def png(value):
+        from PIL import Image
+        import io
+        buffer = io.BytesIO()
+        Image.new("RGB", (32, 32), (value, value, value)).save(buffer, format="PNG")
+        return DecodedImage(buffer.getvalue())
+
+    # The stub's score is the mean pixel value, so dark images count as food.
+    verdicts = asyncio.run(detector.is_food_batch_async([png(0), png(255), png(10)]))
+    assert verdicts == [True, False, True]
+    assert model.batch_sizes == [3]
+    detector.close()
+    assert detector.get_stats()["items"] == 3
@@ -0,0 +1,74 @@
+import pytest
+
+from fast_orchestrator import MAX_FOOD_ITEMS, FastNutritionOrchestrator, parse_quantity, split_food_items
+
+
+@pytest.mark.parametrize("food_item, items", [
+    ("Rice, Chicken Curry", ["Rice", "Chicken Curry"]),
+    ("[Rice; Dal]", ["Rice", "Dal"]),
+    ("rice + dal", ["rice", "dal"]),
+    ("Rice\nDal", ["Rice", "Dal"]),
+    ("- Rice.\n- Dal.", ["Rice", "Dal"]),
+    ("eggs & toast, coffee", ["eggs", "toast", "coffee"]),
+    # "and" only separates the last element of a list, so single dishes stay whole.
+    ("rice, beans and corn", ["rice", "beans", "corn"]),
+    ("burger, fries, and a soda", ["burger", "fries", "a soda"]),
+    ("macaroni and cheese", ["macaroni and cheese"]),
+    # "with" never separates: it joins a dish to its sauce or side.
+    ("pasta with tomato sauce", ["pasta with tomato sauce"]),
+    ("rice, chicken with broccoli", ["rice", "chicken with broccoli"]),
+    ("Rice, rice, RICE", ["Rice"]),
+])
+def test_split_food_items(food_item, items):
+    assert split_food_items(food_item) == items
+
+
+@pytest.mark.parametrize("food_item", ["", "   ", "[]", ", ,", "Unknown Food", "unknown food, "])
+def test_split_food_items_without_items(food_item):
+    assert split_food_items(food_item) == []
+
+
+def test_split_food_items_caps_the_fan_out():
+    items = split_food_items(", ".join(f"item {i}" for i in range(MAX_FOOD_ITEMS + 5)))
+    assert items == [f"item {i}" for i in range(MAX_FOOD_ITEMS)]
+
+
+@pytest.mark.parametrize("value, amount", [
+    ("130.0 KCAL", 130.0),
+    ("130 kcal", 130.0),
+    ("200 Cal", 200.0),
+    ("418.4 kJ", 100.0),
+    ("30g", 30.0),
+    ("12.5 G", 12.5),
+    ("250 mg", 0.25),
+    ("500 µg", 0.0005),
+    ("500 ug", 0.0005),
+    ("7", 7.0),
+    ("1/2 g", 0.5),
+    ("3 / 4 g", 0.75),
+    ("100-200 kcal", 150.0),
+    ("100 – 200 kcal", 150.0),
+    ("100 to 200 kcal", 150.0),
+    ("1/2-3/2 g", 1.0),
+])
+def test_parse_quantity(value, amount):
+    assert parse_quantity(value) == pytest.approx(amount)
+
+
+@pytest.mark.parametrize("value", ["", None, "N/A", "kcal", "unknown", "12 oz", "1/0 g"])
+def test_parse_quantity_without_an_amount(value):
+    assert parse_quantity(value) is None
+
+
+def test_aggregate_sums_items_and_marks_missing_macros():
+    summary = FastNutritionOrchestrator._aggregate("Rice, Dal", [
+        ("Rice", {"summary": "Rice.", "details": {"calories": "130.0 KCAL", "protein": "2.7 G", "fat": "N/A"}}),
+        ("Dal", {"summary": "Dal.", "details": {"calories": "116 KCAL", "protein": "9000 mg"}}),
+    ])
+    assert summary["details"] == {"Calories": "246 kcal", "Protein": "11.7 g", "Carbohydrates": "N/A", "Fat": "N/A"}
+    assert summary["description"] == "Rice. Dal."
+
+
+def test_aggregate_without_any_amount_has_no_details():
+    summary = FastNutritionOrchestrator._aggregate("Rice", [("Rice", {"summary": "", "details": {}})])
+    assert summary["details"] == {}
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from fdc_index import MAX_RELAXED_QUERIES, FoodDataIndex, build_index
+
+FOODS = [
+    (1, "Pasta with tomato sauce and meat", 160.0),
+    (2, "Ice creams, vanilla", 207.0),
+    (3, "Chicken breast, grilled", 165.0),
+    (4, "Chicken, broilers or fryers, wing, meat and skin, cooked, fried", 321.0),
+    (5, "Cake, chocolate, prepared from recipe without frosting", 371.0),
+    (6, "Fish, salmon, Atlantic, farmed, cooked", 206.0),
+    (7, "Soup, chicken noodle, canned", 62.0),
+    (8, "Rice, white, long-grain, cooked", 130.0),
+]
+
+
+@pytest.fixture(scope="module")
+def index(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("fdc")
+    source = directory / "foods.json"
+    source.write_text(json.dumps({"SRLegacyFoods": [
+        {
+            "fdcId": fdc_id,
+            "description": description,
+            "dataType": "SR Legacy",
+            "foodNutrients": [{"nutrient": {"id": 1008}, "amount": calories}],
+        }
+        for fdc_id, description, calories in FOODS
+    ]}))
+    db_path = directory / "fdc_index.sqlite3"
+    build_index(source, db_path)
+    return FoodDataIndex(str(db_path))
+
+
+@pytest.mark.parametrize("query, fdc_id", [
+    ("grilled chicken", 3),
+    ("fried chicken wings", 4),
+    ("the white rice", 8),
+    ("salmon", 6),
+    ("chicken noodle soup with crackers", 7),
+])
+def test_matches(index, query, fdc_id):
+    assert index.search(query)["fdc_id"] == fdc_id
+
+
+@pytest.mark.parametrize("query", [
+    "sushi with salmon",
+    "miso soup and edamame",
+    "chicken cake",
+    "chicken nuggets",
+    "and with of in the",
+])
+def test_partial_matches_fall_back_to_the_api(index, query):
+    assert index.search(query) is None
+
+
+def test_long_unmatched_query_runs_a_bounded_number_of_fts_queries(index, monkeypatch):
+    queries = []
+    match = index._match
+    monkeypatch.setattr(index, "_match", lambda tokens: queries.append(tokens) or match(tokens))
+    query = "spicy korean fermented cabbage kimchi pancake dipping sauce"
+    assert index.search(query) is None
+    assert len(queries) <= 1 + MAX_RELAXED_QUERIES
+    # The miss is memoized, so repeating the query runs none.
+    assert index.search(query) is None
+    assert len(queries) <= 1 + MAX_RELAXED_QUERIES
@@ -0,0 +1,235 @@
+import asyncio
+import base64
+import io
+import time
+import types
+
+import groq
+import httpx
+import pytest
+from PIL import Image
+
+import groq_scheduler
+from groq_scheduler import (
+    PRIORITY_BATCH,
+    PRIORITY_INTERACTIVE,
+    GroqRateLimitError,
+    GroqScheduler,
+    TokenBucket,
+    estimate_tokens,
+)
+
+
+def rate_limit_error(retry_after=None):
+    headers = {"retry-after": str(retry_after)} if retry_after is not None else {}
+    response = httpx.Response(429, headers=headers, request=httpx.Request("POST", "https://api.groq.test"))
+    return groq.RateLimitError("rate limited", response=response, body=None)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Only the scheduler module sees the fake clock; asyncio keeps the real one.
+    fake = FakeClock()
+    monkeypatch.setattr(groq_scheduler, "time", types.SimpleNamespace(monotonic=fake.monotonic, sleep=fake.sleep))
+    return fake
+
+
+def png_data_url(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height)).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def test_token_bucket_refills_at_its_per_minute_rate(clock):
+    bucket = TokenBucket(60)
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+    clock.sleep(0.5)
+    assert bucket.wait_time(1) == pytest.approx(0.5)
+    clock.sleep(120)
+    bucket.take(0)
+    assert bucket.tokens == 60
+
+
+def test_token_bucket_clamps_requests_to_its_capacity(clock):
+    bucket = TokenBucket(100)
+    assert bucket.clamp(500) == 100
+    assert bucket.clamp(40) == 40
+    assert bucket.wait_time(500) == 0
+    assert TokenBucket(0).clamp(500) == 500
+    assert TokenBucket(0).wait_time(500) == 0
+
+
+def test_estimate_tokens_counts_text_and_image_tiles():
+    assert estimate_tokens([("user", "x" * 40)]) == 10
+    assert estimate_tokens([("user", "x" * 40)], completion_tokens=5, extra_text="y" * 8) == 17
+    image = {"type": "image_url", "image_url": {"url": png_data_url(1120, 560)}}
+    assert estimate_tokens([("user", [{"type": "text", "text": "x" * 20}, image])]) == 5 + 2 * 1601
+    unreadable = {"type": "image_url", "image_url": {"url": "https://example.test/food.jpg"}}
+    assert estimate_tokens([("user", [unreadable])]) == 4 * 1601
+
+
+def test_run_dispatches_interactive_calls_before_batch_calls():
+    async def scenario():
+        scheduler = GroqScheduler(max_concurrency=1)
+        blocker = asyncio.Event()
+        order = []
+
+        def call(name, gate=None):
+            async def func():
+                if gate is not None:
+                    await gate.wait()
+                order.append(name)
+            return func
+
+        first = asyncio.ensure_future(scheduler.run(call("first", blocker), 10))
+        await asyncio.sleep(0)
+        batch = asyncio.ensure_future(scheduler.run(call("batch"), 10, priority=PRIORITY_BATCH))
+        await asyncio.sleep(0)
+        interactive = asyncio.ensure_future(scheduler.run(call("interactive"), 10, priority=PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+        assert scheduler.get_stats()["queued"] == 2
+        blocker.set()
+        await asyncio.gather(first, batch, interactive)
+        return order
+
+    assert asyncio.run(scenario()) == ["first", "interactive", "batch"]
+
+
+def test_concurrency_limit_halves_on_rate_limit_and_recovers_on_success():
+    async def scenario():
+        scheduler = GroqScheduler(max_concurrency=8, max_retries=0)
+
+        async def limited():
+            raise rate_limit_error(retry_after=0)
+
+        async def ok():
+            return "ok"
+
+        with pytest.raises(GroqRateLimitError):
+            await scheduler.run(limited, 10)
+        assert scheduler.get_stats()["concurrency_limit"] == 4
+        # A second 429 in the same window reports the same overload.
+        with pytest.raises(GroqRateLimitError):
+            await scheduler.run(limited, 10)
+        assert scheduler.get_stats()["concurrency_limit"] == 4
+        # Additive increase: about one per limit's worth of successes.
+        for _ in range(5):
+            await scheduler.run(ok, 10)
+        return scheduler.get_stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["concurrency_limit"] == 5
+    assert stats["rate_limited"] == 2
+    assert stats["failed"] == 2
+    assert stats["succeeded"] == 5
+
+
+def test_run_pauses_for_retry_after_before_retrying():
+    async def scenario():
+        scheduler = GroqScheduler(max_concurrency=4)
+        attempts = []
+
+        async def func():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise rate_limit_error(retry_after=0.2)
+            return "ok"
+
+        assert await scheduler.run(func, 10) == "ok"
+        return scheduler, attempts
+
+    scheduler, attempts = asyncio.run(scenario())
+    assert attempts[1] - attempts[0] >= 0.2
+    stats = scheduler.get_stats()
+    assert stats["retries"] == 1
+    assert stats["rate_limited"] == 1
+    assert stats["concurrency_limit"] == 2
+
+
+def test_run_raises_when_no_capacity_within_the_queue_timeout():
+    async def scenario():
+        scheduler = GroqScheduler(requests_per_minute=60, queue_timeout=0.05)
+        scheduler.requests.take(60)
+
+        async def func():
+            return "ok"
+
+        with pytest.raises(GroqRateLimitError):
+            await scheduler.run(func, 10)
+        return scheduler.get_stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["queue_timeouts"] == 1
+    assert stats["succeeded"] == 0
+
+
+def test_run_sync_shares_the_rate_limit_pause_and_concurrency_limit(clock):
+    scheduler = GroqScheduler(max_concurrency=8)
+    attempts = []
+
+    def func():
+        attempts.append(clock.now)
+        if len(attempts) == 1:
+            raise rate_limit_error(retry_after=2)
+        return "ok"
+
+    assert scheduler.run_sync(func, 10) == "ok"
+    assert attempts[1] - attempts[0] == pytest.approx(2)
+    stats = scheduler.get_stats()
+    assert stats["rate_limited"] == 1
+    assert stats["retries"] == 1
+    # Halved by the 429, then raised by 1/4 for the successful retry.
+    assert scheduler._limit == pytest.approx(4.25)
+
+
+def test_run_sync_waits_for_a_pause_set_by_the_async_path(clock):
+    scheduler = GroqScheduler()
+    scheduler._record_rate_limit(retry_after=3)
+    started = clock.now
+    assert scheduler.run_sync(lambda: "ok", 10) == "ok"
+    assert clock.now - started == pytest.approx(3)
+
+
+def test_run_sync_charges_the_budgets_and_corrects_from_actual_usage(clock):
+    scheduler = GroqScheduler(requests_per_minute=60, tokens_per_minute=1000)
+    scheduler.run_sync(lambda: 300, 500, actual_tokens=lambda result: result)
+    assert scheduler.requests.tokens == pytest.approx(59)
+    assert scheduler.tokens.tokens == pytest.approx(700)
+
+
+def test_run_sync_raises_when_no_capacity_within_the_queue_timeout(clock):
+    scheduler = GroqScheduler(tokens_per_minute=600, queue_timeout=5)
+    scheduler.tokens.take(600)
+    calls = []
+    with pytest.raises(GroqRateLimitError) as excinfo:
+        scheduler.run_sync(lambda: calls.append(1), 300)
+    assert excinfo.value.retry_after == pytest.approx(30)
+    assert calls == []
+    assert scheduler.get_stats()["queue_timeouts"] == 1
+
+
+def test_run_sync_gives_up_after_the_last_retry(clock):
+    scheduler = GroqScheduler(tokens_per_minute=1000, max_retries=2)
+
+    def func():
+        raise rate_limit_error(retry_after=1)
+
+    with pytest.raises(GroqRateLimitError):
+        scheduler.run_sync(func, 100)
+    stats = scheduler.get_stats()
+    assert stats["retries"] == 2
+    assert stats["failed"] == 1
+    # Rejected calls are not billed.
+    assert scheduler.tokens.tokens == pytest.approx(1000)
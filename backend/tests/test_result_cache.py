@@ -0,0 +1,194 @@
+import io
+import types
+
+import pytest
+from PIL import Image, ImageDraw
+
+import result_cache
+from image_pipeline import DecodedImage
+from main import _is_cacheable
+from result_cache import ResultCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(result_cache, "time", types.SimpleNamespace(time=fake.time))
+    return fake
+
+
+def encode(img, format="PNG", **params):
+    buffer = io.BytesIO()
+    img.save(buffer, format=format, **params)
+    return DecodedImage(buffer.getvalue())
+
+
+def plate(seed, size=(256, 256)):
+    # A few rectangles give the image enough structure for an informative perceptual hash.
+    img = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(img)
+    for i in range(6):
+        x = (seed * 37 + i * 53) % (size[0] - 40)
+        y = (seed * 59 + i * 31) % (size[1] - 40)
+        draw.rectangle([x, y, x + 40, y + 40], fill=((seed * 70 + i * 40) % 256, i * 40, 255 - i * 40))
+    return img
+
+
+def image(seed):
+    return encode(plate(seed))
+
+
+def with_phash(monkeypatch, hashes):
+    # Controls the perceptual hash of each test image by its digest.
+    monkeypatch.setattr(result_cache, "perceptual_hash", lambda img: hashes[img.digest])
+
+
+# An informative hash (32 of 64 bits set) and variants at a given Hamming distance from it.
+BASE_HASH = 0x00FF00FF00FF00FF
+
+
+def flip_bits(value, count):
+    # Flips bits spread over every band, so no band is shared once count >= 4.
+    for i in range(count):
+        value ^= 1 << (i * 16 + i)
+    return value
+
+
+def test_exact_hit_and_variant_isolation(clock):
+    cache = ResultCache()
+    img = image(1)
+    cache.put(img, {"calories": 100}, variant="fast")
+    assert cache.get(image(1), variant="fast") == {"calories": 100}
+    assert cache.get(img, variant="agent") is None
+    stats = cache.get_stats()
+    assert stats["hits_exact"] == 1
+    assert stats["misses"] == 1
+
+
+def test_lru_evicts_the_least_recently_used_entry(clock, monkeypatch):
+    images = [image(seed) for seed in range(3)]
+    with_phash(monkeypatch, {img.digest: 0 for img in images})
+    cache = ResultCache(max_entries=2)
+    cache.put(images[0], {"n": 0})
+    cache.put(images[1], {"n": 1})
+    assert cache.get(images[0]) == {"n": 0}
+    cache.put(images[2], {"n": 2})
+    assert cache.get(images[1]) is None
+    assert cache.get(images[0]) == {"n": 0}
+    assert cache.get(images[2]) == {"n": 2}
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = ResultCache(ttl_seconds=60)
+    img = image(1)
+    cache.put(img, {"n": 1})
+    clock.now += 59
+    assert cache.get(img) == {"n": 1}
+    clock.now += 2
+    assert cache.get(img) is None
+    assert cache.get_stats()["expirations"] == 1
+
+
+@pytest.mark.parametrize("distance, hit", [(0, True), (1, True), (3, True), (4, False), (8, False)])
+def test_perceptual_hash_matches_within_the_distance_threshold(clock, monkeypatch, distance, hit):
+    stored, lookup = image(1), image(2)
+    with_phash(monkeypatch, {stored.digest: BASE_HASH, lookup.digest: flip_bits(BASE_HASH, distance)})
+    cache = ResultCache(phash_max_distance=3)
+    cache.put(stored, {"n": 1})
+    assert (cache.get(lookup) == {"n": 1}) is hit
+    assert cache.get_stats()["hits_perceptual"] == (1 if hit else 0)
+
+
+def test_recompressed_copy_hits_through_the_perceptual_hash(clock):
+    original = plate(3, size=(512, 384))
+    cache = ResultCache()
+    cache.put(encode(original), {"n": 3})
+    copy = encode(original.resize((256, 192)), format="JPEG", quality=80)
+    assert cache.get(copy) == {"n": 3}
+    assert cache.get_stats()["hits_perceptual"] == 1
+
+
+def test_flat_images_only_match_exactly(clock):
+    cache = ResultCache()
+    cache.put(encode(Image.new("RGB", (64, 64), "white")), {"n": 1})
+    assert cache.get(encode(Image.new("RGB", (64, 64), (250, 250, 250)))) is None
+
+
+def test_disk_tier_survives_a_new_instance(clock, tmp_path, monkeypatch):
+    stored, lookup = image(1), image(2)
+    with_phash(monkeypatch, {stored.digest: BASE_HASH, lookup.digest: flip_bits(BASE_HASH, 2)})
+    db_path = str(tmp_path / "cache.sqlite3")
+    cache = ResultCache(disk_path=db_path)
+    cache.put(stored, {"n": 1}, variant="fast")
+    cache.close()
+
+    reopened = ResultCache(disk_path=db_path)
+    assert reopened.get(image(1), variant="fast") == {"n": 1}
+    reopened = ResultCache(disk_path=db_path)
+    assert reopened.get(lookup, variant="fast") == {"n": 1}
+    assert reopened.get(lookup, variant="agent") is None
+    stats = reopened.get_stats()
+    assert stats["hits_disk"] == 1
+    assert stats["disk_entries"] == 1
+
+
+def test_disk_tier_deletes_expired_rows(clock, tmp_path):
+    db_path = str(tmp_path / "cache.sqlite3")
+    cache = ResultCache(ttl_seconds=60, disk_path=db_path)
+    cache.put(image(1), {"n": 1})
+    cache.put(image(2), {"n": 2})
+    cache.close()
+    clock.now += 61
+
+    reopened = ResultCache(ttl_seconds=60, disk_path=db_path)
+    stats = reopened.get_stats()
+    assert stats["disk_expirations"] == 2
+    assert stats["disk_entries"] == 0
+
+
+def test_disk_tier_is_capped_at_disk_max_entries(clock, tmp_path):
+    cache = ResultCache(max_entries=1, disk_path=str(tmp_path / "cache.sqlite3"), disk_max_entries=3)
+    images = [image(seed) for seed in range(5)]
+    for n, img in enumerate(images):
+        clock.now += 1
+        cache.put(img, {"n": n})
+    cache.put(images[4], {"n": 4})
+    stats = cache.get_stats()
+    assert stats["disk_entries"] == 3
+    assert stats["disk_evictions"] == 2
+    assert cache._db.execute("SELECT COUNT(*) FROM results").fetchone()[0] == 3
+    assert cache.get(images[0]) is None
+    assert cache.get(images[2]) == {"n": 2}
+
+
+def test_stores_sweep_expired_disk_rows_periodically(clock, tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "DISK_EXPIRY_INTERVAL", 3)
+    cache = ResultCache(ttl_seconds=60, disk_path=str(tmp_path / "cache.sqlite3"))
+    cache.put(image(1), {"n": 1})
+    clock.now += 61
+    cache.put(image(2), {"n": 2})
+    assert cache.get_stats()["disk_entries"] == 2
+    cache.put(image(3), {"n": 3})
+    stats = cache.get_stats()
+    assert stats["disk_expirations"] == 1
+    assert stats["disk_entries"] == 2
+
+
+@pytest.mark.parametrize("vlm_result, analysis, cacheable", [
+    ({"food_item_vlm": "rice"}, {"details": {"calories": "200 kcal", "protein": "N/A"}}, True),
+    ({"food_item_vlm": "rice", "failed": True}, {"details": {"calories": "200 kcal"}}, False),
+    ({"food_item_vlm": "rice"}, {"details": {"calories": "N/A", "protein": "N/A"}}, False),
+    ({"food_item_vlm": "rice"}, {"details": {}}, False),
+    ({"food_item_vlm": "rice"}, None, False),
+])
+def test_only_complete_analyses_are_cacheable(vlm_result, analysis, cacheable):
+    assert _is_cacheable(vlm_result, analysis) is cacheable
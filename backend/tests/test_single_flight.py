@@ -0,0 +1,226 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from groq_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, GroqScheduler, groq_priority_var, priority_value
+from metrics import trace_id_var
+from single_flight import SingleFlight, ThreadSingleFlight
+
+
+def test_concurrent_calls_with_one_key_share_one_execution():
+    async def scenario():
+        flight = SingleFlight("test")
+        calls = []
+
+        async def work(key):
+            calls.append(key)
+            await asyncio.sleep(0.01)
+            return {"key": key}
+
+        results = await asyncio.gather(
+            *(flight.do("a", lambda: work("a")) for _ in range(5)),
+            flight.do("b", lambda: work("b")),
+        )
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(scenario())
+    assert sorted(calls) == ["a", "b"]
+    assert results[0] is results[4]
+    assert results[5] == {"key": "b"}
+    assert flight.get_stats() == {"leaders": 2, "followers": 4, "cancelled": 0, "in_flight": 0}
+
+
+def test_finished_calls_release_their_key():
+    async def scenario():
+        flight = SingleFlight("test")
+        calls = []
+
+        async def work():
+            calls.append(1)
+            return len(calls)
+
+        assert await flight.do("a", work) == 1
+        assert not flight.in_flight("a")
+        assert await flight.do("a", work) == 2
+
+    asyncio.run(scenario())
+
+
+def test_errors_reach_every_waiter():
+    async def scenario():
+        flight = SingleFlight("test")
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        return await asyncio.gather(*(flight.do("a", work) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert results[0] is results[1] is results[2]
+
+
+def test_cancelling_one_waiter_leaves_the_others_running():
+    async def scenario():
+        flight = SingleFlight("test")
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "done"
+
+        first = asyncio.ensure_future(flight.do("a", work))
+        second = asyncio.ensure_future(flight.do("a", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return first, await second, flight.get_stats()
+
+    first, result, stats = asyncio.run(scenario())
+    assert first.cancelled()
+    assert result == "done"
+    assert stats["cancelled"] == 0
+
+
+def test_cancelling_the_last_waiter_cancels_the_work():
+    async def scenario():
+        flight = SingleFlight("test")
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.ensure_future(flight.do("a", work)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        return flight
+
+    flight = asyncio.run(scenario())
+    assert not flight.in_flight("a")
+    assert flight.get_stats()["cancelled"] == 1
+
+
+def test_shared_work_does_not_inherit_the_leaders_context():
+    async def scenario():
+        flight = SingleFlight("test")
+        seen = {}
+
+        async def work():
+            seen["trace_id"] = trace_id_var.get()
+            seen["priority"] = priority_value(groq_priority_var.get())
+
+        trace_id_var.set("leader-trace")
+        groq_priority_var.set(PRIORITY_BATCH)
+        await flight.do("a", work)
+        return seen
+
+    assert asyncio.run(scenario()) == {"trace_id": "-", "priority": PRIORITY_BATCH}
+
+
+def test_interactive_follower_raises_the_priority_of_a_batch_led_call():
+    async def scenario():
+        scheduler = GroqScheduler(max_concurrency=1)
+        flight = SingleFlight("test")
+        blocker = asyncio.Event()
+        order = []
+
+        def groq_call(name, gate=None):
+            async def func():
+                if gate is not None:
+                    await gate.wait()
+                order.append(name)
+            return func
+
+        async def batch_request(name):
+            groq_priority_var.set(PRIORITY_BATCH)
+            await scheduler.run(groq_call(name), 10)
+
+        async def shared_request():
+            groq_priority_var.set(PRIORITY_BATCH)
+            await flight.do("image", lambda: scheduler.run(groq_call("shared"), 10))
+
+        async def interactive_request():
+            groq_priority_var.set(PRIORITY_INTERACTIVE)
+            await flight.do("image", lambda: scheduler.run(groq_call("unused"), 10))
+
+        holder = asyncio.ensure_future(scheduler.run(groq_call("holder", blocker), 10))
+        await asyncio.sleep(0)
+        other_batch = asyncio.ensure_future(batch_request("other batch"))
+        await asyncio.sleep(0)
+        shared = asyncio.ensure_future(shared_request())
+        await asyncio.sleep(0.01)
+        assert scheduler.get_stats()["queued"] == 2
+        interactive = asyncio.ensure_future(interactive_request())
+        await asyncio.sleep(0)
+        blocker.set()
+        await asyncio.gather(holder, other_batch, shared, interactive)
+        return order
+
+    assert asyncio.run(scenario()) == ["holder", "shared", "other batch"]
+
+
+def test_raised_priority_reaches_nested_shared_work():
+    async def scenario():
+        outer, inner = SingleFlight("outer"), SingleFlight("inner")
+        joined = asyncio.Event()
+        seen = []
+
+        async def inner_work():
+            await joined.wait()
+            seen.append(priority_value(groq_priority_var.get()))
+
+        async def request(priority):
+            groq_priority_var.set(priority)
+            await outer.do("image", lambda: inner.do("image", inner_work))
+
+        batch = asyncio.ensure_future(request(PRIORITY_BATCH))
+        await asyncio.sleep(0.01)
+        interactive = asyncio.ensure_future(request(PRIORITY_INTERACTIVE))
+        await asyncio.sleep(0)
+        joined.set()
+        await asyncio.gather(batch, interactive)
+        return seen
+
+    assert asyncio.run(scenario()) == [PRIORITY_INTERACTIVE]
+
+
+def test_thread_single_flight_shares_one_execution_and_its_errors():
+    flight = ThreadSingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(1)
+        return "done"
+
+    with ThreadPoolExecutor(4) as pool:
+        leader = pool.submit(flight.do, "a", work)
+        started.wait(1)
+        followers = [pool.submit(flight.do, "a", work) for _ in range(3)]
+        while flight.get_stats()["followers"] < 3:
+            time.sleep(0.001)
+        release.set()
+        assert [f.result() for f in [leader, *followers]] == ["done"] * 4
+    assert calls == [1]
+    assert flight.get_stats() == {"leaders": 1, "followers": 3, "in_flight": 0}
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flight.do("a", fail)
+    assert flight.get_stats()["in_flight"] == 0
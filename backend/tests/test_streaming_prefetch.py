@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+
+import main
+from nutrition_analyzer import NutritionAnalyzer
+from vlm_analyzer import VLMLineParser
+
+ANSWER = "Food Item: Rice, Chicken Curry\nCalories: 650 kcal\nProtein: 30 g\n"
+
+
+def feed_all(parser, chunks):
+    return [item for item in map(parser.feed, chunks) if item is not None]
+
+
+@pytest.mark.parametrize("chunks", [
+    [ANSWER],
+    list(ANSWER),
+    ["Food It", "em: Rice, Chi", "cken Curry", "\nCalories: 650 kcal\nProtein: 30 g\n"],
+    ["Food Item: Rice, Chicken Curry", "\n", "Calories: 650 kcal\n", "Protein: 30 g\n"],
+])
+def test_food_item_is_reported_once_its_line_is_complete(chunks):
+    parser = VLMLineParser()
+    assert feed_all(parser, chunks) == ["Rice, Chicken Curry"]
+    assert parser.close() is None
+    assert parser.lines == ["Food Item: Rice, Chicken Curry", "Calories: 650 kcal", "Protein: 30 g"]
+
+
+def test_partial_food_item_line_waits_for_its_newline():
+    parser = VLMLineParser()
+    assert parser.feed("Food Item: Rice, Chic") is None
+    assert parser.food_item is None
+    assert parser.feed("ken\n") == "Rice, Chicken"
+
+
+def test_unterminated_last_line_is_flushed_on_close():
+    parser = VLMLineParser()
+    assert feed_all(parser, ["Calories: 100 kcal\n", "  food item:  Soup "]) == []
+    assert parser.close() == "Soup"
+    assert parser.lines == ["Calories: 100 kcal", "  food item:  Soup "]
+
+
+def test_only_the_first_food_item_line_counts():
+    parser = VLMLineParser()
+    assert feed_all(parser, ["Food Item: Rice\n", "Food Item: Bread\n"]) == ["Rice"]
+    assert parser.food_item == "Rice"
+
+
+def test_answer_without_a_food_item_line():
+    parser = VLMLineParser()
+    assert feed_all(parser, ["Calories: 100 kcal\nProtein: 3 g"]) == []
+    assert parser.close() is None
+    assert parser.food_item is None
+
+
+@pytest.fixture
+def analyzer(monkeypatch):
+    monkeypatch.setenv("USDA_API_KEY", "test")
+    monkeypatch.delenv("FDC_INDEX_PATH", raising=False)
+    monkeypatch.setenv("NUTRITION_PREFETCH_TTL_SECONDS", "0.05")
+    analyzer = NutritionAnalyzer()
+    analyzer.requests = []
+
+    async def search_usda(query):
+        analyzer.requests.append(query)
+        await asyncio.sleep(0.01)
+        if query == "broken":
+            raise RuntimeError("USDA unavailable")
+        return f'{{"query": "{query}"}}'
+
+    monkeypatch.setattr(analyzer, "_search_usda_async", search_usda)
+    return analyzer
+
+
+def test_lookups_reuse_prefetched_searches(analyzer):
+    async def scenario():
+        analyzer.prefetch_searches(["Rice", "chicken  curry", "rice"])
+        results = await asyncio.gather(
+            analyzer.search_food_data_async("rice"),
+            analyzer.search_food_data_async("Chicken Curry"),
+        )
+        return results
+
+    assert asyncio.run(scenario()) == ['{"query": "rice"}', '{"query": "chicken curry"}']
+    assert analyzer.requests == ["rice", "chicken curry"]
+
+
+def test_prefetched_searches_expire_after_the_ttl(analyzer):
+    async def scenario():
+        analyzer.prefetch_searches(["rice"])
+        await analyzer.search_food_data_async("rice")
+        await asyncio.sleep(0.1)
+        assert analyzer._prefetched == {}
+        await analyzer.search_food_data_async("rice")
+
+    asyncio.run(scenario())
+    assert analyzer.requests == ["rice", "rice"]
+
+
+def test_failed_prefetches_are_retried_by_the_lookup(analyzer):
+    async def scenario():
+        analyzer.prefetch_searches(["broken"])
+        await asyncio.sleep(0.02)
+        assert analyzer._prefetched == {}
+        with pytest.raises(RuntimeError):
+            await analyzer.search_food_data_async("broken")
+
+    asyncio.run(scenario())
+    assert analyzer.requests == ["broken", "broken"]
+
+
+def test_a_ttl_of_zero_disables_prefetching(analyzer):
+    analyzer.prefetch_ttl = 0
+
+    async def scenario():
+        analyzer.prefetch_searches(["rice"])
+        assert analyzer._prefetched == {}
+
+    asyncio.run(scenario())
+    assert analyzer.requests == []
+
+
+@pytest.mark.parametrize("mode, prefetches", [("fast", True), ("agent", False)])
+def test_only_fast_mode_prefetches_from_the_vlm_answer(monkeypatch, mode, prefetches):
+    class FakeVLM:
+        async def analyze_image_with_vlm_async(self, image, on_food_item=None):
+            self.on_food_item = on_food_item
+            return {"food_item_vlm": "rice"}
+
+    class FakeImage:
+        digest = f"digest-{mode}"
+
+    vlm = FakeVLM()
+    monkeypatch.setattr(main, "vlm_analyzer", vlm)
+    asyncio.run(main._analyze_with_vlm(FakeImage(), mode))
+    assert (vlm.on_food_item is main._prefetch_nutrition) is prefetches
@@ -0,0 +1,200 @@
+import asyncio
+import io
+import json
+import struct
+import zlib
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+from starlette.datastructures import Headers, UploadFile
+
+import main
+from image_pipeline import DecodedImage, ImageTooLargeError, decode_upload
+from upload_guard import (
+    MAX_IMAGE_PIXELS,
+    AdmissionController,
+    UploadGuardMiddleware,
+    UploadRejected,
+    check_dimensions,
+    read_upload,
+    sniff_image_format,
+)
+
+
+def png_header(width, height):
+    # A PNG whose header declares `width`x`height`; only headers are parsed, so no pixels are needed.
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(b"")) + chunk(b"IEND", b""))
+
+
+def encoded(format, size=(8, 8)):
+    buffer = io.BytesIO()
+    Image.new("RGB", size).save(buffer, format=format)
+    return buffer.getvalue()
+
+
+def upload(content, filename="food.png"):
+    return UploadFile(io.BytesIO(content), filename=filename, headers=Headers({"content-type": "image/png"}))
+
+
+@pytest.mark.parametrize("format", ["JPEG", "PNG", "GIF", "WEBP"])
+def test_sniffs_supported_formats_from_their_magic_bytes(format):
+    assert sniff_image_format(encoded(format)[:16]) == format
+
+
+@pytest.mark.parametrize("header", [b"", b"GIF8", b"BM\x00\x00", b"RIFF\x00\x00\x00\x00WAVE", b"<svg xmlns="])
+def test_rejects_unknown_magic_bytes(header):
+    assert sniff_image_format(header) is None
+
+
+def test_read_upload_checks_format_and_size():
+    png = encoded("PNG")
+    assert asyncio.run(read_upload(upload(png), len(png))) == png
+
+    with pytest.raises(UploadRejected) as excinfo:
+        asyncio.run(read_upload(upload(png), len(png) - 1))
+    assert (excinfo.value.status_code, excinfo.value.reason) == (413, "too_large")
+
+    with pytest.raises(UploadRejected) as excinfo:
+        asyncio.run(read_upload(upload(b"%PDF-1.7 not an image"), 1024))
+    assert (excinfo.value.status_code, excinfo.value.reason) == (400, "invalid_type")
+
+    with pytest.raises(UploadRejected) as excinfo:
+        asyncio.run(read_upload(upload(b""), 1024))
+    assert (excinfo.value.status_code, excinfo.value.reason) == (400, "invalid_image")
+
+    # Batch parts may be zip archives, so they skip sniffing.
+    assert asyncio.run(read_upload(upload(b"PK\x03\x04"), 1024, sniff=False)) == b"PK\x03\x04"
+
+
+# PIL warns about images between its limit and twice that; check_dimensions rejects them.
+@pytest.mark.filterwarnings("ignore::PIL.Image.DecompressionBombWarning")
+def test_check_dimensions_rejects_images_over_the_pixel_limit():
+    side = int(MAX_IMAGE_PIXELS ** 0.5)
+    check_dimensions(DecodedImage(png_header(side, side)))
+    with pytest.raises(UploadRejected) as excinfo:
+        check_dimensions(DecodedImage(png_header(side + 1, side + 1)))
+    assert (excinfo.value.status_code, excinfo.value.reason) == (413, "too_many_pixels")
+
+
+def test_pil_limit_follows_the_upload_limit():
+    assert Image.MAX_IMAGE_PIXELS == MAX_IMAGE_PIXELS
+    with pytest.raises(ImageTooLargeError):
+        decode_upload(png_header(20000, 20000))
+
+
+def test_decompression_bomb_is_rejected_with_413_not_400():
+    with pytest.raises(UploadRejected) as excinfo:
+        asyncio.run(main._read_upload(upload(png_header(20000, 20000))))
+    assert (excinfo.value.status_code, excinfo.value.reason) == (413, "too_many_pixels")
+
+
+async def echo_app(scope, receive, send):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": str(len(body)).encode()})
+
+
+def call(guard, chunks, content_length=None, path="/upload"):
+    """
+    Sends one POST through the middleware; returns (status, headers, body), or the
+    UploadRejected the app would turn into a response.
+    """
+    headers = [(b"content-length", str(content_length).encode())] if content_length is not None else []
+    scope = {"type": "http", "method": "POST", "path": path, "headers": headers}
+    messages = [{"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+                for i, chunk in enumerate(chunks)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    async def run():
+        try:
+            await guard(scope, receive, send)
+        except UploadRejected as e:
+            return e
+        start, body = sent
+        return start["status"], dict(start["headers"]), body["body"]
+
+    return asyncio.run(run())
+
+
+def test_middleware_passes_requests_within_the_limit():
+    admission = AdmissionController(max_bytes=0, max_requests=0)
+    guard = UploadGuardMiddleware(echo_app, {"/upload": 100}, admission)
+    assert call(guard, [b"x" * 60, b"x" * 40], content_length=100)[0] == 200
+    assert call(guard, [b"x" * 60, b"x" * 40])[0] == 200
+    assert admission.get_stats()["requests_in_flight"] == 0
+
+
+def test_middleware_refuses_a_declared_oversized_body_without_reading_it():
+    guard = UploadGuardMiddleware(echo_app, {"/upload": 100}, AdmissionController(0, 0))
+    status_code, headers, body = call(guard, [b"x" * 101], content_length=101)
+    assert status_code == 413
+    assert headers[b"connection"] == b"close"
+    assert "limit" in json.loads(body)["detail"]
+
+
+def test_middleware_aborts_a_body_without_content_length_once_it_crosses_the_limit():
+    admission = AdmissionController(max_bytes=0, max_requests=0)
+    guard = UploadGuardMiddleware(echo_app, {"/upload": 100}, admission)
+    rejected = call(guard, [b"x" * 60, b"x" * 60, b"x" * 60])
+    assert isinstance(rejected, UploadRejected)
+    assert (rejected.status_code, rejected.reason) == (413, "too_large")
+    assert admission.get_stats()["requests_in_flight"] == 0
+
+
+def test_app_answers_413_for_a_chunked_upload_over_the_limit():
+    def body():
+        yield (b'--boundary\r\nContent-Disposition: form-data; name="file"; filename="food.png"\r\n'
+               b"Content-Type: image/png\r\n\r\n")
+        for _ in range(100):
+            yield b"x" * 65536
+        yield b"\r\n--boundary--\r\n"
+
+    # A generator body is sent without a Content-Length.
+    response = TestClient(main.app).post(
+        "/api/analyze", content=body(), headers={"content-type": "multipart/form-data; boundary=boundary"})
+    assert response.status_code == 413
+
+
+def test_middleware_ignores_other_routes():
+    guard = UploadGuardMiddleware(echo_app, {"/upload": 10}, AdmissionController(0, 0))
+    assert call(guard, [b"x" * 50], path="/other")[0] == 200
+
+
+def test_admission_sheds_requests_over_the_budget_with_retry_after():
+    admission = AdmissionController(max_bytes=150, max_requests=2)
+    guard = UploadGuardMiddleware(echo_app, {"/upload": 100}, admission, retry_after=7)
+    assert admission.try_acquire(100)
+
+    status_code, headers, _ = call(guard, [b"x" * 60], content_length=60)
+    assert status_code == 503
+    assert headers[b"retry-after"] == b"7"
+    # Without a Content-Length the route's whole limit is reserved.
+    assert call(guard, [b"x" * 10])[0] == 503
+    assert call(guard, [b"x" * 50], content_length=50)[0] == 200
+
+    assert admission.try_acquire(10)
+    assert call(guard, [b"x"], content_length=1)[0] == 503
+    assert admission.get_stats()["shed"] == 3
+
+
+def test_an_idle_server_admits_one_request_over_the_budget():
+    admission = AdmissionController(max_bytes=10, max_requests=1)
+    assert admission.try_acquire(1000)
+    assert not admission.try_acquire(1)
+    admission.release(1000)
+    assert admission.get_stats()["bytes_in_flight"] == 0
@@ -0,0 +1,111 @@
+import io
+
+import pytest
+from PIL import Image
+
+from image_pipeline import DecodedImage
+from vlm_payload import ImagePayloadOptimizer
+
+
+def encoded(image, format, **params):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **params)
+    return DecodedImage(buffer.getvalue())
+
+
+def decode(payload):
+    return Image.open(io.BytesIO(payload.data))
+
+
+@pytest.mark.parametrize("size, output", [
+    ((2048, 1536), (1024, 768)),
+    ((1536, 2048), (768, 1024)),
+    ((4000, 500), (1024, 128)),
+    ((800, 600), (800, 600)),
+])
+def test_longest_side_is_capped_at_max_side(size, output):
+    payload = ImagePayloadOptimizer(max_side=1024).optimize(encoded(Image.new("RGB", size, "green"), "PNG"))
+    assert payload.size == output
+    assert decode(payload).size == output
+    assert decode(payload).format == "JPEG"
+    assert payload.mime_type == "image/jpeg"
+
+
+def test_jpeg_decoded_at_a_reduced_scale_still_gets_the_exact_target_size():
+    payload = ImagePayloadOptimizer(max_side=500).optimize(encoded(Image.new("RGB", (4000, 3000), "red"), "JPEG"))
+    assert decode(payload).size == (500, 375)
+
+
+def test_token_budget_shrinks_images_below_max_side():
+    optimizer = ImagePayloadOptimizer(max_side=1024, token_budget=256, pixels_per_token=784)
+    payload = optimizer.optimize(encoded(Image.new("RGB", (1024, 1024), "green"), "PNG"))
+    assert payload.size == (448, 448)
+    assert payload.estimated_tokens <= 256
+    assert optimizer.estimate_tokens(decode(payload).size) == payload.estimated_tokens
+
+
+def test_exif_orientation_is_applied_and_metadata_dropped():
+    # A landscape sensor image tagged "rotate 90 degrees" displays as portrait.
+    image = Image.new("RGB", (200, 100), "blue")
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    upload = encoded(image, "JPEG", exif=exif)
+    assert upload.has_exif
+
+    payload = ImagePayloadOptimizer(max_side=1024).optimize(upload)
+    assert payload.size == (100, 200)
+    assert not decode(payload).getexif()
+
+
+def test_transparency_is_flattened_onto_white():
+    image = Image.new("RGBA", (64, 64), (0, 0, 0, 0))
+    image.paste((255, 0, 0, 255), (0, 0, 32, 64))
+    payload = ImagePayloadOptimizer().optimize(encoded(image, "PNG"))
+
+    output = decode(payload).convert("RGB")
+    assert output.mode == "RGB"
+    assert all(abs(channel - 255) <= 3 for channel in output.getpixel((48, 32)))
+    red = output.getpixel((16, 32))
+    assert red[0] > 240 and red[1] < 20 and red[2] < 20
+
+
+def test_palette_images_are_converted():
+    image = Image.new("P", (64, 64))
+    payload = ImagePayloadOptimizer().optimize(encoded(image, "GIF"))
+    assert decode(payload).mode == "RGB"
+
+
+def test_compliant_uploads_are_forwarded_unchanged():
+    optimizer = ImagePayloadOptimizer(max_side=1024, quality=85)
+    upload = encoded(Image.effect_noise((640, 480), 64).convert("RGB"), "JPEG", quality=60)
+    assert optimizer.is_compliant(upload)
+
+    payload = optimizer.optimize(upload)
+    assert payload.data == upload.raw_bytes
+    assert payload.size == (640, 480)
+    assert payload.original_bytes == len(upload.raw_bytes)
+
+
+@pytest.mark.parametrize("upload, reason", [
+    (encoded(Image.new("RGB", (640, 480)), "PNG"), "wrong format"),
+    (encoded(Image.new("RGB", (2048, 1536)), "JPEG", quality=60), "over max_side"),
+    (encoded(Image.new("CMYK", (640, 480)), "JPEG"), "colour mode"),
+    (encoded(Image.effect_noise((640, 480), 64).convert("RGB"), "JPEG", quality=100), "too many bytes per pixel"),
+])
+def test_non_compliant_uploads_are_re_encoded(upload, reason):
+    optimizer = ImagePayloadOptimizer(max_side=1024)
+    assert not optimizer.is_compliant(upload), reason
+    assert optimizer.optimize(upload).data != upload.raw_bytes
+
+
+def test_uploads_with_exif_are_not_compliant():
+    exif = Image.Exif()
+    exif[0x0110] = "Camera"
+    upload = encoded(Image.new("RGB", (64, 64)), "JPEG", exif=exif)
+    assert not ImagePayloadOptimizer().is_compliant(upload)
+
+
+def test_rejects_unsupported_output_formats():
+    with pytest.raises(ValueError):
+        ImagePayloadOptimizer(output_format="PNG")
+    assert ImagePayloadOptimizer(output_format="webp").output_format == "WEBP"
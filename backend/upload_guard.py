@@ -0,0 +1,240 @@
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+from fastapi import HTTPException, UploadFile, status
+from PIL import Image
+
+from image_pipeline import DecodedImage
+from metrics import REJECTIONS, UPLOAD_INFLIGHT_BYTES, UPLOAD_INFLIGHT_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Room for the multipart boundaries and part headers around a single file.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Largest image area accepted; anything bigger is rejected from its header, before decoding.
+MAX_IMAGE_PIXELS = int(os.environ.get("UPLOAD_MAX_IMAGE_PIXELS", "40000000"))
+# PIL refuses to open images over twice its own limit, before check_dimensions could see
+# them. Tie that limit to ours, so settings above PIL's default are honoured and the
+# bombs it refuses are reported as too_many_pixels (see ImageTooLargeError).
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class UploadRejected(HTTPException):
+    def __init__(self, status_code: int, reason: str, detail: str, headers: Optional[Dict[str, str]] = None):
+        """
+        An HTTPException for a refused upload, counted in the rejections metric under `reason`.
+        """
+        super().__init__(status_code=status_code, detail=detail, headers=headers)
+        self.reason = reason
+        REJECTIONS.labels(reason).inc()
+
+
+def sniff_image_format(header: bytes) -> Optional[str]:
+    """
+    Identifies an image from its magic bytes, ignoring the client-supplied content type.
+
+    Returns:
+        The PIL format name ("JPEG", "PNG", "GIF" or "WEBP"), or None if unrecognised.
+    """
+    if header.startswith(b"\xff\xd8\xff"):
+        return "JPEG"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "PNG"
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "GIF"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WEBP"
+    return None
+
+
+async def read_upload(file: UploadFile, max_bytes: int, sniff: bool = True) -> bytes:
+    """
+    Reads a parsed upload and checks its size and format.
+
+    By the time this runs Starlette has spooled the whole multipart body, so this check
+    does not bound memory or I/O. That limit is enforced while the body streams in, by
+    UploadGuardMiddleware; this one applies the per-file cap within the request.
+
+    Args:
+        file: The uploaded file.
+        max_bytes: Size cap; larger files are rejected with 413.
+        sniff: Reject with 400 unless the first bytes are a JPEG, PNG, GIF or WebP image.
+
+    Returns:
+        The file content.
+    """
+    content = await file.read()
+    if len(content) > max_bytes:
+        raise UploadRejected(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "too_large",
+                             f"File size exceeds the limit of {max_bytes // (1024 * 1024)}MB.")
+    if sniff and not content:
+        raise UploadRejected(status.HTTP_400_BAD_REQUEST, "invalid_image", "The uploaded file is empty.")
+    if sniff and sniff_image_format(content[:16]) is None:
+        raise UploadRejected(status.HTTP_400_BAD_REQUEST, "invalid_type",
+                             "The uploaded file is not a JPEG, PNG, GIF or WebP image.")
+    return content
+
+
+def too_many_pixels(filename: str, dimensions: str = "dimensions") -> UploadRejected:
+    """
+    Returns the 413 rejection for an image over UPLOAD_MAX_IMAGE_PIXELS.
+    """
+    logger.warning(f"Rejected {filename}: image {dimensions} exceed {MAX_IMAGE_PIXELS} pixels.")
+    return UploadRejected(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "too_many_pixels",
+                          f"Image {dimensions} exceed the limit of {MAX_IMAGE_PIXELS} pixels.")
+
+
+def check_dimensions(image: DecodedImage):
+    """
+    Rejects images whose header declares more than UPLOAD_MAX_IMAGE_PIXELS pixels, such as
+    decompression bombs that are small on the wire but enormous once decoded. Only the
+    header has been parsed at this point, so nothing large has been allocated yet. Images
+    over twice the limit never get here: decode_upload raises ImageTooLargeError for them,
+    which callers map to too_many_pixels.
+    """
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise too_many_pixels(image.filename, f"dimensions {width}x{height}")
+
+
+class AdmissionController:
+    def __init__(self, max_bytes: int, max_requests: int):
+        """
+        Global budget of upload bytes and upload requests being processed at once.
+
+        Each admitted request holds its declared body size (or its route's cap when the
+        size is not declared) until its response has been sent, so the memory held by
+        uploads stays bounded no matter how many clients arrive together.
+
+        Args:
+            max_bytes: Total bytes admitted at once; 0 disables the byte budget.
+            max_requests: Upload requests admitted at once; 0 disables the request budget.
+        """
+        self.max_bytes = max_bytes
+        self.max_requests = max_requests
+        self.bytes_in_flight = 0
+        self.requests_in_flight = 0
+        self._stats = {"admitted": 0, "shed": 0}
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_bytes=int(float(os.environ.get("UPLOAD_MAX_INFLIGHT_MB", "256")) * 1024 * 1024),
+            max_requests=int(os.environ.get("UPLOAD_MAX_INFLIGHT_REQUESTS", "64")),
+        )
+
+    def try_acquire(self, size: int) -> bool:
+        """
+        Admits a request of `size` bytes if it fits both budgets. An idle server always
+        admits one request, so a budget smaller than a single upload cannot block everything.
+        """
+        idle = self.requests_in_flight == 0
+        over_bytes = self.max_bytes and self.bytes_in_flight + size > self.max_bytes
+        over_requests = self.max_requests and self.requests_in_flight >= self.max_requests
+        if not idle and (over_bytes or over_requests):
+            self._stats["shed"] += 1
+            return False
+        self.bytes_in_flight += size
+        self.requests_in_flight += 1
+        self._stats["admitted"] += 1
+        self._update_gauges()
+        return True
+
+    def release(self, size: int):
+        self.bytes_in_flight -= size
+        self.requests_in_flight -= 1
+        self._update_gauges()
+
+    def _update_gauges(self):
+        UPLOAD_INFLIGHT_BYTES.set(self.bytes_in_flight)
+        UPLOAD_INFLIGHT_REQUESTS.set(self.requests_in_flight)
+
+    def get_stats(self) -> dict:
+        return {
+            **self._stats,
+            "bytes_in_flight": self.bytes_in_flight,
+            "requests_in_flight": self.requests_in_flight,
+            "max_bytes": self.max_bytes,
+            "max_requests": self.max_requests,
+        }
+
+
+class UploadGuardMiddleware:
+    def __init__(self, app, limits: Dict[str, int], admission: AdmissionController, retry_after: int = 2):
+        """
+        ASGI middleware that guards upload routes before their bodies are parsed.
+
+        A request whose Content-Length exceeds its route's limit is refused with 413, and
+        one that does not fit the admission budget with 503 and Retry-After, without
+        reading its body. While the body streams in, bytes are counted and the request is
+        aborted with 413 as soon as it crosses the limit, so a missing or false
+        Content-Length cannot get around it.
+
+        Args:
+            app: The ASGI application.
+            limits: Maximum request body size in bytes, by POST route path.
+            admission: Shared in-flight byte and request budget.
+            retry_after: Seconds suggested to shed clients.
+        """
+        self.app = app
+        self.limits = limits
+        self.admission = admission
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self.limits.get(scope.get("path", "")) if scope["type"] == "http" and scope.get("method") == "POST" else None
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = None
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    content_length = int(value)
+                except ValueError:
+                    pass
+        if content_length is not None and content_length > max_bytes:
+            REJECTIONS.labels("too_large").inc()
+            await self._respond(send, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                                f"Request body exceeds the limit of {max_bytes // (1024 * 1024)}MB.")
+            return
+
+        reserved = content_length if content_length is not None else max_bytes
+        if not self.admission.try_acquire(reserved):
+            REJECTIONS.labels("overloaded").inc()
+            await self._respond(send, status.HTTP_503_SERVICE_UNAVAILABLE,
+                                "The server is handling too many uploads. Please retry shortly.",
+                                {"Retry-After": str(self.retry_after)})
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_bytes:
+                    # Raised inside body parsing, so FastAPI answers with this status.
+                    raise UploadRejected(status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, "too_large",
+                                         f"Request body exceeds the limit of {max_bytes // (1024 * 1024)}MB.")
+            return message
+
+        try:
+            await self.app(scope, limited_receive, send)
+        finally:
+            self.admission.release(reserved)
+
+    @staticmethod
+    async def _respond(send, status_code: int, detail: str, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+        raw_headers += [(key.lower().encode(), value.encode()) for key, value in (headers or {}).items()]
+        # Tell the client not to reuse the connection, since its body was never read.
+        raw_headers.append((b"connection", b"close"))
+        await send({"type": "http.response.start", "status": status_code, "headers": raw_headers})
+        await send({"type": "http.response.body", "body": body})
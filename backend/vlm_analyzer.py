@@ -1,16 +1,65 @@
 import logging
-from typing import Dict, Any
+import time
+from typing import Callable, Dict, Any, List, Optional, Union
 from PIL import Image
 import io
 import os
 import base64
-import json
 
 from langchain_groq import ChatGroq
 from langchain_core.messages import HumanMessage
 
+from concurrency import run_in_cpu_executor
+from groq_scheduler import GroqRateLimitError, estimate_tokens, get_groq_scheduler, response_tokens
+from image_pipeline import DecodedImage, PIL_FORMAT_MIME_TYPES, decode_upload
+from metrics import PAYLOAD_BYTES, STAGE_SECONDS, record_token_usage, track_stage
+from vlm_payload import ImagePayloadOptimizer
+
 logger = logging.getLogger(__name__)
 
+# Expected length of the structured VLM answer, reserved from the token budget up front.
+VLM_COMPLETION_TOKENS = 200
+
+class VLMLineParser:
+    def __init__(self):
+        """
+        Splits a streamed VLM answer into lines as tokens arrive, and picks out the
+        `Food Item:` line as soon as it is complete.
+        """
+        self._buffer = ""
+        self.lines: List[str] = []
+        self.food_item: Optional[str] = None
+
+    def feed(self, text: str) -> Optional[str]:
+        """
+        Adds a chunk of streamed text.
+
+        Returns:
+            The food item list if this chunk completed the `Food Item:` line, otherwise None.
+        """
+        self._buffer += text
+        food_item = None
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            food_item = self._add_line(line) or food_item
+        return food_item
+
+    def close(self) -> Optional[str]:
+        """
+        Flushes the last, unterminated line. Returns the food item if that line held it.
+        """
+        line, self._buffer = self._buffer, ""
+        return self._add_line(line) if line else None
+
+    def _add_line(self, line: str) -> Optional[str]:
+        self.lines.append(line)
+        stripped = line.strip()
+        if self.food_item is None and stripped.lower().startswith("food item:"):
+            self.food_item = stripped.split(":", 1)[-1].strip()
+            return self.food_item
+        return None
+
+
 class VLMAnalyzer:
     def __init__(self):
         """
@@ -27,101 +76,220 @@ class VLMAnalyzer:
         # Default to a Groq vision model (e.g., llama-3.2-90b-vision-preview)
         self.GROQ_VLM_MODEL = os.environ.get("GROQ_VLM_MODEL", "llama-3.2-90b-vision-preview")
         
+        # Retries are left to the shared scheduler, which knows about the other Groq traffic.
         self.llm = ChatGroq(
             temperature=0,
             model_name=self.GROQ_VLM_MODEL,
-            api_key=self.GROQ_API_KEY
+            api_key=self.GROQ_API_KEY,
+            max_retries=0
         )
+        self.scheduler = get_groq_scheduler()
+
+        # Stream the answer so the food items are known before the macro lines are generated.
+        self.streaming = os.environ.get("VLM_STREAMING", "true").lower() == "true"
         logger.info(f"Groq VLM configured with model: {self.GROQ_VLM_MODEL}")
 
-    def _encode_image_to_base64_data_url(self, image_path: str) -> str:
+        # Downscale and recompress images before upload unless explicitly disabled.
+        self.payload_optimizer = None
+        if os.environ.get("VLM_IMAGE_OPTIMIZATION", "true").lower() != "false":
+            self.payload_optimizer = ImagePayloadOptimizer.from_env()
+
+    def _encode_image_to_base64_data_url(self, image: Union[str, DecodedImage]) -> str:
         """
-        Encodes an image file to a base64 data URL.
+        Encodes an image file or an in-memory upload to a base64 data URL.
+
+        With the payload optimizer enabled, the image is downscaled, re-encoded and stripped
+        of EXIF first. Otherwise in-memory uploads in a format the VLM accepts are forwarded
+        byte-for-byte.
         """
         try:
-            img = Image.open(image_path)
+            if self.payload_optimizer is not None:
+                if not isinstance(image, DecodedImage):
+                    with open(image, "rb") as f:
+                        image = decode_upload(f.read(), str(image))
+                return self.payload_optimizer.optimize(image).to_data_url()
+
+            if isinstance(image, DecodedImage):
+                if image.format in PIL_FORMAT_MIME_TYPES:
+                    base64_image = base64.b64encode(image.raw_bytes).decode('utf-8')
+                    return f"data:{image.mime_type};base64,{base64_image}"
+                img = image.image.convert("RGB")
+                img_byte_arr = io.BytesIO()
+                img.save(img_byte_arr, format='JPEG')
+                base64_image = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
+                return f"data:image/jpeg;base64,{base64_image}"
+
+            img = Image.open(image)
             img_byte_arr = io.BytesIO()
             img_format = img.format if img.format else 'JPEG'
             img.save(img_byte_arr, format=img_format)
             base64_image = base64.b64encode(img_byte_arr.getvalue()).decode('utf-8')
             return f"data:image/{img_format.lower()};base64,{base64_image}"
         except Exception as e:
-            logger.error(f"Error encoding image {image_path} to base64: {e}")
+            logger.error(f"Error encoding image {self._describe(image)} to base64: {e}")
             raise
 
-    def analyze_image_with_vlm(self, image_path: str) -> Dict[str, Any]:
+    @staticmethod
+    def _describe(image: Union[str, DecodedImage]) -> str:
+        return image.filename if isinstance(image, DecodedImage) else str(image)
+
+    def _build_message(self, image: Union[str, DecodedImage]) -> HumanMessage:
+        with track_stage("vlm_encode"):
+            base64_data_url = self._encode_image_to_base64_data_url(image)
+        PAYLOAD_BYTES.labels("vlm_request").observe(len(base64_data_url))
+        return HumanMessage(
+            content=[
+                {
+                    "type": "text", 
+                    "text": "Analyze this image of food. Identify all food items in the image and provide a combined nutritional estimate for all of them. Present the total nutritional estimates clearly in a structured format. Each item should be on a new line, like this:\nFood Item: [list of all food items]\nCalories: [total value]\nProtein: [total value]\nCarbohydrates: [total value]\nFat: [total value]"
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {"url": base64_data_url},
+                },
+            ]
+        )
+
+    @staticmethod
+    def _parse_vlm_response(vlm_text_response: str) -> Dict[str, Any]:
+        """
+        Parses the VLM's structured text response into the analysis dictionary.
+        """
+        food_item = "Unknown Food"
+        vlm_nutritional_estimates = {}
+
+        # Robust parsing based on the structured format requested in the prompt
+        lines = vlm_text_response.split('\n')
+        for line in lines:
+            line = line.strip()
+            if line.lower().startswith("food item:"):
+                food_item = line.split(":", 1)[-1].strip()
+            elif line.lower().startswith("calories:"):
+                vlm_nutritional_estimates["calories"] = line.split(":", 1)[-1].strip()
+            elif line.lower().startswith("protein:"):
+                vlm_nutritional_estimates["protein"] = line.split(":", 1)[-1].strip()
+            elif line.lower().startswith("carbohydrates:"):
+                vlm_nutritional_estimates["carbohydrates"] = line.split(":", 1)[-1].strip()
+            elif line.lower().startswith("fat:"):
+                vlm_nutritional_estimates["fat"] = line.split(":", 1)[-1].strip()
+
+        # If food_item wasn't explicitly found, try to infer from first line or general description
+        if food_item == "Unknown Food" and lines:
+            first_line_content = lines[0].strip()
+            if first_line_content and not any(kw in first_line_content.lower() for kw in ["calories:", "protein:"]):
+                possible_food = first_line_content.split(':', 1)[-1].strip() if ':' in first_line_content else first_line_content
+                # Simple heuristic to avoid picking up long descriptions as food name
+                if len(possible_food.split()) <= 10: 
+                    food_item = possible_food
+
+        return {
+            "food_item_vlm": food_item,
+            "description": vlm_text_response, # Keep full response for context
+            "vlm_nutritional_estimates": vlm_nutritional_estimates
+        }
+
+    @staticmethod
+    def _failure_result(e: Exception) -> Dict[str, Any]:
+        logger.error(f"Error during VLM analysis or parsing: {e}")
+        return {
+            "food_item_vlm": "Unknown Food",
+            "description": f"Failed to analyze image with VLM: {e}",
+            "vlm_nutritional_estimates": {},
+            # Lets callers tell a failed analysis apart from an unidentified food, e.g. to not cache it.
+            "failed": True,
+        }
+
+    def analyze_image_with_vlm(self, image: Union[str, DecodedImage]) -> Dict[str, Any]:
         """
         Analyzes an image using the Groq VLM to identify food items,
         extract contextual information, and provide nutritional estimates.
 
         Args:
-            image_path: The path to the image file.
+            image: The path to the image file, or an in-memory upload.
 
         Returns:
             A dictionary containing the VLM's analysis, including identified food items,
             description, and nutritional estimates.
         """
-        logger.info(f"Analyzing image {image_path} with Groq VLM.")
-        
-        try:
-            base64_data_url = self._encode_image_to_base64_data_url(image_path)
-
-            message = HumanMessage(
-                content=[
-                    {
-                        "type": "text", 
-                        "text": "Analyze this image of food. Identify all food items in the image and provide a combined nutritional estimate for all of them. Present the total nutritional estimates clearly in a structured format. Each item should be on a new line, like this:\nFood Item: [list of all food items]\nCalories: [total value]\nProtein: [total value]\nCarbohydrates: [total value]\nFat: [total value]"
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": base64_data_url},
-                    },
-                ]
-            )
+        logger.info(f"Analyzing image {self._describe(image)} with Groq VLM.")
 
-            response = self.llm.invoke([message])
+        try:
+            message = self._build_message(image)
+            with track_stage("vlm"):
+                response = self.scheduler.run_sync(
+                    lambda: self.llm.invoke([message]),
+                    estimate_tokens([message], VLM_COMPLETION_TOKENS),
+                    actual_tokens=response_tokens,
+                )
+            record_token_usage("vlm", response)
             vlm_text_response = response.content
-            logger.info(f"Groq VLM raw response: {vlm_text_response}")
-
-            # Parse the VLM's response
-            food_item = "Unknown Food"
-            description = vlm_text_response
-            vlm_nutritional_estimates = {}
-
-            # Robust parsing based on the structured format requested in the prompt
-            lines = vlm_text_response.split('\n')
-            for line in lines:
-                line = line.strip()
-                if line.lower().startswith("food item:"):
-                    food_item = line.split(":", 1)[-1].strip()
-                elif line.lower().startswith("calories:"):
-                    vlm_nutritional_estimates["calories"] = line.split(":", 1)[-1].strip()
-                elif line.lower().startswith("protein:"):
-                    vlm_nutritional_estimates["protein"] = line.split(":", 1)[-1].strip()
-                elif line.lower().startswith("carbohydrates:"):
-                    vlm_nutritional_estimates["carbohydrates"] = line.split(":", 1)[-1].strip()
-                elif line.lower().startswith("fat:"):
-                    vlm_nutritional_estimates["fat"] = line.split(":", 1)[-1].strip()
-            
-            # If food_item wasn't explicitly found, try to infer from first line or general description
-            if food_item == "Unknown Food" and lines:
-                first_line_content = lines[0].strip()
-                if first_line_content and not any(kw in first_line_content.lower() for kw in ["calories:", "protein:"]):
-                    possible_food = first_line_content.split(':', 1)[-1].strip() if ':' in first_line_content else first_line_content
-                    # Simple heuristic to avoid picking up long descriptions as food name
-                    if len(possible_food.split()) <= 10: 
-                        food_item = possible_food
-
-            return {
-                "food_item_vlm": food_item,
-                "description": vlm_text_response, # Keep full response for context
-                "vlm_nutritional_estimates": vlm_nutritional_estimates
-            }
+            logger.debug(f"Groq VLM raw response: {vlm_text_response}")
+            return self._parse_vlm_response(vlm_text_response)
+        except GroqRateLimitError:
+            # Over quota is not a parse failure; let the caller answer 503 instead of "Unknown Food".
+            raise
+        except Exception as e:
+            return self._failure_result(e)
+
+    async def _ainvoke(self, message: HumanMessage):
+        with track_stage("vlm"):
+            return await self.llm.ainvoke([message])
+
+    async def _astream(self, message: HumanMessage, on_food_item: Optional[Callable[[str], None]]):
+        """
+        Streams the VLM answer through a VLMLineParser, calling `on_food_item` with the
+        `Food Item:` line as soon as it has been generated. Returns the merged message.
+        """
+        parser = VLMLineParser()
+        response = None
+        start = time.perf_counter()
+
+        def emit(food_item: Optional[str]):
+            if food_item is None:
+                return
+            STAGE_SECONDS.labels("vlm_food_item").observe(time.perf_counter() - start)
+            if on_food_item is not None:
+                try:
+                    on_food_item(food_item)
+                except Exception:
+                    logger.exception("VLM food item callback failed.")
+
+        with track_stage("vlm"):
+            async for chunk in self.llm.astream([message]):
+                response = chunk if response is None else response + chunk
+                if isinstance(chunk.content, str):
+                    emit(parser.feed(chunk.content))
+            emit(parser.close())
+        if response is None:
+            raise ValueError("The VLM returned an empty stream.")
+        return response
 
+    async def analyze_image_with_vlm_async(self, image: Union[str, DecodedImage],
+                                           on_food_item: Optional[Callable[[str], None]] = None) -> Dict[str, Any]:
+        """
+        Async variant of analyze_image_with_vlm. Image encoding runs on the bounded CPU
+        executor and the Groq call is awaited, so the event loop is never blocked.
+
+        Args:
+            image: The path to the image file, or an in-memory upload.
+            on_food_item: Called from the event loop with the `Food Item:` line as soon as
+                          the VLM has generated it (streaming mode only), so that work such
+                          as nutrition lookups can start while the rest is generated.
+        """
+        logger.info(f"Analyzing image {self._describe(image)} with Groq VLM (async).")
+
+        try:
+            message = await run_in_cpu_executor(self._build_message, image)
+            response = await self.scheduler.run(
+                (lambda: self._astream(message, on_food_item)) if self.streaming else (lambda: self._ainvoke(message)),
+                estimate_tokens([message], VLM_COMPLETION_TOKENS),
+                actual_tokens=response_tokens,
+            )
+            record_token_usage("vlm", response)
+            vlm_text_response = response.content
+            logger.debug(f"Groq VLM raw response: {vlm_text_response}")
+            return self._parse_vlm_response(vlm_text_response)
+        except GroqRateLimitError:
+            raise
         except Exception as e:
-            logger.error(f"Error during VLM analysis or parsing: {e}")
-            return {
-                "food_item_vlm": "Unknown Food",
-                "description": f"Failed to analyze image with VLM: {e}",
-                "vlm_nutritional_estimates": {}
-            }
+            return self._failure_result(e)
@@ -0,0 +1,170 @@
+import base64
+import io
+import logging
+import math
+import os
+from typing import Tuple
+
+from PIL import Image, ImageOps
+
+from image_pipeline import DecodedImage
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = {
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+}
+
+
+class OptimizedPayload:
+    def __init__(self, data: bytes, mime_type: str, size: Tuple[int, int],
+                 original_bytes: int, estimated_tokens: int):
+        """
+        An image re-encoded for upload to the VLM.
+
+        Args:
+            data: The encoded image bytes.
+            mime_type: MIME type of `data`.
+            size: (width, height) of the encoded image.
+            original_bytes: Size of the image before optimization.
+            estimated_tokens: Approximate number of vision tokens the image will cost.
+        """
+        self.data = data
+        self.mime_type = mime_type
+        self.size = size
+        self.original_bytes = original_bytes
+        self.estimated_tokens = estimated_tokens
+
+    def to_data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{base64.b64encode(self.data).decode('utf-8')}"
+
+
+class ImagePayloadOptimizer:
+    def __init__(self, max_side: int = 1024, output_format: str = "JPEG", quality: int = 85,
+                 token_budget: int = 0, pixels_per_token: int = 784):
+        """
+        Downscales and recompresses images before they are sent to the VLM.
+
+        The longest side is capped at `max_side`, the image is re-encoded as JPEG or WebP at
+        `quality`, and EXIF metadata is dropped (after applying its orientation). When
+        `token_budget` is set, the image is shrunk further until its estimated vision-token
+        cost fits the budget.
+
+        Uploads that already meet these limits, such as images the frontend has resized
+        and re-encoded in the browser, are forwarded as they are without being decoded.
+
+        Args:
+            max_side: Maximum length of the longest side in pixels; 0 disables the cap.
+            output_format: "JPEG" or "WEBP".
+            quality: Encoder quality (1-95).
+            token_budget: Maximum estimated vision tokens per image; 0 disables the budget.
+            pixels_per_token: Pixel area the provider bills as one vision token. This is an
+                              approximation; the default corresponds to 28x28 patches.
+        """
+        output_format = output_format.upper()
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported VLM image format {output_format}. "
+                             f"Only {', '.join(OUTPUT_FORMATS)} are allowed.")
+        self.max_side = max_side
+        self.output_format = output_format
+        self.quality = quality
+        self.token_budget = token_budget
+        self.pixels_per_token = pixels_per_token
+
+    @classmethod
+    def from_env(cls) -> "ImagePayloadOptimizer":
+        """
+        Builds an optimizer configured from VLM_IMAGE_* environment variables.
+        """
+        return cls(
+            max_side=int(os.environ.get("VLM_IMAGE_MAX_SIDE", "1024")),
+            output_format=os.environ.get("VLM_IMAGE_FORMAT", "JPEG"),
+            quality=int(os.environ.get("VLM_IMAGE_QUALITY", "85")),
+            token_budget=int(os.environ.get("VLM_IMAGE_TOKEN_BUDGET", "0")),
+            pixels_per_token=int(os.environ.get("VLM_IMAGE_PIXELS_PER_TOKEN", "784")),
+        )
+
+    def estimate_tokens(self, size: Tuple[int, int]) -> int:
+        return math.ceil(size[0] * size[1] / self.pixels_per_token)
+
+    def target_size(self, size: Tuple[int, int]) -> Tuple[int, int]:
+        """
+        Returns the output size for an image of `size`, preserving its aspect ratio.
+        """
+        width, height = size
+        scale = 1.0
+        if self.max_side and max(width, height) > self.max_side:
+            scale = self.max_side / max(width, height)
+        if self.token_budget:
+            max_pixels = self.token_budget * self.pixels_per_token
+            if width * height * scale * scale > max_pixels:
+                scale = math.sqrt(max_pixels / (width * height))
+        return max(1, int(width * scale)), max(1, int(height * scale))
+
+    def is_compliant(self, image: DecodedImage) -> bool:
+        """
+        Returns whether an upload can be sent unchanged: already in the output format and
+        within the size limits, in a plain colour mode, without EXIF metadata, and no larger
+        than a typical encode at this size (4 bits per pixel).
+        """
+        width, height = image.size
+        return (image.format == self.output_format
+                and image.mode in ("RGB", "L")
+                and not image.has_exif
+                and self.target_size(image.size) == image.size
+                and len(image.raw_bytes) * 2 <= width * height)
+
+    def optimize(self, image: DecodedImage) -> OptimizedPayload:
+        """
+        Produces the VLM upload payload for an in-memory image.
+        """
+        if self.is_compliant(image):
+            payload = OptimizedPayload(
+                data=image.raw_bytes,
+                mime_type=OUTPUT_FORMATS[self.output_format],
+                size=image.size,
+                original_bytes=len(image.raw_bytes),
+                estimated_tokens=self.estimate_tokens(image.size),
+            )
+            logger.info(f"VLM payload for {image.filename}: {image.size[0]}x{image.size[1]} "
+                        f"{len(image.raw_bytes)} bytes forwarded unchanged "
+                        f"({self.output_format}, ~{payload.estimated_tokens} vision tokens)")
+            return payload
+
+        if image.format == "JPEG":
+            # Decode at a reduced DCT scale when the target is much smaller than the original.
+            img = Image.open(io.BytesIO(image.raw_bytes))
+            img.draft("RGB", self.target_size(image.size))
+        else:
+            img = image.image
+
+        img = ImageOps.exif_transpose(img)
+        target = self.target_size(img.size)
+        if img.mode in ("RGBA", "LA", "P"):
+            # Flatten transparency onto white, since JPEG has no alpha channel.
+            rgba = img.convert("RGBA")
+            background = Image.new("RGB", rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            img = background
+        else:
+            img = img.convert("RGB")
+        if img.size != target:
+            img = img.resize(target, Image.LANCZOS)
+
+        buffer = io.BytesIO()
+        # No exif= argument is passed, so no metadata is written.
+        img.save(buffer, format=self.output_format, quality=self.quality, optimize=True)
+        data = buffer.getvalue()
+
+        payload = OptimizedPayload(
+            data=data,
+            mime_type=OUTPUT_FORMATS[self.output_format],
+            size=img.size,
+            original_bytes=len(image.raw_bytes),
+            estimated_tokens=self.estimate_tokens(img.size),
+        )
+        logger.info(f"VLM payload for {image.filename}: {image.size[0]}x{image.size[1]} "
+                    f"{len(image.raw_bytes)} bytes -> {img.size[0]}x{img.size[1]} {len(data)} bytes "
+                    f"({self.output_format}, ~{payload.estimated_tokens} vision tokens)")
+        return payload
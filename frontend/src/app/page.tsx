@@ -1,17 +1,21 @@
 'use client';
 
-import React, { useState } from 'react';
+import React, { useRef, useState } from 'react';
 import ImageUpload from '../components/ImageUpload';
 import AnalysisResult from '../components/AnalysisResult';
+import { streamAnalysis, StreamedAnalysis } from '../lib/analysisStream';
+import { prepareImageUpload } from '../lib/prepareUpload';
 import { motion, AnimatePresence } from 'framer-motion';
 import { ShieldCheck, Info, Terminal, LayoutDashboard, Database } from 'lucide-react';
 
 export default function Home() {
-  const [analysisResult, setAnalysisResult] = useState<any>(null);
+  const [analysisResult, setAnalysisResult] = useState<StreamedAnalysis | null>(null);
   const [loading, setLoading] = useState<boolean>(false);
   const [error, setError] = useState<string | null>(null);
   const [selectedFile, setSelectedFile] = useState<File | null>(null);
   const [imageUrl, setImageUrl] = useState<string | null>(null);
+  // Resizing starts as soon as an image is selected, so it is usually done before Analyze is pressed.
+  const preparedUpload = useRef<Promise<File> | null>(null);
 
   const handleAnalyze = async () => {
     if (!selectedFile) return;
@@ -20,23 +24,15 @@ export default function Home() {
     setError(null);
     setAnalysisResult(null);
 
-    const formData = new FormData();
-    formData.append('file', selectedFile);
-
     try {
-      const response = await fetch('http://localhost:8000/api/analyze', {
-        method: 'POST',
-        body: formData,
-      });
-
-      if (!response.ok) {
-        const errorData = await response.json().catch(() => ({}));
-        throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
-      }
+      const upload = await (preparedUpload.current ?? prepareImageUpload(selectedFile));
+      const formData = new FormData();
+      formData.append('file', upload, upload.name);
 
-      const data = await response.json();
-      setAnalysisResult(data);
+      // Render each pipeline stage as soon as the server reports it.
+      await streamAnalysis('http://localhost:8000/api/analyze/stream', formData, setAnalysisResult);
     } catch (e: any) {
+      setAnalysisResult(null);
       setError(e.message);
     } finally {
       setLoading(false);
@@ -46,11 +42,13 @@ export default function Home() {
   const handleImageUpload = (file: File) => {
     setSelectedFile(file);
     setImageUrl(URL.createObjectURL(file));
+    preparedUpload.current = prepareImageUpload(file);
   };
 
   const handleClear = () => {
     setSelectedFile(null);
     setImageUrl(null);
+    preparedUpload.current = null;
     setAnalysisResult(null);
     setError(null);
   };
@@ -144,7 +142,7 @@ export default function Home() {
             <div className="absolute top-0 left-0 w-full h-full border-2 border-white/5 border-dashed rounded-sm -z-10" />
             
             <AnimatePresence mode="wait">
-              {analysisResult ? (
+              {analysisResult && analysisResult.stage !== 'detecting' ? (
                 <AnalysisResult key="result" data={analysisResult} />
               ) : loading ? (
                 <motion.div 
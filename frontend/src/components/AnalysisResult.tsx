@@ -3,22 +3,35 @@
 import React from 'react';
 import { motion } from 'framer-motion';
 import { ShieldCheck, Zap, Receipt, Barcode } from 'lucide-react';
+import { StreamedAnalysis } from '../lib/analysisStream';
 
 interface AnalysisResultProps {
-  data: {
-    food_item: string;
-    details: { [key: string]: any };
-  };
+  data: StreamedAnalysis;
 }
 
 const AnalysisResult: React.FC<AnalysisResultProps> = ({ data }) => {
-  const { food_item, details } = data;
+  const { food_item, details, items, lookups, stage } = data;
+  const complete = stage === 'complete';
 
-  // Extract total calories (massive display)
+  // Extract total calories (massive display); totals stay pending until the final event
+  const pending = complete ? 'N/A' : '...';
   const calories = details?.Calories || '---';
-  const protein = details?.Protein || 'N/A';
-  const carbs = details?.Carbohydrates || 'N/A';
-  const fat = details?.Fat || 'N/A';
+  const protein = details?.Protein || pending;
+  const carbs = details?.Carbohydrates || pending;
+  const fat = details?.Fat || pending;
+
+  // Per-item USDA lookups, in the order the VLM listed the items. The agent may look up
+  // names the VLM did not list verbatim; those are appended as they arrive.
+  const listed = items.map((item) => item.toLowerCase());
+  const lineItems = [
+    ...items.map((item) => ({
+      item,
+      lookup: lookups.find((l) => l.item.toLowerCase() === item.toLowerCase()),
+    })),
+    ...lookups
+      .filter((l) => !listed.includes(l.item.toLowerCase()))
+      .map((lookup) => ({ item: lookup.item, lookup })),
+  ];
 
   const date = new Date().toLocaleDateString('en-US', {
     year: 'numeric',
@@ -64,9 +77,27 @@ const AnalysisResult: React.FC<AnalysisResultProps> = ({ data }) => {
       <div className="space-y-6 mb-8">
         <div className="flex justify-between items-end border-b border-black/10 pb-2">
           <span className="text-xs font-mono text-black/40">IDENT_TARGET:</span>
-          <span className="text-xl font-bold uppercase truncate max-w-[200px]">{food_item}</span>
+          <span className={`text-xl font-bold uppercase truncate max-w-[200px] ${food_item ? '' : 'animate-pulse text-black/40'}`}>
+            {food_item || 'IDENTIFYING...'}
+          </span>
         </div>
 
+        {/* Per-item Lookups (streamed as each USDA lookup finishes) */}
+        {lineItems.length > 0 && (
+          <div className="space-y-1">
+            <div className="text-[10px] font-mono text-black/40 uppercase">LINE_ITEMS // PER_100G</div>
+            {lineItems.map(({ item, lookup }) => (
+              <div key={item} className="flex justify-between items-center text-xs font-mono">
+                <span className="uppercase truncate max-w-[180px]">{item}</span>
+                <span className="border-b border-dotted border-black/20 grow mx-4 h-3" />
+                <span className={lookup ? '' : 'animate-pulse text-black/40'}>
+                  {lookup ? lookup.details?.calories || 'N/A' : 'LOOKUP...'}
+                </span>
+              </div>
+            ))}
+          </div>
+        )}
+
         {/* Nutritional Breakdown */}
         <div className="space-y-2 py-4">
           <div className="flex justify-between items-center text-sm font-mono">
@@ -89,7 +120,7 @@ const AnalysisResult: React.FC<AnalysisResultProps> = ({ data }) => {
         {/* The Grand Total */}
         <div className="text-center py-6 border-y-4 border-black border-double">
           <div className="text-[10px] font-mono font-bold tracking-widest text-black/60 uppercase mb-2">CALORIC_INTAKE_ESTIMATE</div>
-          <div className="text-8xl font-black italic tracking-tighter leading-none">{calories.toString().replace(' kcal', '').replace(' KCAL', '')}</div>
+          <div className={`text-8xl font-black italic tracking-tighter leading-none ${complete ? '' : 'animate-pulse text-black/30'}`}>{calories.toString().replace(' kcal', '').replace(' KCAL', '')}</div>
           <div className="text-sm font-bold uppercase mt-2 italic">KiloCalories</div>
         </div>
       </div>
@@ -127,7 +158,9 @@ const AnalysisResult: React.FC<AnalysisResultProps> = ({ data }) => {
               ))}
             </div>
           </div>
-          <div className="text-[8px] font-mono mt-2 tracking-[0.5em] text-black/40 uppercase">DATA_TRANSMISSION_COMPLETE</div>
+          <div className="text-[8px] font-mono mt-2 tracking-[0.5em] text-black/40 uppercase">
+            {complete ? 'DATA_TRANSMISSION_COMPLETE' : 'DATA_TRANSMISSION_IN_PROGRESS'}
+          </div>
         </div>
       </div>
 
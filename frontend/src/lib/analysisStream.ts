@@ -0,0 +1,107 @@
+export interface NutritionLookup {
+  item: string;
+  summary: string;
+  details: { [key: string]: string };
+}
+
+export interface StreamedAnalysis {
+  stage: 'detecting' | 'identifying' | 'looking_up' | 'complete';
+  food_item?: string;
+  items: string[];
+  lookups: NutritionLookup[];
+  vlm_nutritional_estimates?: { [key: string]: string };
+  details?: { [key: string]: any };
+  cached?: boolean;
+}
+
+type AnalysisEvent = { event: string; data: any };
+
+// Splits a text/event-stream body into { event, data } records.
+async function* readServerSentEvents(body: ReadableStream<Uint8Array>): AsyncGenerator<AnalysisEvent> {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      const block = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf('\n\n');
+
+      let event = 'message';
+      const dataLines: string[] = [];
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) dataLines.push(line.slice(5).trim());
+      }
+      if (dataLines.length) {
+        yield { event, data: JSON.parse(dataLines.join('\n')) };
+      }
+    }
+  }
+}
+
+/**
+ * Posts an image to the streaming analysis endpoint and reports the partial result
+ * after every server event. Resolves with the final result, or throws on an `error` event.
+ */
+export async function streamAnalysis(
+  apiUrl: string,
+  formData: FormData,
+  onUpdate: (analysis: StreamedAnalysis) => void,
+): Promise<StreamedAnalysis> {
+  const response = await fetch(apiUrl, {
+    method: 'POST',
+    body: formData,
+    headers: { Accept: 'text/event-stream' },
+  });
+
+  if (!response.ok || !response.body) {
+    const errorData = await response.json().catch(() => ({}));
+    throw new Error(errorData.detail || `HTTP error! status: ${response.status}`);
+  }
+
+  let analysis: StreamedAnalysis = { stage: 'detecting', items: [], lookups: [] };
+
+  for await (const { event, data } of readServerSentEvents(response.body)) {
+    switch (event) {
+      case 'detection':
+        analysis = { ...analysis, stage: 'identifying' };
+        break;
+      case 'vlm':
+        analysis = {
+          ...analysis,
+          stage: 'looking_up',
+          food_item: data.food_item,
+          items: data.items || [],
+          vlm_nutritional_estimates: data.vlm_nutritional_estimates,
+        };
+        break;
+      case 'nutrition_item':
+        analysis = { ...analysis, lookups: [...analysis.lookups, data] };
+        break;
+      case 'result':
+        analysis = {
+          ...analysis,
+          stage: 'complete',
+          food_item: data.food_item,
+          details: data.details,
+          cached: data.cached,
+        };
+        break;
+      case 'error':
+        throw new Error(data.detail || 'Analysis failed.');
+    }
+    onUpdate(analysis);
+  }
+
+  if (analysis.stage !== 'complete') {
+    throw new Error('The analysis stream ended before a result was received.');
+  }
+  return analysis;
+}
@@ -0,0 +1,55 @@
+export interface ResizeOptions {
+  maxDimension: number;
+  quality: number;
+}
+
+export interface ResizedImage {
+  blob: Blob;
+  width: number;
+  height: number;
+  downscaled: boolean;
+}
+
+// Decodes an image, applying its EXIF orientation, scales it so the longest side is at most
+// `maxDimension`, and re-encodes it as JPEG without metadata. Transparent areas are filled
+// with white, as the backend does before sending images to the VLM.
+// Runs inside the resize worker, or on the main thread where OffscreenCanvas is missing.
+export async function downscaleImage(source: Blob, { maxDimension, quality }: ResizeOptions): Promise<ResizedImage> {
+  const bitmap = await createImageBitmap(source, { imageOrientation: 'from-image' });
+  const scale = Math.min(1, maxDimension / Math.max(bitmap.width, bitmap.height));
+  const width = Math.max(1, Math.round(bitmap.width * scale));
+  const height = Math.max(1, Math.round(bitmap.height * scale));
+
+  let canvas: OffscreenCanvas | HTMLCanvasElement;
+  let context: OffscreenCanvasRenderingContext2D | CanvasRenderingContext2D | null;
+  if (typeof OffscreenCanvas !== 'undefined') {
+    const offscreen = new OffscreenCanvas(width, height);
+    context = offscreen.getContext('2d');
+    canvas = offscreen;
+  } else {
+    const element = Object.assign(document.createElement('canvas'), { width, height });
+    context = element.getContext('2d');
+    canvas = element;
+  }
+  if (!context) {
+    bitmap.close();
+    throw new Error('Canvas 2D context is unavailable.');
+  }
+  context.fillStyle = '#fff';
+  context.fillRect(0, 0, width, height);
+  context.imageSmoothingQuality = 'high';
+  context.drawImage(bitmap, 0, 0, width, height);
+  bitmap.close();
+
+  // HTMLCanvasElement is not defined inside workers, so test for the method instead.
+  let blob: Blob;
+  if ('convertToBlob' in canvas) {
+    blob = await canvas.convertToBlob({ type: 'image/jpeg', quality });
+  } else {
+    const element = canvas;
+    blob = await new Promise<Blob>((resolve, reject) =>
+      element.toBlob((result) => (result ? resolve(result) : reject(new Error('Image encoding failed.'))), 'image/jpeg', quality));
+  }
+
+  return { blob, width, height, downscaled: scale < 1 };
+}
@@ -0,0 +1,17 @@
+import { downscaleImage, ResizeOptions } from './imageResize';
+
+type ResizeRequest = { id: number; file: Blob; options: ResizeOptions };
+
+const scope = self as unknown as {
+  onmessage: ((event: MessageEvent<ResizeRequest>) => void) | null;
+  postMessage: (message: unknown) => void;
+};
+
+// Decoding and encoding happen here, so large photos do not block the UI thread.
+scope.onmessage = async ({ data: { id, file, options } }) => {
+  try {
+    scope.postMessage({ id, result: await downscaleImage(file, options) });
+  } catch (e: any) {
+    scope.postMessage({ id, error: e?.message || 'Image resizing failed.' });
+  }
+};
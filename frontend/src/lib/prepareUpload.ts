@@ -0,0 +1,68 @@
+import { downscaleImage, ResizeOptions, ResizedImage } from './imageResize';
+
+// Longest side, in pixels, of uploaded images; 0 uploads originals unchanged. The default
+// matches the backend's VLM_IMAGE_MAX_SIDE, so resized uploads are forwarded to the VLM as-is.
+const MAX_DIMENSION = Number(process.env.NEXT_PUBLIC_UPLOAD_MAX_DIMENSION ?? 1024);
+// JPEG quality between 0 and 1.
+const QUALITY = Number(process.env.NEXT_PUBLIC_UPLOAD_QUALITY ?? 0.85);
+
+type ResizeResponse = { id: number; result?: ResizedImage; error?: string };
+
+let worker: Worker | null = null;
+let nextRequestId = 0;
+const pendingRequests = new Map<number, { resolve: (result: ResizedImage) => void; reject: (error: Error) => void }>();
+
+function getWorker(): Worker | null {
+  if (worker === null && typeof Worker !== 'undefined' && typeof OffscreenCanvas !== 'undefined') {
+    try {
+      worker = new Worker(new URL('./imageResize.worker.ts', import.meta.url));
+      worker.onmessage = ({ data }: MessageEvent<ResizeResponse>) => {
+        const pending = pendingRequests.get(data.id);
+        pendingRequests.delete(data.id);
+        if (data.result) pending?.resolve(data.result);
+        else pending?.reject(new Error(data.error));
+      };
+      worker.onerror = () => {
+        // The worker script failed; fail the queued requests so their originals are uploaded.
+        pendingRequests.forEach(({ reject }) => reject(new Error('The image resize worker failed.')));
+        pendingRequests.clear();
+      };
+    } catch {
+      worker = null;
+    }
+  }
+  return worker;
+}
+
+function resizeInBackground(file: File, options: ResizeOptions): Promise<ResizedImage> {
+  const resizeWorker = getWorker();
+  if (!resizeWorker) {
+    // Browsers without OffscreenCanvas in workers resize on the main thread instead.
+    return downscaleImage(file, options);
+  }
+  const id = nextRequestId++;
+  return new Promise((resolve, reject) => {
+    pendingRequests.set(id, { resolve, reject });
+    resizeWorker.postMessage({ id, file, options });
+  });
+}
+
+/**
+ * Downscales and re-encodes a selected image before upload, so phone photos travel as a
+ * few hundred kilobytes instead of several megabytes. Falls back to the original file if
+ * resizing is disabled, the browser cannot decode the image, or re-encoding would not
+ * make it smaller.
+ */
+export async function prepareImageUpload(file: File): Promise<File> {
+  if (!(MAX_DIMENSION > 0) || !file.type.startsWith('image/')) return file;
+
+  try {
+    const { blob, downscaled } = await resizeInBackground(file, { maxDimension: MAX_DIMENSION, quality: QUALITY });
+    if (!downscaled && blob.size >= file.size) return file;
+    const name = file.name.replace(/\.[^.]*$/, '') + '.jpg';
+    return new File([blob], name, { type: 'image/jpeg', lastModified: file.lastModified });
+  } catch (e) {
+    console.warn('Uploading the original image; resizing failed:', e);
+    return file;
+  }
+}